@@ -3,6 +3,21 @@ SmartVision Flask API 后端服务
 提供视频批量处理和智能分析接口
 """
 
+import time
+
+# 启动耗时统计：各阶段（导入/初始化）耗时，启动后打印并在 /api/health 的 startup 字段中返回
+_startup_began = time.perf_counter()
+_startup_last = [_startup_began]
+STARTUP_TIMINGS = {}
+
+
+def record_startup_stage(stage):
+    """记录从上一阶段结束到现在的耗时"""
+    now = time.perf_counter()
+    STARTUP_TIMINGS[stage] = round(now - _startup_last[0], 3)
+    _startup_last[0] = now
+
+
 # 加载环境变量（支持.env文件）
 try:
     from dotenv import load_dotenv
@@ -10,46 +25,82 @@ try:
 except ImportError:
     # 如果没有安装python-dotenv，跳过（可以使用系统环境变量）
     pass
+record_startup_stage('dotenv')
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 from PIL import Image
 import tempfile
 import os
 import io
-import base64
-import pandas as pd
+import json
+import queue
 from datetime import datetime
-from config import MODEL_TYPE, MODEL_CONFIG
+record_startup_stage('import_flask_pillow')
+from config import (MODEL_TYPE, BATCH_WORKER_COUNT, JOB_STORE_ENABLED, JOB_STORE_PATH,
+                    SSE_KEEPALIVE_SECONDS, INGEST_ALLOWED_ROOTS, ensure_temp_dir)
+record_startup_stage('import_config')
 from model_manager import ModelManager
+from batch_jobs import BatchJobManager, is_error_result
+from job_store import JobStore
+from upload_stream import parse_boundary, stream_multipart
+from path_ingest import collect_video_items, normalize_roots
+from dataset_catalog import parse_dataset_path
+record_startup_stage('import_model_manager')
 
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
 
-# 初始化模型管理器
-print(f"正在初始化 {MODEL_TYPE} 模型...")
+# 初始化模型管理器（提供商SDK、Moondream在首次请求时初始化）
+ensure_temp_dir()
 try:
     model_manager = ModelManager()
-    print(f"✓ {MODEL_TYPE} 模型初始化成功")
+    print(f"✓ 模型管理器已创建: {MODEL_TYPE}（首次请求时初始化模型）")
 except Exception as e:
     print(f"❌ 模型初始化失败: {e}")
     model_manager = None
+record_startup_stage('create_model_manager')
 
 # 创建上传文件夹
 UPLOAD_FOLDER = 'uploads'
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
-# 批量处理状态管理（全局）
-batch_processing_status = {
-    'is_paused': False,
-    'is_processing': False,
-    'current_file': '',
-    'current_index': 0,
-    'total_files': 0,
-    'current_city': '',
-    'total_cities': 0
-}
+# 批量任务管理器（在导出函数定义后初始化，见文件末尾）
+job_manager = None
+
+
+def parse_video_options(form):
+    """
+    解析视频查询策略参数（表单字段均可选，未提供时使用配置默认值）
+    - video_strategy: video / frames
+    - frame_count / frame_size / frame_method: 抽帧数量、最长边像素、采样方式（scene / uniform）
+    参数无效时抛出 ValueError
+    """
+    options = {}
+    strategy = form.get('video_strategy', '').strip()
+    if strategy:
+        if strategy not in ('video', 'frames'):
+            raise ValueError(f"video_strategy 只能为 video 或 frames: {strategy}")
+        options['strategy'] = strategy
+    
+    for field, low, high in (('frame_count', 1, 32), ('frame_size', 64, 2048)):
+        value = form.get(field, '').strip()
+        if value:
+            try:
+                number = int(value)
+            except ValueError:
+                raise ValueError(f"{field} 必须为整数: {value}")
+            if not low <= number <= high:
+                raise ValueError(f"{field} 必须在 {low}-{high} 之间: {number}")
+            options[field] = number
+    
+    frame_method = form.get('frame_method', '').strip()
+    if frame_method:
+        if frame_method not in ('scene', 'uniform'):
+            raise ValueError(f"frame_method 只能为 scene 或 uniform: {frame_method}")
+        options['frame_method'] = frame_method
+    return options
 
 
 @app.route('/api/health', methods=['GET'])
@@ -65,10 +116,28 @@ def health_check():
         'model_type': MODEL_TYPE,
         'moondream_loaded': model_manager.moondream_model is not None if model_manager else False,
         'video_support': video_support_info,
-        'current_model_supports_video': video_support_info.get(MODEL_TYPE, {}).get('supported', False)
+        'current_model_supports_video': video_support_info.get(MODEL_TYPE, {}).get('supported', False),
+        'providers': model_manager.get_router_status() if model_manager else {},
+        'rate_limits': model_manager.get_rate_limit_status() if model_manager else {},
+        'response_cache': model_manager.get_cache_status() if model_manager else {},
+        'transcode_cache': model_manager.get_transcode_cache_status() if model_manager else {},
+        'compression': model_manager.get_compression_status() if model_manager else {},
+        'encoder': model_manager.get_encoder_status() if model_manager else {},
+        'job_store': job_manager.store.get_stats() if job_manager and job_manager.store else {'enabled': False},
+        'path_ingest': {'enabled': bool(INGEST_ALLOWED_ROOTS), 'allowed_roots': INGEST_ALLOWED_ROOTS},
+        'startup': get_startup_report()
     })
 
 
+def get_startup_report():
+    """启动各阶段耗时和模型延迟初始化状态"""
+    return {
+        'timings': dict(STARTUP_TIMINGS),
+        'total_seconds': round(sum(STARTUP_TIMINGS.values()), 3),
+        'lazy_init': model_manager.get_init_status() if model_manager else {},
+    }
+
+
 @app.route('/api/query', methods=['POST'])
 def query_image():
     """
@@ -158,6 +227,14 @@ def video_query():
                 'error': '未提供问题'
             }), 400
         
+        try:
+            video_options = parse_video_options(request.form)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
         # 读取视频文件
         video_file = request.files['video']
         
@@ -167,32 +244,18 @@ def video_query():
         
         # 创建临时文件 - 使用配置的临时目录
         with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4', dir=TEMP_DIR) as tmp_file:
-            file_storage.save(tmp_file.name)
+            video_file.save(tmp_file.name)
             tmp_video_path = tmp_file.name
         
         try:
             # 调用模型API直接处理视频
             print(f"收到视频问题: {question}")
-            result = model_manager.query_video(tmp_video_path, question)
+            result = model_manager.query_video(tmp_video_path, question, **video_options)
             
-            # 检查是否有错误
-            has_error = 'error' in result and result.get('error')
             answer = result.get('answer', '未能生成答案')
             
-            # 检测错误关键词
-            error_keywords = ['失败', '错误', '连接失败', 'API连接失败', '处理失败', 
-                             '未初始化', '不支持', 'ProxyError', 'ConnectionResetError',
-                             '代理问题', '连接被', '强制关闭', '通义千问API连接失败',
-                             'InternalError', 'Algo', 'model_dump', '500', '内部算法错误', 
-                             'API内部算法错误', '算法错误']
-            
-            # 判断是否为错误
-            is_error = has_error
-            if not is_error and isinstance(answer, str):
-                answer_lower = answer.lower()
-                is_error = any(keyword.lower() in answer_lower or keyword in answer for keyword in error_keywords)
-            
-            if is_error:
+            # 判断是否为错误（error字段或错误关键词）
+            if is_error_result(result):
                 print(f"API调用失败: {result.get('error', answer[:100])}")
                 return jsonify({
                     'success': False,
@@ -379,29 +442,59 @@ def batch_query():
 def batch_control():
     """
     批量处理控制接口
-    - 暂停/恢复批量处理
+    - 指定 job_id 时暂停/恢复/取消该任务（action: pause / resume / cancel），不影响其他任务
+    - 未指定 job_id 时暂停/恢复所有批量处理
     """
-    global batch_processing_status
     try:
-        data = request.get_json()
-        action = data.get('action', '')  # 'pause' 或 'resume'
+        data = request.get_json() or {}
+        action = data.get('action', '')  # 'pause' / 'resume' / 'cancel'
+        job_id = data.get('job_id')
+        
+        if job_id:
+            controls = {
+                'pause': (job_manager.pause_job, '已暂停'),
+                'resume': (job_manager.resume_job, '已恢复'),
+                'cancel': (job_manager.cancel_job, '已取消'),
+            }
+            if action not in controls:
+                return jsonify({
+                    'success': False,
+                    'error': f'未知的操作: {action}'
+                }), 400
+            control, message = controls[action]
+            job = control(job_id)
+            if job is None:
+                return jsonify({
+                    'success': False,
+                    'error': f'任务不存在: {job_id}'
+                }), 404
+            return jsonify({
+                'success': True,
+                'message': f'批量任务{message}',
+                'status': job.to_dict(include_results=False)
+            })
         
         if action == 'pause':
-            batch_processing_status['is_paused'] = True
+            job_manager.pause_all()
             print("⏸️  批量处理已暂停")
             return jsonify({
                 'success': True,
                 'message': '批量处理已暂停',
-                'status': batch_processing_status
+                'status': job_manager.get_status()
             })
         elif action == 'resume':
-            batch_processing_status['is_paused'] = False
+            job_manager.resume_all()
             print("▶️  批量处理已恢复")
             return jsonify({
                 'success': True,
                 'message': '批量处理已恢复',
-                'status': batch_processing_status
+                'status': job_manager.get_status()
             })
+        elif action == 'cancel':
+            return jsonify({
+                'success': False,
+                'error': '取消操作需要指定 job_id'
+            }), 400
         else:
             return jsonify({
                 'success': False,
@@ -419,11 +512,30 @@ def batch_control():
 def batch_status():
     """
     获取批量处理状态接口
+    返回所有未结束任务的汇总状态，jobs 字段列出每个任务的状态
+    """
+    return jsonify({
+        'success': True,
+        'status': job_manager.get_status()
+    })
+
+
+@app.route('/api/batch-status/<job_id>', methods=['GET'])
+def batch_job_status(job_id):
+    """
+    获取单个批量任务的状态接口
+    返回任务状态、成功/失败/取消计数、正在处理的视频和耗时统计（不含分析结果）
     """
-    global batch_processing_status
+    job = job_manager.get_job(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': f'任务不存在: {job_id}'
+        }), 404
+    
     return jsonify({
         'success': True,
-        'status': batch_processing_status
+        'status': job.to_dict(include_results=False)
     })
 
 
@@ -432,250 +544,263 @@ def video_batch_query():
     """
     批量视频直接处理接口
     - 接收多个视频文件（表单字段名：videos）与问题
-    - 直接处理每个视频文件，不抽帧
-    - 支持按城市分组实时导出Excel文件
-    - 返回每个视频的分析结果
+    - 流式解析上传：每个视频接收完整后直接写入临时文件并立即入队，上传和处理同时进行
+      （问题和查询参数等表单字段需放在视频文件之前，否则视频在上传结束后才入队）
+    - 上传结束后返回任务ID，由后台工作线程池并发处理
+    - 每个视频处理完成后实时导出Excel文件
+    - 通过 /api/video-batch-jobs/<job_id> 查询进度和每个视频的分析结果
     """
+    print("收到批量视频直接处理请求")
+    
+    if model_manager is None:
+        print("模型未初始化")
+        return jsonify({
+            'success': False,
+            'error': '模型未初始化'
+        }), 500
+    
+    # 直接读取请求流，不访问 request.form / request.files（否则Flask会先解析完整个请求体）
+    boundary = parse_boundary(request.content_type)
+    if boundary is None:
+        return jsonify({
+            'success': False,
+            'error': '请求必须为 multipart/form-data'
+        }), 400
+    
+    from config import TEMP_DIR
+    form = {}
+    held = []  # 问题字段到达前已接收的视频，任务创建后再入队
+    state = {'job': None}
+    
+    def open_job():
+        question = form.get('question', '').strip()
+        # 检查是否需要跳过立即导出（由前端统一导出）
+        skip_export = form.get('skip_export', 'false').lower() == 'true'
+        # 视频查询策略（整段视频 / 抽帧），按任务配置；参数无效时抛出 ValueError
+        video_options = parse_video_options(form)
+        print(f"问题: {question}")
+        job = job_manager.open_job(question, skip_export, video_options)
+        state['job'] = job
+        while held:
+            job_manager.add_item(job, held.pop(0))
+    
+    def on_field(name, value):
+        form[name] = value
+    
+    def on_file(filename, path):
+        # 解析文件路径（大洲/国家/城市），提取城市信息
+        held.append({
+            'filename': filename,
+            'path': path,
+            'city': parse_dataset_path(filename)['city']
+        })
+        print(f"已接收文件: {filename}, 大小: {os.path.getsize(path)/1024/1024:.1f}MB")
+        if state['job'] is None and form.get('question', '').strip():
+            open_job()
+        elif state['job'] is not None:
+            job_manager.add_item(state['job'], held.pop(0))
+    
+    def discard():
+        """上传失败或参数无效：删除未入队的临时文件，已入队的视频随任务一起取消"""
+        for item in held:
+            try:
+                os.unlink(item['path'])
+            except OSError:
+                pass
+        held.clear()
+        if state['job'] is not None:
+            job_manager.cancel_job(state['job'].job_id)
+            job_manager.finish_upload(state['job'])
+    
     try:
-        print("收到批量视频直接处理请求")
+        file_count = stream_multipart(request.stream, boundary, 'videos', TEMP_DIR, on_field, on_file)
         
-        if model_manager is None:
-            print("模型未初始化")
-            return jsonify({
-                'success': False,
-                'error': '模型未初始化'
-            }), 500
-
-        # 校验视频文件
-        if 'videos' not in request.files:
+        if file_count == 0:
             print("未找到视频文件字段")
+            discard()
             return jsonify({
                 'success': False,
                 'error': '未找到视频文件（字段名应为 videos，可多选）'
             }), 400
-
-        question = request.form.get('question', '').strip()
-        if not question:
-            print("未提供问题")
-            return jsonify({
-                'success': False,
-                'error': '未提供问题'
-            }), 400
-        
-        # 检查是否需要跳过立即导出（由前端统一导出）
-        skip_export = request.form.get('skip_export', 'false').lower() == 'true'
-
-        files = request.files.getlist('videos')
-        print(f"收到 {len(files)} 个视频文件")
-        print(f"问题: {question}")
         
-        # 初始化批量处理状态
-        global batch_processing_status
-        batch_processing_status['is_processing'] = True
-        batch_processing_status['is_paused'] = False
-        batch_processing_status['total_files'] = len(files)
-        batch_processing_status['current_index'] = 0
-        batch_processing_status['current_file'] = ''
-        batch_processing_status['current_city'] = ''
+        if state['job'] is None:
+            if not form.get('question', '').strip():
+                print("未提供问题")
+                discard()
+                return jsonify({
+                    'success': False,
+                    'error': '未提供问题'
+                }), 400
+            open_job()
         
-        # 记录文件大小（不限制）
-        for file in files:
-            if file.content_length:
-                print(f"处理文件: {file.filename}, 大小: {file.content_length/1024/1024:.1f}MB")
+        job = state['job']
+        job_manager.finish_upload(job)
         
         # 如果文件数量很多，给出警告但不阻止处理
-        if len(files) > 100:
-            print(f"警告：检测到 {len(files)} 个文件，处理时间可能较长")
-
-        # 按城市分组处理视频
-        import os
-        city_groups = {}
-        for file_storage in files:
-            filename = file_storage.filename
-            # 解析文件路径，提取城市信息
-            file_dir = os.path.dirname(filename)
-            # 统一路径分隔符为正斜杠
-            file_dir = file_dir.replace(os.sep, '/')
-            path_parts = file_dir.split('/')
-            
-            # 智能提取城市名称
-            city_name = "未知城市"
-            if path_parts:
-                # 查找dataset或dataset_output在路径中的位置
-                dataset_index = -1
-                for i, part in enumerate(path_parts):
-                    if part == "dataset" or part == "dataset_output":
-                        dataset_index = i
-                        break
-                
-                if dataset_index != -1 and dataset_index + 3 < len(path_parts):
-                    # 从dataset/dataset_output开始：索引[0]=大洲, 索引[1]=国家, 索引[2]=城市
-                    city_name = path_parts[dataset_index + 3]
-                elif len(path_parts) >= 3:
-                    # 如果没有找到dataset/dataset_output，尝试直接使用路径结构
-                    # 假设路径格式为：大洲/国家/城市/...
-                    city_name = path_parts[2]  # 第三个部分应该是城市
-                else:
-                    # 如果路径不完整，使用最后一个部分作为备选
-                    city_name = path_parts[-1] if path_parts else "未知城市"
-                
-                # 从城市名中提取真正的城市名称（去掉年份前缀，如 "2023布里斯班" -> "布里斯班"）
-                import re
-                # 匹配开头是数字的模式，如 "2023布里斯班"
-                match = re.match(r'^\d+(.+)$', city_name)
-                if match:
-                    city_name = match.group(1)  # 提取城市名部分
-            
-            if city_name not in city_groups:
-                city_groups[city_name] = []
-            city_groups[city_name].append(file_storage)
-        
-        print(f"检测到 {len(city_groups)} 个城市组: {list(city_groups.keys())}")
-        
-        all_results = []
-        video_exports = []  # 改为存储每个视频的导出结果
-        batch_processing_status['total_cities'] = len(city_groups)
-        
-        # 按城市顺序处理
-        current_global_index = 0
-        for city_name, city_files in city_groups.items():
-            batch_processing_status['current_city'] = city_name
-            print(f"\n🏙️  开始处理城市: {city_name} (共 {len(city_files)} 个视频)")
-            
-            for i, file_storage in enumerate(city_files):
-                # 检查暂停状态
-                while batch_processing_status.get('is_paused', False):
-                    import time
-                    time.sleep(0.5)  # 暂停时每0.5秒检查一次
-                
-                # 更新当前处理状态
-                current_global_index += 1
-                batch_processing_status['current_index'] = current_global_index
-                batch_processing_status['current_file'] = file_storage.filename
-                
-                try:
-                    print(f"  处理第 {i+1}/{len(city_files)} 个视频: {file_storage.filename}")
-                    
-                    # 保存视频到临时文件
-                    import tempfile
-                    import os
-                    
-                    # 创建临时文件
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_file:
-                        file_storage.save(tmp_file.name)
-                        tmp_video_path = tmp_file.name
-                    
-                    try:
-                        # 直接处理视频
-                        result = model_manager.query_video(tmp_video_path, question)
-                        
-                        # 检查是否有错误
-                        has_error = 'error' in result and result.get('error')
-                        answer = result.get('answer', '未能生成答案')
-                        
-                        # 检测错误关键词（API失败的各种情况）
-                        error_keywords = ['失败', '错误', '连接失败', 'API连接失败', '处理失败', 
-                                         '未初始化', '不支持', 'ProxyError', 'ConnectionResetError',
-                                         '代理问题', '连接被', '强制关闭', '通义千问API连接失败',
-                                         'InternalError', 'Algo', 'model_dump', '500', '内部算法错误', 
-                                         'API内部算法错误', '算法错误']
-                        
-                        # 判断是否为错误
-                        is_error = has_error
-                        if not is_error and isinstance(answer, str):
-                            # 检查answer中是否包含错误关键词
-                            answer_lower = answer.lower()
-                            is_error = any(keyword.lower() in answer_lower or keyword in answer for keyword in error_keywords)
-                        
-                        if is_error:
-                            video_result = {
-                                'filename': file_storage.filename,
-                                'answer': answer,
-                                'success': False,
-                                'error': result.get('error', answer)  # 如果有error字段就用它，否则用answer作为错误信息
-                            }
-                            print(f"    ⚠️ API调用失败: {file_storage.filename}, 错误: {result.get('error', answer[:100])}")
-                        else:
-                            video_result = {
-                                'filename': file_storage.filename,
-                                'answer': answer,
-                                'success': True,
-                                'request_id': result.get('request_id', 'N/A')
-                            }
-                        all_results.append(video_result)
-                        
-                        print(f"    处理完成: {file_storage.filename}")
-                        
-                        # 每个视频处理完成后，立即导出Excel文件（除非指定跳过）
-                        if not skip_export:
-                            export_result = export_single_video_result(video_result)
-                            if export_result.get('success'):
-                                video_exports.append(export_result)
-                                print(f"    ✅ Excel文件已保存: {export_result.get('filepath', '未知路径')}")
-                            else:
-                                print(f"    ⚠️ Excel导出失败: {export_result.get('error', '未知错误')}")
-                        
-                        # 定期清理内存，每处理10个视频强制垃圾回收
-                        if current_global_index % 10 == 0:
-                            import gc
-                            gc.collect()
-                            print(f"    ✅ 已处理 {current_global_index} 个视频，执行内存清理")
-                    
-                    finally:
-                        # 清理临时文件
-                        try:
-                            os.unlink(tmp_video_path)
-                        except Exception as e:
-                            print(f"删除临时文件失败: {e}")
-                    
-                except Exception as e:
-                    print(f"处理视频文件 {file_storage.filename} 时发生错误: {str(e)}")
-                    video_result = {
-                        'filename': file_storage.filename,
-                        'answer': '',
-                        'success': False,
-                        'error': str(e)
-                    }
-                    all_results.append(video_result)
-                    
-                    # 即使失败也尝试导出Excel
-                    if not skip_export:
-                        export_result = export_single_video_result(video_result)
-                        if export_result.get('success'):
-                            video_exports.append(export_result)
-                    
-                    # 单个视频处理失败时继续处理下一个，不中断整个批次
-                    continue
-            
-            print(f"✅ 城市 {city_name} 处理完成，共 {len(city_files)} 个视频")
-        
-        # 处理完成，重置状态
-        batch_processing_status['is_processing'] = False
-        batch_processing_status['current_file'] = ''
-        batch_processing_status['current_index'] = 0
+        if job.total_files > 100:
+            print(f"警告：检测到 {job.total_files} 个文件，处理时间可能较长")
+        print(f"检测到 {job.total_cities} 个城市，任务ID: {job.job_id}")
         
         return jsonify({
             'success': True,
-            'question': question,
-            'total_files': len(files),
-            'total_cities': len(city_groups),
-            'results': all_results,
-            'video_exports': video_exports,
-            'message': f'批量处理完成，共处理 {len(files)} 个视频，每个视频已生成独立的Excel文件'
-        })
-        
+            'job_id': job.job_id,
+            'status': job.status,
+            'question': job.question,
+            'total_files': job.total_files,
+            'total_cities': job.total_cities,
+            'status_url': f'/api/video-batch-jobs/{job.job_id}',
+            'message': f'已提交批量任务，共 {job.total_files} 个视频，正在后台处理'
+        }), 202
+    
+    except ValueError as e:
+        # 查询参数无效或上传数据不完整
+        discard()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
     except Exception as e:
         print(f"批量视频直接处理错误: {str(e)}")
-        # 出错时也重置状态
-        batch_processing_status['is_processing'] = False
-        batch_processing_status['current_file'] = ''
-        batch_processing_status['current_index'] = 0
+        discard()
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
 
+@app.route('/api/video-batch-paths', methods=['POST'])
+def video_batch_paths():
+    """
+    服务器路径批量处理接口（JSON）
+    - root: 服务器上的视频目录（递归查找全部视频），或 paths: 视频路径清单（相对路径相对于 root）
+    - question: 问题；skip_export、video_strategy、frame_count、frame_size、frame_method 同 /api/video-batch-query
+    - 视频原地读取，不上传、不复制、处理后不删除；只允许读取 INGEST_ALLOWED_ROOTS 配置的目录
+    - 立即返回任务ID，由后台工作线程池并发处理
+    """
+    if model_manager is None:
+        return jsonify({
+            'success': False,
+            'error': '模型未初始化'
+        }), 500
+    
+    data = request.get_json(silent=True) or {}
+    question = str(data.get('question', '')).strip()
+    if not question:
+        return jsonify({
+            'success': False,
+            'error': '未提供问题'
+        }), 400
+    
+    root = data.get('root')
+    if root is not None and not isinstance(root, str):
+        return jsonify({
+            'success': False,
+            'error': 'root 必须为目录路径字符串'
+        }), 400
+    
+    paths = data.get('paths')
+    if paths is not None and (not isinstance(paths, list) or not all(isinstance(p, str) for p in paths)):
+        return jsonify({
+            'success': False,
+            'error': 'paths 必须为路径字符串列表'
+        }), 400
+    
+    skip_export = str(data.get('skip_export', 'false')).lower() == 'true'
+    try:
+        # 查询参数与表单接口一致，JSON中的数字转为字符串后解析
+        video_options = parse_video_options({key: str(value) for key, value in data.items()
+                                             if isinstance(value, (str, int, float))})
+        items = collect_video_items(normalize_roots(INGEST_ALLOWED_ROOTS), root, paths)
+    except PermissionError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 403
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    job = job_manager.submit(question, items, skip_export, video_options)
+    print(f"服务器路径批量任务: {job.total_files} 个视频，{job.total_cities} 个城市，任务ID: {job.job_id}")
+    
+    return jsonify({
+        'success': True,
+        'job_id': job.job_id,
+        'status': job.status,
+        'question': question,
+        'total_files': job.total_files,
+        'total_cities': job.total_cities,
+        'status_url': f'/api/video-batch-jobs/{job.job_id}',
+        'message': f'已提交批量任务，共 {job.total_files} 个视频，正在后台处理'
+    }), 202
+
+
+@app.route('/api/video-batch-jobs/<job_id>', methods=['GET'])
+def video_batch_job(job_id):
+    """
+    查询批量视频任务接口
+    返回任务状态、进度以及已完成视频的分析结果
+    """
+    job = job_manager.get_job(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': f'任务不存在: {job_id}'
+        }), 404
+    
+    data = job.to_dict(include_results=request.args.get('results', 'true').lower() != 'false')
+    data['success'] = True
+    return jsonify(data)
+
+
+@app.route('/api/video-batch-jobs/<job_id>/events', methods=['GET'])
+def video_batch_job_events(job_id):
+    """
+    批量视频任务事件流接口（Server-Sent Events）
+    连接后先推送 snapshot（当前状态和已有结果），之后实时推送：
+    - progress: 任务状态变化（开始处理某个视频、暂停/恢复/取消、计数和耗时）
+    - result: 单个视频的结果、导出信息和各阶段耗时（queue_wait / query / export / total）
+    - done: 任务结束（完成或取消），含全部结果，随后关闭连接
+    """
+    job = job_manager.get_job(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': f'任务不存在: {job_id}'
+        }), 404
+    
+    def format_event(event, data):
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    
+    def generate():
+        events, snapshot = job.subscribe()
+        try:
+            yield format_event('snapshot', snapshot)
+            if snapshot['finished_at'] is not None:
+                yield format_event('done', snapshot)
+                return
+            while True:
+                try:
+                    event, data = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # 注释行保活，避免代理因连接空闲而断开
+                    yield ': keepalive\n\n'
+                    continue
+                yield format_event(event, data)
+                if event == 'done':
+                    return
+        finally:
+            job.unsubscribe(events)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # 关闭Nginx缓冲，事件立即送达
+    })
+
+
 
 def export_single_video_result(video_result):
     """
@@ -702,6 +827,7 @@ def export_single_video_result(video_result):
         }]
         
         # 创建DataFrame
+        import pandas as pd  # 首次导出时才导入
         df = pd.DataFrame(excel_data)
         
         # 创建Excel文件
@@ -812,6 +938,7 @@ def export_city_results_immediately(city_results, city_name):
             })
         
         # 创建DataFrame
+        import pandas as pd  # 首次导出时才导入
         df = pd.DataFrame(excel_data)
         
         # 创建Excel文件
@@ -844,38 +971,11 @@ def export_city_results_immediately(city_results, city_name):
             elif file_dir.startswith('dataset_output/'):
                 file_dir = file_dir[15:]  # 去掉'dataset_output/'前缀
             
-            # 智能提取城市名称和构建路径
-            path_parts = file_dir.split('/')
-            actual_city_name = city_name  # 使用传入的城市名，如果已经正确解析
-            
-            # 如果传入的城市名无效，重新解析
-            if actual_city_name == "未知城市" or not actual_city_name:
-                # 查找dataset或dataset_output在路径中的位置（如果还有的话）
-                dataset_index = -1
-                for i, part in enumerate(path_parts):
-                    if part == "dataset" or part == "dataset_output":
-                        dataset_index = i
-                        break
-                
-                if dataset_index != -1 and dataset_index + 3 < len(path_parts):
-                    actual_city_name = path_parts[dataset_index + 3]
-                    file_dir = '/'.join(path_parts[dataset_index + 1:dataset_index + 4])
-                elif len(path_parts) >= 3:
-                    actual_city_name = path_parts[2]
-                    file_dir = '/'.join(path_parts[:3])
-                else:
-                    actual_city_name = path_parts[-1] if path_parts else "未知城市"
-            
-            # 从城市名中提取真正的城市名称（去掉年份前缀）
-            import re
-            match = re.match(r'^\d+(.+)$', actual_city_name)
-            if match:
-                actual_city_name = match.group(1)  # 提取城市名部分
-            
-            # 如果没有有效路径结构，使用默认
-            if not file_dir or file_dir == '/' or len(path_parts) < 3:
-                if len(path_parts) >= 3:
-                    file_dir = '/'.join(path_parts[:3])
+            # 传入的城市名无效时，按 大洲/国家/城市 目录结构重新解析输出目录
+            if city_name == "未知城市" or not city_name:
+                location = parse_dataset_path(first_file_path)['location']
+                if location:
+                    file_dir = location
             
             # 创建输出目录：在D:\无人机步态论文\data_anlyis下按照视频目录结构创建新目录
             # 例如：视频在 dataset/非洲/肯尼亚/内罗毕/walking.mp4
@@ -972,35 +1072,8 @@ def export_to_excel():
             
             if export_result.get('success'):
                 # 从视频文件名中提取城市名称（用于前端显示兼容）
-                import os
-                import re
                 video_filename = export_result.get('video_filename', '')
-                city_name = "未知城市"
-                
-                if video_filename:
-                    file_dir = os.path.dirname(video_filename)
-                    file_dir = file_dir.replace(os.sep, '/')
-                    path_parts = file_dir.split('/')
-                    
-                    if path_parts:
-                        # 查找dataset或dataset_output在路径中的位置
-                        dataset_index = -1
-                        for i, part in enumerate(path_parts):
-                            if part == "dataset" or part == "dataset_output":
-                                dataset_index = i
-                                break
-                        
-                        if dataset_index != -1 and dataset_index + 3 < len(path_parts):
-                            city_name = path_parts[dataset_index + 3]
-                        elif len(path_parts) >= 3:
-                            city_name = path_parts[2]
-                        else:
-                            city_name = path_parts[-1] if path_parts else "未知城市"
-                        
-                        # 从城市名中提取真正的城市名称（去掉年份前缀）
-                        match = re.match(r'^\d+(.+)$', city_name)
-                        if match:
-                            city_name = match.group(1)
+                city_name = parse_dataset_path(video_filename)['city'] if video_filename else "未知城市"
                 
                 exported_files.append({
                     'filename': export_result.get('filename', ''),
@@ -1065,20 +1138,41 @@ def download_file(filename):
         }), 500
 
 
+# 初始化批量任务管理器（工作线程在首次提交任务时启动），任务和结果持久化到任务存储
+job_manager = BatchJobManager(model_manager, BATCH_WORKER_COUNT, export_func=export_single_video_result,
+                              store=JobStore(JOB_STORE_PATH) if JOB_STORE_ENABLED else None)
+record_startup_stage('create_job_manager')
+
+# 恢复服务重启前未完成的批量任务（debug模式下重载器的监视进程不处理任务，只在实际服务进程中恢复）
+if model_manager is not None and (__name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+    resumed_jobs = job_manager.resume()
+    if resumed_jobs:
+        print(f"♻️  已恢复 {resumed_jobs} 个未完成的批量任务")
+    record_startup_stage('resume_jobs')
+print(f"⏱️  启动耗时 {sum(STARTUP_TIMINGS.values()):.3f}秒: "
+      + ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in STARTUP_TIMINGS.items()))
+
+
 if __name__ == '__main__':
     print("\n" + "=" * 60)
     print("🎥 SmartVision 批量视频处理系统")
     print("=" * 60)
     print(f"✓ 主模型: {MODEL_TYPE} (视频/图像问答)")
-    print(f"✓ 主模型状态: {'已加载' if model_manager else '未加载'}")
-    print(f"✓ Moondream模型: {'已加载' if model_manager and model_manager.moondream_model else '未加载'} (目标检测)")
+    print(f"✓ 主模型状态: {'首次请求时加载' if model_manager else '未加载'}")
+    print(f"✓ Moondream模型: 首次目标检测时加载 (目标检测)")
+    print(f"✓ 批量处理工作线程: {BATCH_WORKER_COUNT} 个")
     print("✓ 服务器地址: http://localhost:5000")
     print("✓ API 文档:")
     print("  - GET  /api/health - 健康检查")
     print("  - POST /api/query - 图像问答")
     print("  - POST /api/video-query - 视频直接问答")
     print("  - POST /api/batch-query - 批量问答")
-    print("  - POST /api/video-batch-query - 批量视频直接处理")
+    print("  - POST /api/video-batch-query - 批量视频直接处理（提交后台任务）")
+    print("  - POST /api/video-batch-paths - 批量处理服务器上的视频目录/路径清单（原地读取，不上传）")
+    print("  - GET  /api/video-batch-jobs/<job_id> - 查询批量任务进度和结果")
+    print("  - GET  /api/video-batch-jobs/<job_id>/events - 批量任务进度事件流 (SSE)")
+    print("  - GET  /api/batch-status/<job_id> - 查询单个批量任务状态")
+    print("  - POST /api/batch-control - 暂停/恢复/取消批量任务")
     print("  - POST /api/detect - 目标检测 (Moondream)")
     print("  - POST /api/export-excel - 导出Excel文件")
     print("  - GET  /api/download/<filename> - 下载文件")
@@ -0,0 +1,738 @@
+"""
+批量视频任务队列
+/api/video-batch-query 只负责保存上传文件并入队，后台工作线程池并发调用
+ModelManager.query_video 处理队列中的视频，结果按任务ID保存，可随时查询；
+配置了任务存储（JobStore）时每个视频的结果处理完成即持久化，服务重启后继续处理未完成的视频；
+任务的进度、每个视频的结果和各阶段耗时以事件形式推送给订阅者（/api/video-batch-jobs/<job_id>/events）
+"""
+
+import os
+import queue
+import threading
+import time
+import uuid
+
+
+# 检测错误关键词（API失败的各种情况）
+ERROR_KEYWORDS = ['失败', '错误', '连接失败', 'API连接失败', '处理失败',
+                  '未初始化', '不支持', 'ProxyError', 'ConnectionResetError',
+                  '代理问题', '连接被', '强制关闭', '通义千问API连接失败',
+                  'InternalError', 'Algo', 'model_dump', '500', '内部算法错误',
+                  'API内部算法错误', '算法错误']
+
+
+def is_error_result(result):
+    """判断模型返回结果是否为错误（error字段或answer中包含错误关键词）"""
+    if 'error' in result and result.get('error'):
+        return True
+
+    answer = result.get('answer', '未能生成答案')
+    if isinstance(answer, str):
+        answer_lower = answer.lower()
+        return any(keyword.lower() in answer_lower or keyword in answer for keyword in ERROR_KEYWORDS)
+    return False
+
+
+def build_video_result(filename, result):
+    """将模型返回结果转换为批量接口的单个视频结果"""
+    answer = result.get('answer', '未能生成答案')
+    if is_error_result(result):
+        return {
+            'filename': filename,
+            'answer': answer,
+            'success': False,
+            'error': result.get('error', answer)  # 如果有error字段就用它，否则用answer作为错误信息
+        }
+    video_result = {
+        'filename': filename,
+        'answer': answer,
+        'success': True,
+        'request_id': result.get('request_id', 'N/A')
+    }
+    if result.get('segments'):
+        # 长视频分段模式：保留每段的起止时间和回答
+        video_result['segments'] = result['segments']
+    return video_result
+
+
+class BatchJob:
+    """
+    一次批量视频请求对应的任务
+    每个任务有独立的状态、计数、耗时统计和暂停/恢复/取消控制，多个任务可同时运行、分别查询；
+    状态变化时向订阅者推送事件：progress（任务状态）/ result（单个视频结果和阶段耗时）/ done（任务结束，含全部结果）
+    """
+
+    def __init__(self, question, items, skip_export=False, video_options=None):
+        """
+        Args:
+            question: 对每个视频提出的问题
+            items: 任务项列表，每项包含 filename / path / city；in_place 为 True 时原地读取服务器上的视频，处理后不删除
+            skip_export: 是否跳过每个视频的Excel导出
+            video_options: 传给 ModelManager.query_video 的查询参数（strategy / frame_count / frame_size / frame_method）
+        """
+        self.job_id = uuid.uuid4().hex
+        self.question = question
+        self.items = items
+        self.skip_export = skip_export
+        self.video_options = video_options or {}
+        self.results = [None] * len(items)
+        self.video_exports = []
+        self.completed = 0   # 已有结果的视频数（成功 + 失败）
+        self.succeeded = 0
+        self.failed = 0
+        self.cancelled = 0   # 因任务取消而未处理的视频数
+        self.status = 'queued'  # queued / running / paused / cancelled / completed
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.processing_seconds = 0.0  # 各视频处理耗时之和
+        self.stage_seconds = {}  # 阶段（queue_wait / query / export）-> 各视频该阶段耗时之和
+        self.resumed = False  # 是否为服务重启后从任务存储恢复的任务
+        self.paused = False
+        self.cancel_requested = False
+        self.uploading = False  # 流式上传中：视频陆续加入，上传结束前任务不会结束
+        self._in_progress = {}  # 序号 -> 文件名（正在处理的视频）
+        self._parked = []  # 暂停期间从队列取出的 (index, item)，恢复时重新入队
+        self._subscribers = []  # 事件订阅者的队列
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_record(cls, record):
+        """由任务存储中的记录恢复任务（已完成视频的结果和导出信息一并恢复）"""
+        items = [{'filename': item['filename'], 'path': item['path'], 'city': item['city'],
+                  'in_place': item['in_place']}
+                 for item in record['items']]
+        job = cls(record['question'], items, record['skip_export'], record['video_options'])
+        job.job_id = record['job_id']
+        job.created_at = record['created_at']
+        job.started_at = record['started_at']
+        job.resumed = True
+        for index, item in enumerate(record['items']):
+            if item['done']:
+                job.results[index] = item['result']
+                if item['export'] and item['export'].get('success'):
+                    job.video_exports.append(item['export'])
+                job.completed += 1
+                if item['result'] and item['result'].get('success'):
+                    job.succeeded += 1
+                else:
+                    job.failed += 1
+        job.paused = record['status'] == 'paused'
+        job.status = 'paused' if job.paused else ('running' if job.started_at else 'queued')
+        return job
+
+    def pending_indices(self):
+        """尚未完成的任务项序号"""
+        with self._lock:
+            return [index for index, result in enumerate(self.results) if result is None]
+
+    def has_result(self, index):
+        """该任务项是否已有结果"""
+        with self._lock:
+            return self.results[index] is not None
+
+    @property
+    def total_files(self):
+        return len(self.items)
+
+    @property
+    def total_cities(self):
+        return len({item.get('city') for item in self.items})
+
+    @property
+    def is_finished(self):
+        return self.status in ('completed', 'cancelled')
+
+    def _active_status(self):
+        """未暂停时的状态（调用方需持有锁）"""
+        return 'running' if self.started_at else 'queued'
+
+    def _check_finished(self):
+        """所有视频都已有结果或已取消时结束任务，返回是否刚结束（调用方需持有锁）"""
+        if (self.finished_at is None and not self.uploading
+                and self.completed + self.cancelled >= len(self.items)):
+            self.status = 'cancelled' if self.cancel_requested else 'completed'
+            self.finished_at = time.time()
+            self._publish('done', self._snapshot(include_results=True))
+            return True
+        return False
+
+    def subscribe(self):
+        """
+        订阅任务事件
+
+        Returns:
+            tuple: (事件队列, 订阅时的任务状态快照含已有结果)；快照和订阅在同一把锁内完成，不会漏掉或重复事件
+        """
+        events = queue.Queue()
+        with self._lock:
+            self._subscribers.append(events)
+            return events, self._snapshot(include_results=True)
+
+    def unsubscribe(self, events):
+        with self._lock:
+            if events in self._subscribers:
+                self._subscribers.remove(events)
+
+    def _publish(self, event, data):
+        """向所有订阅者推送事件（调用方需持有锁）"""
+        for events in self._subscribers:
+            events.put((event, data))
+
+    def _publish_progress(self):
+        self._publish('progress', self._snapshot(include_results=False))
+
+    def add_item(self, item):
+        """流式上传时加入一个已接收完整的视频，返回其序号"""
+        with self._lock:
+            self.items.append(item)
+            self.results.append(None)
+            self._publish_progress()
+            return len(self.items) - 1
+
+    def finish_upload(self):
+        """流式上传结束，返回任务是否已结束（所有视频都已处理完或已取消）"""
+        with self._lock:
+            self.uploading = False
+            self._publish_progress()
+            return self._check_finished()
+
+    def mark_started(self):
+        """标记任务开始处理，首次调用时返回 True"""
+        with self._lock:
+            if self.started_at is None:
+                self.started_at = time.time()
+                if not self.paused and not self.cancel_requested:
+                    self.status = 'running'
+                self._publish_progress()
+                return True
+            return False
+
+    def begin_item(self, index, item):
+        """
+        工作线程取出任务项后调用，决定是否处理
+
+        Returns:
+            str: 'process' 立即处理 / 'parked' 任务已暂停，任务项暂存到恢复时 / 'cancelled' 任务已取消
+        """
+        with self._lock:
+            if self.cancel_requested:
+                return 'cancelled'
+            if self.paused:
+                self._parked.append((index, item))
+                return 'parked'
+            self._in_progress[index] = item['filename']
+            self._publish_progress()
+            return 'process'
+
+    def pause(self):
+        """暂停任务：正在处理的视频继续完成，其余视频在恢复前不再处理。返回是否改变了状态"""
+        with self._lock:
+            if self.paused or self.is_finished or self.cancel_requested:
+                return False
+            self.paused = True
+            self.status = 'paused'
+            self._publish_progress()
+            return True
+
+    def resume(self):
+        """
+        恢复任务
+
+        Returns:
+            list: 暂停期间暂存的 (index, item)，由调用方重新入队；任务未暂停时返回 None
+        """
+        with self._lock:
+            if not self.paused or self.is_finished:
+                return None
+            self.paused = False
+            self.status = self._active_status()
+            parked, self._parked = self._parked, []
+            self._publish_progress()
+            return parked
+
+    def cancel(self):
+        """
+        取消任务：正在处理的视频继续完成，其余视频不再处理
+
+        Returns:
+            tuple: (暂存的 (index, item) 列表, 任务是否已结束)；任务已结束时返回 (None, False)
+        """
+        with self._lock:
+            if self.is_finished or self.cancel_requested:
+                return None, False
+            self.cancel_requested = True
+            self.paused = False
+            self.status = 'cancelled'
+            parked, self._parked = self._parked, []
+            self.cancelled += len(parked)
+            self._publish_progress()
+            return parked, self._check_finished()
+
+    def skip_item(self):
+        """记录一个因取消而未处理的视频，返回任务是否已结束"""
+        with self._lock:
+            self.cancelled += 1
+            self._publish_progress()
+            return self._check_finished()
+
+    def record_result(self, index, video_result, export_result=None, timings=None):
+        """
+        记录单个视频的结果，返回任务是否已全部完成
+
+        Args:
+            timings: 该视频各阶段耗时（秒），如 {'queue_wait': ..., 'query': ..., 'export': ..., 'total': ...}
+        """
+        with self._lock:
+            self.results[index] = video_result
+            self._in_progress.pop(index, None)
+            if export_result and export_result.get('success'):
+                self.video_exports.append(export_result)
+            self.completed += 1
+            if video_result.get('success'):
+                self.succeeded += 1
+            else:
+                self.failed += 1
+            if timings:
+                self.processing_seconds += timings.get('total', 0.0)
+                for stage, seconds in timings.items():
+                    if stage != 'total':
+                        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+            self._publish('result', {
+                'index': index,
+                'result': video_result,
+                'export': export_result,
+                'timings': timings or {},
+            })
+            self._publish_progress()
+            return self._check_finished()
+
+    def _timings(self):
+        """耗时统计和剩余时间估算（调用方需持有锁）"""
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        processed = self.succeeded + self.failed
+        remaining = len(self.items) - self.completed - self.cancelled
+        eta = None
+        if processed and elapsed > 0 and remaining > 0 and not self.is_finished:
+            # 按实际吞吐量估算（多个工作线程并发处理同一任务时比单个视频平均耗时更准确）
+            eta = round(remaining * elapsed / processed, 1)
+        return {
+            'elapsed_seconds': round(elapsed, 1),
+            'avg_seconds_per_video': round(self.processing_seconds / processed, 2) if processed else None,
+            'avg_stage_seconds': {stage: round(seconds / processed, 2)
+                                  for stage, seconds in self.stage_seconds.items()} if processed else {},
+            'eta_seconds': eta,
+        }
+
+    def to_dict(self, include_results=True):
+        with self._lock:
+            return self._snapshot(include_results)
+
+    def _snapshot(self, include_results=True):
+        """任务状态（调用方需持有锁）"""
+        data = {
+            'job_id': self.job_id,
+            'status': self.status,
+            'is_paused': self.paused,
+            'uploading': self.uploading,
+            'question': self.question,
+            'video_options': dict(self.video_options),
+            'total_files': self.total_files,
+            'total_cities': self.total_cities,
+            'completed': self.completed,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'cancelled': self.cancelled,
+            'in_progress': [self._in_progress[index] for index in sorted(self._in_progress)],
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'resumed': self.resumed,
+            'timings': self._timings(),
+        }
+        if include_results:
+            data['results'] = [r for r in self.results if r is not None]
+            data['video_exports'] = list(self.video_exports)
+        return data
+
+
+class BatchJobManager:
+    """
+    批量任务管理器
+    所有任务的视频共用一个队列，由固定数量的工作线程并发处理；
+    暂停某个任务时，工作线程取出的该任务视频暂存到任务中，不会阻塞其他任务
+    """
+
+    def __init__(self, model_manager, worker_count=4, export_func=None, job_retention=24 * 3600, store=None):
+        """
+        Args:
+            model_manager: ModelManager 实例
+            worker_count: 后台工作线程数量
+            export_func: 单个视频结果的导出函数（如 export_single_video_result）
+            job_retention: 已完成任务在内存（和任务存储）中保留的秒数
+            store: JobStore 实例，为空时任务只保存在内存中
+        """
+        self.model_manager = model_manager
+        self.worker_count = max(1, int(worker_count))
+        self.export_func = export_func
+        self.job_retention = job_retention
+        self.store = store
+        self._resumed = threading.Event()  # 全局暂停时清除（兼容未指定 job_id 的 /api/batch-control 请求）
+        self._resumed.set()
+
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._jobs_lock = threading.Lock()
+        self._workers = []
+        self._workers_lock = threading.Lock()
+        self._active = {}  # 工作线程名 -> 正在处理的 (job, item)
+
+    @property
+    def is_paused(self):
+        return not self._resumed.is_set()
+
+    def pause_all(self):
+        """全局暂停：正在处理的视频继续完成，工作线程在取下一个视频前等待恢复"""
+        self._resumed.clear()
+
+    def resume_all(self):
+        """全局恢复：等待中的工作线程立即继续"""
+        self._resumed.set()
+
+    def start(self):
+        """启动后台工作线程（重复调用无副作用）"""
+        with self._workers_lock:
+            if self._workers:
+                return
+            for i in range(self.worker_count):
+                worker = threading.Thread(target=self._worker_loop, name=f"batch-worker-{i+1}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+        print(f"✓ 批量任务工作线程已启动: {self.worker_count} 个")
+
+    def submit(self, question, items, skip_export=False, video_options=None):
+        """提交任务，立即返回 BatchJob（首次提交时启动工作线程）"""
+        self.start()
+        self._prune_finished_jobs()
+
+        job = BatchJob(question, items, skip_export, video_options)
+        if self.store is not None:
+            self.store.save_job(job)
+        with self._jobs_lock:
+            self._jobs[job.job_id] = job
+
+        for index, item in enumerate(items):
+            self._enqueue(job, index, item)
+
+        print(f"📥 批量任务 {job.job_id} 已入队: {job.total_files} 个视频，当前队列长度 {self._queue.qsize()}")
+        return job
+
+    def open_job(self, question, skip_export=False, video_options=None):
+        """
+        创建流式上传的任务（初始没有视频），之后通过 add_item 逐个加入已接收完整的视频，
+        最后调用 finish_upload；视频加入后立即入队，不等待整个上传结束
+        """
+        self.start()
+        self._prune_finished_jobs()
+
+        job = BatchJob(question, [], skip_export, video_options)
+        job.uploading = True
+        if self.store is not None:
+            self.store.save_job(job)
+        with self._jobs_lock:
+            self._jobs[job.job_id] = job
+        print(f"📥 批量任务 {job.job_id} 已创建，视频边上传边处理")
+        return job
+
+    def add_item(self, job, item):
+        """向流式上传的任务加入一个视频并立即入队"""
+        index = job.add_item(item)
+        if self.store is not None:
+            self.store.add_item(job.job_id, index, item)
+        self._enqueue(job, index, item)
+        return index
+
+    def finish_upload(self, job):
+        """流式上传结束"""
+        if job.finish_upload():
+            self._finish_job(job)
+        if not job.cancel_requested:
+            print(f"📥 批量任务 {job.job_id} 上传完成: {job.total_files} 个视频，当前队列长度 {self._queue.qsize()}")
+
+    def resume(self):
+        """
+        从任务存储恢复未完成的任务，把未完成的视频重新入队（服务启动时调用一次）
+        视频文件（上传的临时文件或原地读取的服务器文件）已不存在的视频记为失败
+        
+        Returns:
+            int: 恢复的任务数
+        """
+        if self.store is None:
+            return 0
+        
+        try:
+            records = self.store.load_unfinished()
+        except Exception as e:
+            print(f"⚠️  读取任务存储失败，跳过恢复: {e}")
+            return 0
+        
+        for record in records:
+            job = BatchJob.from_record(record)
+            with self._jobs_lock:
+                if job.job_id in self._jobs:
+                    continue
+                self._jobs[job.job_id] = job
+            
+            pending = job.pending_indices()
+            print(f"♻️  恢复批量任务 {job.job_id}: 已完成 {job.completed}/{job.total_files}，"
+                  f"从第 {pending[0] + 1 if pending else job.total_files} 个视频继续")
+            if not pending:
+                # 最后一个视频的结果已保存，但任务状态更新前服务已退出
+                with job._lock:
+                    job._check_finished()
+                self.store.update_status(job.job_id, job.status, job.finished_at)
+                continue
+            
+            self.start()
+            # 已暂停的任务同样入队，工作线程取出后暂存到任务中，恢复时再处理
+            for index in pending:
+                item = job.items[index]
+                if os.path.exists(item['path']):
+                    self._enqueue(job, index, item)
+                else:
+                    self._record_result(job, index, {
+                        'filename': item['filename'],
+                        'answer': '',
+                        'success': False,
+                        'error': '服务重启后未找到视频文件' if item.get('in_place') else '服务重启后未找到待处理的临时文件'
+                    })
+        return len(records)
+
+    def _enqueue(self, job, index, item):
+        """视频入队（记录入队时间，用于统计排队耗时）"""
+        self._queue.put((job, index, item, time.time()))
+
+    def get_job(self, job_id):
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self):
+        with self._jobs_lock:
+            return list(self._jobs.values())
+
+    def pause_job(self, job_id):
+        """暂停指定任务，任务不存在时返回 None"""
+        job = self.get_job(job_id)
+        if job is not None and job.pause():
+            self._save_status(job)
+            print(f"⏸️  批量任务 {job_id} 已暂停")
+        return job
+
+    def resume_job(self, job_id):
+        """恢复指定任务，暂停期间暂存的视频重新入队；任务不存在时返回 None"""
+        job = self.get_job(job_id)
+        if job is None:
+            return None
+        parked = job.resume()
+        if parked is not None:
+            self._save_status(job)
+            for index, item in parked:
+                self._enqueue(job, index, item)
+            print(f"▶️  批量任务 {job_id} 已恢复，重新入队 {len(parked)} 个视频")
+        return job
+
+    def cancel_job(self, job_id):
+        """取消指定任务，尚未处理的视频不再处理并删除临时文件；任务不存在时返回 None"""
+        job = self.get_job(job_id)
+        if job is None:
+            return None
+        parked, finished = job.cancel()
+        if parked is None:
+            return job
+        for _, item in parked:
+            self._remove_temp_file(item)
+        print(f"⏹️  批量任务 {job_id} 已取消")
+        if finished:
+            self._finish_job(job)
+        else:
+            self._save_status(job)
+        return job
+
+    def get_status(self):
+        """汇总所有任务的处理状态（兼容旧的 /api/batch-status 返回格式）"""
+        with self._jobs_lock:
+            jobs = list(self._jobs.values())
+            active = list(self._active.values())
+
+        running_jobs = [job for job in jobs if not job.is_finished]
+        total_files = sum(job.total_files for job in running_jobs)
+        completed = sum(job.completed for job in running_jobs)
+        current_job, current_item = active[0] if active else (None, {})
+
+        return {
+            'is_paused': self.is_paused,
+            'is_processing': bool(running_jobs),
+            'current_file': current_item.get('filename', ''),
+            'current_index': completed + len(active) if running_jobs else 0,
+            'total_files': total_files,
+            'current_city': current_item.get('city', ''),
+            'total_cities': len({item.get('city') for job in running_jobs for item in job.items}),
+            'queue_size': self._queue.qsize(),
+            'active_workers': len(active),
+            'worker_count': self.worker_count,
+            'jobs': [job.to_dict(include_results=False) for job in running_jobs],
+        }
+
+    def _prune_finished_jobs(self):
+        """清理超过保留时间的已完成任务"""
+        now = time.time()
+        with self._jobs_lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at and now - job.finished_at > self.job_retention]
+            for job_id in expired:
+                del self._jobs[job_id]
+        if self.store is not None:
+            try:
+                self.store.prune(now - self.job_retention)
+            except Exception as e:
+                print(f"⚠️  清理任务存储失败: {e}")
+
+    def _save_status(self, job):
+        if self.store is not None:
+            try:
+                self.store.update_status(job.job_id, job.status, job.finished_at)
+            except Exception as e:
+                print(f"⚠️  更新任务存储中的任务状态失败: {e}")
+
+    def _finish_job(self, job):
+        self._save_status(job)
+        elapsed = job.finished_at - (job.started_at or job.created_at)
+        if job.status == 'cancelled':
+            print(f"⏹️  批量任务 {job.job_id} 已结束（取消），完成 {job.completed}/{job.total_files} 个视频，"
+                  f"耗时 {elapsed:.1f}秒")
+        else:
+            print(f"✅ 批量任务 {job.job_id} 处理完成，共 {job.total_files} 个视频，耗时 {elapsed:.1f}秒")
+
+    def _record_result(self, job, index, video_result, export_result=None, timings=None):
+        """记录单个视频的结果：先写入任务存储，再更新内存中的任务"""
+        if self.store is not None:
+            try:
+                self.store.record_result(job.job_id, index, video_result, export_result)
+            except Exception as e:
+                print(f"⚠️  保存视频结果到任务存储失败: {e}")
+        
+        if job.record_result(index, video_result, export_result, timings):
+            self._finish_job(job)
+
+    def _record_failure(self, job, index, item, error):
+        """视频处理过程中出现未预期的错误时记录失败结果"""
+        video_result = {
+            'filename': item['filename'],
+            'answer': '',
+            'success': False,
+            'error': str(error)
+        }
+        try:
+            self._record_result(job, index, video_result)
+        except Exception as e:
+            print(f"记录视频 {item['filename']} 的失败结果时出错: {e}")
+        self._remove_temp_file(item)
+
+    def _skip_item(self, job, item):
+        """跳过已取消任务的视频"""
+        self._remove_temp_file(item)
+        if job.skip_item():
+            self._finish_job(job)
+
+    @staticmethod
+    def _remove_temp_file(item):
+        """删除上传的临时文件（原地读取的服务器文件不删除）"""
+        if item.get('in_place'):
+            return
+        try:
+            os.unlink(item['path'])
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"删除临时文件失败: {e}")
+
+    def _worker_loop(self):
+        name = threading.current_thread().name
+        while True:
+            job, index, item, queued_at = self._queue.get()
+            processing = False
+            try:
+                # 全局暂停时等待恢复（resume_all 后立即继续）
+                self._resumed.wait()
+
+                action = job.begin_item(index, item)
+                if action == 'cancelled':
+                    self._skip_item(job, item)
+                    continue
+                if action == 'parked':
+                    continue
+
+                with self._jobs_lock:
+                    self._active[name] = (job, item)
+                processing = True
+                if job.mark_started() and self.store is not None:
+                    try:
+                        self.store.mark_started(job.job_id, job.started_at)
+                    except Exception as e:
+                        print(f"⚠️  保存任务开始时间到任务存储失败: {e}")
+                self._process_item(job, index, item, queued_at)
+            except Exception as e:
+                print(f"批量任务工作线程 {name} 出错: {e}")
+                if processing and not job.has_result(index):
+                    # 记录为失败，保证任务最终能结束
+                    self._record_failure(job, index, item, e)
+            finally:
+                with self._jobs_lock:
+                    self._active.pop(name, None)
+                self._queue.task_done()
+
+    def _process_item(self, job, index, item, queued_at):
+        filename = item['filename']
+        video_path = item['path']
+        started = time.time()
+        timings = {'queue_wait': round(started - queued_at, 3)}
+        try:
+            print(f"  [{threading.current_thread().name}] 处理视频 {index+1}/{job.total_files}: {filename}")
+            result = self.model_manager.query_video(video_path, job.question, **job.video_options)
+            video_result = build_video_result(filename, result)
+            if not video_result['success']:
+                print(f"    ⚠️ API调用失败: {filename}, 错误: {str(video_result['error'])[:100]}")
+            else:
+                print(f"    处理完成: {filename}")
+        except Exception as e:
+            print(f"处理视频文件 {filename} 时发生错误: {str(e)}")
+            video_result = {
+                'filename': filename,
+                'answer': '',
+                'success': False,
+                'error': str(e)
+            }
+
+        timings['query'] = round(time.time() - started, 3)
+
+        # 每个视频处理完成后，立即导出Excel文件（除非指定跳过，即使失败也尝试导出）
+        export_started = time.time()
+        export_result = None
+        if not job.skip_export and self.export_func:
+            try:
+                export_result = self.export_func(video_result)
+            except Exception as e:
+                export_result = {'success': False, 'error': str(e)}
+            if export_result.get('success'):
+                print(f"    ✅ Excel文件已保存: {export_result.get('filepath', '未知路径')}")
+            else:
+                print(f"    ⚠️ Excel导出失败: {export_result.get('error', '未知错误')}")
+
+        timings['export'] = round(time.time() - export_started, 3)
+        timings['total'] = round(time.time() - started, 3)
+
+        self._record_result(job, index, video_result, export_result, timings)
+
+        # 结果保存后再清理临时文件（保存前崩溃时，重启后可重新处理该视频）
+        self._remove_temp_file(item)
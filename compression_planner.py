@@ -0,0 +1,650 @@
+"""
+视频压缩规划器
+先用 ffprobe 获取时长、分辨率、帧率和音频信息，再按目标大小计算码率、分辨率和帧率，
+尽量一次编码就落在目标大小以内，避免逐级重新编码；
+视频已是兼容编码且只略超目标时，只做流复制（去掉音轨/截掉末尾），不重新编码
+"""
+
+import functools
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+# 分辨率阶梯（输出高度），按画质从高到低排列
+HEIGHT_LADDER = [1080, 720, 540, 480, 360, 288, 240, 180, 144, 120]
+# 帧率阶梯，按流畅度从高到低排列
+FPS_LADDER = [15, 12, 10, 8, 6, 5, 4, 3]
+# 优先保证的最低帧率：码率足够时先降分辨率，尽量不低于此帧率，避免丢失动作信息
+PREFERRED_MIN_FPS = 8
+# H.264 每像素每帧的最低比特数，低于此值画面会严重失真
+MIN_BITS_PER_PIXEL = 0.06
+# 容器封装等额外开销预留比例
+CONTAINER_OVERHEAD = 0.04
+# 保留音频时的音频码率（kbps）
+AUDIO_BITRATE_KBPS = 48
+# 可直接流复制（不重新编码）上传的视频编码和像素格式
+REMUX_VIDEO_CODECS = ('h264',)
+REMUX_PIX_FMTS = ('', 'yuv420p', 'yuvj420p')
+# ffprobe 未给出音频码率时估算的音频码率（kbps），手机录制的AAC音轨通常在此之上
+ASSUMED_AUDIO_BITRATE_KBPS = 96
+# 流复制后封装开销预留比例（只改封装，开销远小于重新编码）
+REMUX_OVERHEAD = 0.02
+# H.264 编码器，按编码速度从快到慢排列（硬件编码器需要实际试编码成功才使用）
+H264_ENCODERS = ['h264_nvenc', 'h264_qsv', 'h264_videotoolbox', 'h264_amf', 'libx264']
+# 支持 -preset fast 的编码器
+PRESET_ENCODERS = ('libx264', 'h264_nvenc', 'h264_qsv')
+
+
+@functools.lru_cache(maxsize=None)
+def resolve_ffmpeg_path():
+    """获取ffmpeg路径：优先使用配置的路径，其次 imageio-ffmpeg，最后使用系统PATH中的ffmpeg（进程内只查找一次）"""
+    from config import FFMPEG_PATH
+    if os.path.exists(FFMPEG_PATH):
+        return FFMPEG_PATH
+
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return 'ffmpeg'
+
+
+@functools.lru_cache(maxsize=None)
+def resolve_ffprobe_path():
+    """获取ffprobe路径：优先使用与配置的ffmpeg同目录的ffprobe，否则使用系统PATH中的ffprobe"""
+    from config import FFMPEG_PATH
+    if os.path.exists(FFMPEG_PATH):
+        ffmpeg_dir = os.path.dirname(FFMPEG_PATH)
+        for name in ('ffprobe.exe', 'ffprobe'):
+            candidate = os.path.join(ffmpeg_dir, name)
+            if os.path.exists(candidate):
+                return candidate
+    return 'ffprobe'
+
+
+# 编码器探测结果：探测在锁外进行（最长约30秒），完成后一次性发布，探测期间状态查询不等待
+_encoder_capabilities = None
+_encoder_probe_started = False
+_encoder_probe_done = threading.Event()
+_encoder_lock = threading.Lock()
+
+
+def _run_ffmpeg_listing(ffmpeg_path, option):
+    try:
+        result = subprocess.run([ffmpeg_path, '-hide_banner', option], capture_output=True, text=True, timeout=30)
+        return result.stdout
+    except Exception as e:
+        print(f"⚠️  获取ffmpeg {option} 失败: {e}")
+        return ''
+
+
+def _encoder_works(ffmpeg_path, encoder):
+    """用一帧测试画面试编码，确认编码器（尤其是硬件编码器）在本机实际可用"""
+    cmd = [ffmpeg_path, '-hide_banner', '-nostdin', '-f', 'lavfi', '-i', 'color=c=black:s=256x144:d=0.1',
+           '-frames:v', '1', '-c:v', encoder, '-pix_fmt', 'yuv420p', '-f', 'null', '-']
+    try:
+        return subprocess.run(cmd, capture_output=True, timeout=30).returncode == 0
+    except Exception:
+        return False
+
+
+def _claim_encoder_probe():
+    """标记探测已开始，返回当前调用者是否负责探测（进程内只探测一次）"""
+    global _encoder_probe_started
+    with _encoder_lock:
+        if _encoder_probe_started:
+            return False
+        _encoder_probe_started = True
+        return True
+
+
+def _probe_encoder_capabilities():
+    """
+    查询 `ffmpeg -encoders` / `-hwaccels` 并试编码，选择可用的最快H.264编码器，完成后发布结果
+    配置 VIDEO_ENCODER 指定编码器时直接使用，不做试编码；探测出错时回退为 libx264
+    """
+    global _encoder_capabilities
+    started = time.time()
+    capabilities = {'video_codec': 'libx264', 'h264_encoders': [], 'hwaccels': [], 'cuda_available': False}
+    try:
+        from config import VIDEO_ENCODER
+        ffmpeg_path = resolve_ffmpeg_path()
+        listed = _run_ffmpeg_listing(ffmpeg_path, '-encoders')
+        available = [name for name in H264_ENCODERS if re.search(rf'\s{name}\s', listed)]
+        hwaccels = [line.strip() for line in _run_ffmpeg_listing(ffmpeg_path, '-hwaccels').splitlines()[1:]
+                    if line.strip()]
+
+        if VIDEO_ENCODER and VIDEO_ENCODER != 'auto':
+            video_codec = VIDEO_ENCODER
+        else:
+            video_codec = next((name for name in available if name == 'libx264' or _encoder_works(ffmpeg_path, name)),
+                               'libx264')
+
+        capabilities = {
+            'video_codec': video_codec,
+            'h264_encoders': available,
+            'hwaccels': hwaccels,
+            'cuda_available': video_codec == 'h264_nvenc' or 'cuda' in hwaccels,
+        }
+        print(f"✓ 视频编码器: {video_codec}（可用H.264编码器: {', '.join(available) or '无'}）")
+    except Exception as e:
+        print(f"⚠️  探测视频编码器失败: {e}，使用 libx264")
+    finally:
+        capabilities['probe_seconds'] = round(time.time() - started, 3)
+        with _encoder_lock:
+            _encoder_capabilities = capabilities
+        _encoder_probe_done.set()
+
+
+def start_encoder_probe():
+    """在后台线程中探测编码器（不阻塞调用方），已开始探测时直接返回"""
+    if _claim_encoder_probe():
+        threading.Thread(target=_probe_encoder_capabilities, name="encoder-probe", daemon=True).start()
+
+
+def get_encoder_capabilities():
+    """
+    获取选用的视频编码器和硬件加速信息（进程内只探测一次）
+    尚未探测时在当前线程探测；其他线程正在探测时等待其完成（只等待探测结果，不占用锁）
+
+    Returns:
+        dict: video_codec（选用的编码器） / h264_encoders（ffmpeg支持的H.264编码器） /
+              hwaccels / cuda_available / probe_seconds
+    """
+    if not _encoder_probe_done.is_set():
+        if _claim_encoder_probe():
+            _probe_encoder_capabilities()
+        else:
+            _encoder_probe_done.wait()
+    return _encoder_capabilities
+
+
+def get_encoder_status():
+    """
+    获取编码器探测状态，不触发也不等待探测（供健康检查使用）
+
+    Returns:
+        dict: status 为 'pending'（未开始） / 'probing'（探测中） / 'ready'，ready 时包含 get_encoder_capabilities 的结果
+    """
+    if _encoder_probe_done.is_set():
+        return dict(_encoder_capabilities, status='ready')
+    with _encoder_lock:
+        return {'status': 'probing' if _encoder_probe_started else 'pending'}
+
+
+def _parse_frame_rate(value):
+    """解析 ffprobe 的帧率字符串（如 '30000/1001'）"""
+    try:
+        if '/' in value:
+            num, den = value.split('/')
+            return float(num) / float(den) if float(den) else 0.0
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def probe_video(video_path):
+    """
+    获取视频的时长、分辨率、帧率、编码和音频信息
+    ffprobe 不可用时回退为解析 `ffmpeg -i` 的输出
+
+    Returns:
+        dict: duration / width / height / fps / video_codec / has_audio / bit_rate / size，失败时返回 None
+    """
+    cmd = [
+        resolve_ffprobe_path(), '-v', 'quiet', '-print_format', 'json',
+        '-show_format', '-show_streams', video_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+        if result.returncode == 0 and result.stdout.strip():
+            data = json.loads(result.stdout)
+            video_stream = next((s for s in data.get('streams', []) if s.get('codec_type') == 'video'), None)
+            audio_stream = next((s for s in data.get('streams', []) if s.get('codec_type') == 'audio'), None)
+            fmt = data.get('format', {})
+            duration = float(fmt.get('duration') or (video_stream or {}).get('duration') or 0)
+            if video_stream and duration > 0:
+                return {
+                    'duration': duration,
+                    'width': int(video_stream.get('width') or 0),
+                    'height': int(video_stream.get('height') or 0),
+                    'fps': _parse_frame_rate(video_stream.get('avg_frame_rate') or video_stream.get('r_frame_rate')),
+                    'video_codec': video_stream.get('codec_name', ''),
+                    'pix_fmt': video_stream.get('pix_fmt', ''),
+                    'has_audio': audio_stream is not None,
+                    'audio_codec': (audio_stream or {}).get('codec_name', ''),
+                    'audio_bit_rate': int((audio_stream or {}).get('bit_rate') or 0),
+                    'bit_rate': int(fmt.get('bit_rate') or 0),
+                    'size': os.path.getsize(video_path),
+                    'format_name': fmt.get('format_name', ''),
+                }
+    except Exception as e:
+        print(f"⚠️  ffprobe获取视频信息失败: {e}，尝试解析ffmpeg输出")
+
+    return _probe_with_ffmpeg(video_path)
+
+
+def _probe_with_ffmpeg(video_path):
+    """解析 `ffmpeg -i` 输出的视频信息（ffprobe 不可用时使用）"""
+    try:
+        result = subprocess.run([resolve_ffmpeg_path(), '-hide_banner', '-i', video_path],
+                                capture_output=True, text=True, timeout=60)
+        output = result.stderr
+        duration_match = re.search(r'Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)', output)
+        video_match = re.search(r'Video:\s*(\w+).*?,\s*(\d{2,5})x(\d{2,5})', output)
+        if not duration_match or not video_match:
+            return None
+
+        hours, minutes, seconds = duration_match.groups()
+        fps_match = re.search(r'(\d+(?:\.\d+)?)\s*fps', output)
+        bitrate_match = re.search(r'bitrate:\s*(\d+)\s*kb/s', output)
+        audio_match = re.search(r'Audio:\s*(\w+)', output)
+        return {
+            'duration': int(hours) * 3600 + int(minutes) * 60 + float(seconds),
+            'width': int(video_match.group(2)),
+            'height': int(video_match.group(3)),
+            'fps': float(fps_match.group(1)) if fps_match else 0.0,
+            'video_codec': video_match.group(1),
+            'pix_fmt': '',
+            'has_audio': audio_match is not None,
+            'audio_codec': audio_match.group(1) if audio_match else '',
+            'audio_bit_rate': 0,
+            'bit_rate': int(bitrate_match.group(1)) * 1000 if bitrate_match else 0,
+            'size': os.path.getsize(video_path),
+            'format_name': '',
+        }
+    except Exception as e:
+        print(f"⚠️  解析ffmpeg输出失败: {e}")
+        return None
+
+
+def plan_compression(info, target_bytes, keep_audio=False):
+    """
+    根据视频信息计算一次编码即可落在目标大小内的参数
+
+    按 目标大小 / 时长 得到总码率，扣除音频和封装开销后作为视频码率，
+    再从分辨率和帧率阶梯中选择每像素比特数不低于 MIN_BITS_PER_PIXEL 的最高画质组合
+
+    Returns:
+        dict: video_kbps / audio_kbps / width / height / fps / keep_audio
+    """
+    duration = max(info['duration'], 1.0)
+    total_kbps = target_bytes * 8 * (1 - CONTAINER_OVERHEAD) / duration / 1000
+
+    keep_audio = keep_audio and info.get('has_audio', False) and total_kbps > AUDIO_BITRATE_KBPS * 4
+    audio_kbps = AUDIO_BITRATE_KBPS if keep_audio else 0
+    video_kbps = max(total_kbps - audio_kbps, 16)
+
+    source_height = info.get('height') or HEIGHT_LADDER[0]
+    source_width = info.get('width') or int(source_height * 16 / 9)
+    source_fps = info.get('fps') or FPS_LADDER[0]
+    aspect = source_width / source_height if source_height else 16 / 9
+
+    heights = [h for h in HEIGHT_LADDER if h <= source_height] or [HEIGHT_LADDER[-1]]
+    fps_options = [f for f in FPS_LADDER if f <= source_fps] or [FPS_LADDER[-1]]
+
+    def pick(fps_candidates):
+        # 选择满足每像素比特数的最高分辨率，并在该分辨率下选择尽可能高的帧率
+        for height in heights:
+            width = int(round(height * aspect / 2)) * 2
+            for fps in fps_candidates:
+                if video_kbps * 1000 / (width * height * fps) >= MIN_BITS_PER_PIXEL:
+                    return width, height, fps
+        return None
+
+    # 先在不低于 PREFERRED_MIN_FPS 的帧率中选择，码率实在不足时再降低帧率
+    preferred_fps = [f for f in fps_options if f >= PREFERRED_MIN_FPS]
+    chosen = (pick(preferred_fps) if preferred_fps else None) or pick(fps_options)
+
+    if chosen is None:
+        height = heights[-1]
+        chosen = (int(round(height * aspect / 2)) * 2, height, fps_options[-1])
+
+    width, height, fps = chosen
+    return {
+        'video_kbps': int(video_kbps),
+        'audio_kbps': audio_kbps,
+        'width': width,
+        'height': height,
+        'fps': fps,
+        'keep_audio': keep_audio,
+    }
+
+
+def plan_segments(info, target_bytes, min_height, max_segments, keep_audio=False):
+    """
+    整段压缩后的分辨率低于 min_height 时，计算按时间等分的分段边界，
+    使每段单独压缩到目标大小时分辨率不低于 min_height（源视频更低时以源视频为准）
+
+    Returns:
+        list: [(start, end), ...]（秒）；整段压缩画质足够时返回 None
+    """
+    duration = info.get('duration') or 0
+    required_height = min(min_height, info.get('height') or min_height)
+    if duration <= 0 or plan_compression(info, target_bytes, keep_audio)['height'] >= required_height:
+        return None
+
+    count = max_segments
+    for candidate in range(2, max_segments + 1):
+        if plan_compression(dict(info, duration=duration / candidate), target_bytes, keep_audio)['height'] >= required_height:
+            count = candidate
+            break
+
+    segment_duration = duration / count
+    return [(round(i * segment_duration, 3), round(min(duration, (i + 1) * segment_duration), 3))
+            for i in range(count)]
+
+
+def plan_remux(info, target_bytes, max_trim_ratio=0.0, keep_audio=False):
+    """
+    判断视频能否只做流复制（不重新编码）就落在目标大小内：
+    视频已是 H.264/yuv420p 时，依次尝试去掉音轨、在末尾截掉不超过 max_trim_ratio 的时长
+
+    Returns:
+        dict: drop_audio / trim_duration（秒，None 表示不截断） / estimated_bytes；
+              编码不兼容或需要截掉的时长过多时返回 None（需要重新编码）
+    """
+    if info.get('video_codec') not in REMUX_VIDEO_CODECS or info.get('pix_fmt', '') not in REMUX_PIX_FMTS:
+        return None
+
+    duration = info.get('duration') or 0
+    size = info.get('size') or 0
+    if duration <= 0 or size <= 0:
+        return None
+
+    drop_audio = info.get('has_audio', False) and not keep_audio
+    audio_bytes = 0
+    if drop_audio:
+        audio_kbps = (info.get('audio_bit_rate') or 0) / 1000 or ASSUMED_AUDIO_BITRATE_KBPS
+        audio_bytes = min(audio_kbps * 1000 * duration / 8, size / 2)
+    remaining_bytes = size - audio_bytes
+    budget = target_bytes * (1 - REMUX_OVERHEAD)
+
+    if remaining_bytes <= budget:
+        return {'drop_audio': drop_audio, 'trim_duration': None, 'estimated_bytes': int(remaining_bytes)}
+
+    # 按平均码率估算需要保留的时长，只截掉末尾的一小段
+    keep_ratio = budget / remaining_bytes
+    if 1 - keep_ratio > max_trim_ratio:
+        return None
+    return {
+        'drop_audio': drop_audio,
+        'trim_duration': round(duration * keep_ratio, 3),
+        'estimated_bytes': int(budget),
+    }
+
+
+def build_remux_command(ffmpeg_path, video_path, output_path, remux_plan):
+    """
+    构建流复制命令：视频流原样复制到mp4，按规划去掉音轨、截掉末尾
+    只截掉末尾时保留的各帧仍可从开头的关键帧正常解码，不需要重新编码
+    """
+    cmd = [ffmpeg_path, '-y', '-i', video_path]
+    if remux_plan['trim_duration']:
+        cmd += ['-t', f"{remux_plan['trim_duration']:.3f}"]
+    cmd += ['-map', '0:v:0']
+    if not remux_plan['drop_audio']:
+        cmd += ['-map', '0:a:0?']
+    cmd += ['-c', 'copy']
+    if remux_plan['drop_audio']:
+        cmd += ['-an']
+    return cmd + ['-movflags', '+faststart', output_path]
+
+
+def remux_with_plan(video_path, output_path, remux_plan, timeout=300):
+    """按规划流复制，成功返回 True"""
+    cmd = build_remux_command(resolve_ffmpeg_path(), video_path, output_path, remux_plan)
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    if result.returncode != 0:
+        print(f"流复制失败: {result.stderr[-500:]}")
+        return False
+    return os.path.exists(output_path)
+
+
+def build_encode_command(ffmpeg_path, video_path, output_path, plan, video_codec='libx264',
+                         pass_number=None, passlog_prefix=None, start=None, duration=None, threads=None):
+    """
+    构建按规划参数编码的ffmpeg命令（pass_number 为 1/2 时生成两遍编码的对应命令）
+    指定 start / duration 时只编码该时间段（输入端快速定位），threads 限制ffmpeg使用的线程数
+    """
+    video_kbps = plan['video_kbps']
+    cmd = [ffmpeg_path, '-y']
+    if threads:
+        cmd += ['-threads', str(threads)]
+    if start:
+        cmd += ['-ss', f"{start:.3f}"]
+    cmd += ['-i', video_path]
+    if duration:
+        cmd += ['-t', f"{duration:.3f}"]
+    cmd += [
+        '-vf', f"scale=-2:{plan['height']}",
+        '-r', str(plan['fps']),
+        '-c:v', video_codec,
+        '-b:v', f"{video_kbps}k",
+        '-maxrate', f"{int(video_kbps * 1.5)}k",
+        '-bufsize', f"{video_kbps * 2}k",
+        '-pix_fmt', 'yuv420p',
+    ]
+    if threads:
+        cmd += ['-threads', str(threads)]
+    if video_codec in PRESET_ENCODERS:
+        cmd += ['-preset', 'fast']
+
+    if pass_number:
+        cmd += ['-pass', str(pass_number), '-passlogfile', passlog_prefix]
+
+    if pass_number == 1:
+        # 第一遍只分析，不输出音频和文件
+        return cmd + ['-an', '-f', 'mp4', os.devnull]
+
+    if plan['keep_audio']:
+        cmd += ['-c:a', 'aac', '-b:a', f"{plan['audio_kbps']}k", '-ac', '1']
+    else:
+        cmd += ['-an']
+    return cmd + ['-movflags', '+faststart', output_path]
+
+
+def encode_with_plan(video_path, output_path, plan, two_pass=False, video_codec=None, timeout=1200,
+                     start=None, duration=None, threads=None):
+    """
+    按规划参数编码（可只编码 start 起 duration 秒），返回实际执行的编码遍数（两遍编码为2），失败返回 0
+    video_codec 为空时使用启动时探测到的最快编码器；两遍编码只在 libx264 下生效
+    """
+    ffmpeg_path = resolve_ffmpeg_path()
+    video_codec = video_codec or get_encoder_capabilities()['video_codec']
+    passlog_prefix = None
+    try:
+        if two_pass and video_codec == 'libx264':
+            passlog_prefix = os.path.join(os.path.dirname(output_path) or '.', f"ffmpeg2pass_{uuid.uuid4().hex}")
+            commands = [
+                build_encode_command(ffmpeg_path, video_path, output_path, plan, video_codec, 1, passlog_prefix,
+                                     start, duration, threads),
+                build_encode_command(ffmpeg_path, video_path, output_path, plan, video_codec, 2, passlog_prefix,
+                                     start, duration, threads),
+            ]
+        else:
+            commands = [build_encode_command(ffmpeg_path, video_path, output_path, plan, video_codec,
+                                             start=start, duration=duration, threads=threads)]
+
+        for cmd in commands:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+            if result.returncode != 0:
+                print(f"按规划参数压缩失败: {result.stderr[-500:]}")
+                return 0
+        return len(commands) if os.path.exists(output_path) else 0
+    finally:
+        if passlog_prefix:
+            directory = os.path.dirname(passlog_prefix) or '.'
+            prefix = os.path.basename(passlog_prefix)
+            for name in os.listdir(directory):
+                if name.startswith(prefix):
+                    try:
+                        os.unlink(os.path.join(directory, name))
+                    except OSError:
+                        pass
+
+
+def probe_keyframes(video_path, timeout=120):
+    """读取视频流的关键帧时间戳（只解析数据包，不解码），失败时返回空列表"""
+    cmd = [
+        resolve_ffprobe_path(), '-v', 'quiet', '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', video_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except Exception as e:
+        print(f"⚠️  获取关键帧失败: {e}")
+        return []
+    keyframes = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags:
+            try:
+                keyframes.append(float(pts_time))
+            except ValueError:
+                continue
+    return sorted(keyframes)
+
+
+def plan_keyframe_splits(keyframes, duration, count, min_segment_seconds=10):
+    """
+    在关键帧处把视频切成约 count 个等长的时间段（每个切点取离等分点最近的关键帧）
+
+    Returns:
+        list: [(start, end), ...]（秒），关键帧不足以切分时只有一段
+    """
+    cuts = [0.0]
+    for i in range(1, count):
+        target = duration * i / count
+        candidates = [t for t in keyframes if t - cuts[-1] >= min_segment_seconds and duration - t >= min_segment_seconds]
+        if not candidates:
+            break
+        cut = min(candidates, key=lambda t: abs(t - target))
+        if cut > cuts[-1]:
+            cuts.append(cut)
+    cuts.append(duration)
+    return [(round(start, 3), round(end, 3)) for start, end in zip(cuts, cuts[1:])]
+
+
+def concat_segments(segment_paths, output_path, timeout=300):
+    """用 concat 分离器流复制拼接编码参数相同的分段（无损，不重新编码），成功返回 True"""
+    list_path = f"{output_path}.concat.txt"
+    try:
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for path in segment_paths:
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        cmd = [resolve_ffmpeg_path(), '-y', '-f', 'concat', '-safe', '0', '-i', list_path,
+               '-c', 'copy', '-movflags', '+faststart', output_path]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+        if result.returncode != 0:
+            print(f"拼接分段失败: {result.stderr[-500:]}")
+            return False
+        return os.path.exists(output_path)
+    finally:
+        if os.path.exists(list_path):
+            os.unlink(list_path)
+
+
+@functools.lru_cache(maxsize=None)
+def _segment_encode_slots(count):
+    """进程内共用的分段编码名额（同时运行的分段ffmpeg进程数上限）"""
+    return threading.BoundedSemaphore(count)
+
+
+def encode_parallel_with_plan(video_path, output_path, plan, info, workers, two_pass=False, video_codec=None,
+                              timeout=1200, min_segment_seconds=10):
+    """
+    分段并行编码单个视频：在关键帧处切成 workers 段，各段按同一规划参数并发编码
+    （每个ffmpeg分到 CPU核数 / workers 个线程），再无损拼接；码率与整段编码相同，输出大小一致
+    多个批量工作线程同时压缩视频时，进程内所有分段编码共用 workers 个名额，总线程数不超过CPU核数
+
+    Returns:
+        int: 每段执行的编码遍数（与 encode_with_plan 相同），失败返回 0；关键帧不足以切分时直接整段编码
+    """
+    splits = plan_keyframe_splits(probe_keyframes(video_path), info['duration'], workers, min_segment_seconds)
+    if len(splits) < 2:
+        return encode_with_plan(video_path, output_path, plan, two_pass, video_codec, timeout)
+
+    threads = max(1, (os.cpu_count() or 1) // max(1, int(workers)))
+    slots = _segment_encode_slots(max(1, int(workers)))
+
+    base, _ = os.path.splitext(output_path)
+    segment_paths = [f"{base}_part{i:02d}.mp4" for i in range(len(splits))]
+    print(f"🚀 分段并行编码: {len(splits)} 段 ({', '.join(f'{start:.0f}-{end:.0f}s' for start, end in splits)})，"
+          f"每段 {threads} 线程")
+
+    def encode(index):
+        start, end = splits[index]
+        with slots:
+            return encode_with_plan(video_path, segment_paths[index], plan, two_pass, video_codec, timeout,
+                                    start=start, duration=end - start, threads=threads)
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(splits)) as executor:
+            results = list(executor.map(encode, range(len(splits))))
+        if all(results) and concat_segments(segment_paths, output_path):
+            return max(results)
+        return 0
+    finally:
+        for path in segment_paths:
+            if os.path.exists(path):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+
+class CompressionStats:
+    """统计规划压缩的一次命中率，便于和逐级压缩策略对比"""
+
+    def __init__(self):
+        self.planned = 0          # 使用规划器压缩的视频数
+        self.first_try_hits = 0   # 第一次编码即满足目标大小
+        self.retry_hits = 0       # 按实际大小修正码率后第二次编码满足目标大小
+        self.fallbacks = 0        # 规划失败，回退到逐级压缩策略
+        self.encodes = 0          # 实际执行的编码次数
+        self.remux_attempts = 0   # 尝试流复制（不重新编码）的视频数
+        self.remux_hits = 0       # 流复制即满足目标大小
+        self._lock = threading.Lock()
+
+    def record_remux(self, hit):
+        with self._lock:
+            self.remux_attempts += 1
+            if hit:
+                self.remux_hits += 1
+
+    def record(self, encodes, hit_attempt=None):
+        """
+        Args:
+            encodes: 本次视频执行的编码次数
+            hit_attempt: 第几次编码满足目标大小（1/2），未满足为 None
+        """
+        with self._lock:
+            self.planned += 1
+            self.encodes += encodes
+            if hit_attempt == 1:
+                self.first_try_hits += 1
+            elif hit_attempt == 2:
+                self.retry_hits += 1
+            else:
+                self.fallbacks += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'planned': self.planned,
+                'first_try_hits': self.first_try_hits,
+                'first_try_hit_rate': round(self.first_try_hits / self.planned, 3) if self.planned else 0.0,
+                'retry_hits': self.retry_hits,
+                'fallbacks': self.fallbacks,
+                'avg_encodes_per_video': round(self.encodes / self.planned, 2) if self.planned else 0.0,
+                'remux_attempts': self.remux_attempts,
+                'remux_hits': self.remux_hits,
+            }
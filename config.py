@@ -16,41 +16,152 @@ if not TEMP_DIR:
     # 使用指定的D盘解码文件夹
     TEMP_DIR = "D:\\解码文件夹"  # 修改为D盘解码文件夹
     
-    # 确保目录存在
-    if not os.path.exists(TEMP_DIR):
-        try:
-            os.makedirs(TEMP_DIR, exist_ok=True)
-            print(f"✅ 已创建临时文件目录: {TEMP_DIR}")
-        except Exception as e:
-            print(f"❌ 创建目录失败，使用默认临时目录: {e}")
-            TEMP_DIR = tempfile.gettempdir()
+    # 导入配置时不创建目录：目录不存在且无法在其上级目录创建时，使用默认临时目录
+    if not os.path.isdir(TEMP_DIR) and not os.access(os.path.dirname(os.path.abspath(TEMP_DIR)), os.W_OK):
+        TEMP_DIR = tempfile.gettempdir()
+
+
+def ensure_temp_dir():
+    """创建临时文件目录（服务启动时调用，导入配置时不创建目录）"""
+    try:
+        os.makedirs(TEMP_DIR, exist_ok=True)
+    except Exception as e:
+        print(f"❌ 创建临时文件目录失败: {TEMP_DIR}: {e}")
+    return TEMP_DIR
+
 
 # FFmpeg配置 - 指定ffmpeg可执行文件路径
 FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")  # 默认使用系统PATH中的ffmpeg，或通过环境变量指定完整路径
 
+# 批量处理配置 - 后台并发处理视频的工作线程数量（主要耗时在等待模型API返回，可适当调大）
+BATCH_WORKER_COUNT = int(os.getenv("BATCH_WORKER_COUNT", "4"))
+
+# 批量任务存储 - 任务和每个视频的结果处理完成即写入SQLite，服务重启后自动从未完成的视频继续处理
+JOB_STORE_ENABLED = os.getenv("JOB_STORE_ENABLED", "true").lower() == "true"
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "") or os.path.join(TEMP_DIR, "batch_jobs.db")
+
+# 批量任务事件流（SSE）- 没有新事件时每隔多少秒发送一次保活注释，避免代理断开空闲连接
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+
+# 服务器路径提交 - 允许 /api/video-batch-paths 直接读取的目录（多个目录用系统路径分隔符分隔：Linux为":"，Windows为";"）
+# 视频原地读取，不上传、不复制、处理后不删除；为空时禁用该接口
+INGEST_ALLOWED_ROOTS = [root.strip() for root in os.getenv("INGEST_ALLOWED_ROOTS", "").split(os.pathsep) if root.strip()]
+
+# 请求限流配置 - 每个提供商的每个API Key独立的令牌桶（以下为单个Key的速率）
+# rate: 持续速率（每秒请求数），burst: 允许的突发请求数
+RATE_LIMITS = {
+    "qwen": {  # 通义千问：默认每5秒1次请求（保守，避免触发频率限制）
+        "rate": float(os.getenv("QWEN_RATE_LIMIT", "0.2")),
+        "burst": int(os.getenv("QWEN_RATE_BURST", "1")),
+    },
+    "openai": {  # OpenAI：默认每秒1次请求
+        "rate": float(os.getenv("OPENAI_RATE_LIMIT", "1.0")),
+        "burst": int(os.getenv("OPENAI_RATE_BURST", "1")),
+    },
+    "claude": {  # Claude：默认每1.5秒1次请求
+        "rate": float(os.getenv("CLAUDE_RATE_LIMIT", "0.667")),
+        "burst": int(os.getenv("CLAUDE_RATE_BURST", "1")),
+    },
+    "gemini": {  # Gemini：默认每秒1次请求
+        "rate": float(os.getenv("GEMINI_RATE_LIMIT", "1.0")),
+        "burst": int(os.getenv("GEMINI_RATE_BURST", "1")),
+    },
+    "default": {  # 默认：每5秒1次请求
+        "rate": 0.2,
+        "burst": 1,
+    },
+}
+
+# API Key被限流（429/配额错误）后的冷却秒数，冷却期内请求分配给同一提供商的其他Key（连续被限流时成倍延长，最长8倍）
+API_KEY_COOLDOWN_SECONDS = float(os.getenv("API_KEY_COOLDOWN_SECONDS", "60"))
+
+# 自适应限流配置（AIMD）- 请求成功时加性提高速率和并发，遇到429/配额错误或请求超时时乘性降低
+# 各提供商的速率在 [rate/10, rate*10] 范围内调整，可在 RATE_LIMITS 中单独指定 min_rate / max_rate
+ADAPTIVE_RATE_CONTROL = {
+    "max_concurrency": int(os.getenv("RATE_LIMIT_MAX_CONCURRENCY", "8")),  # 每个提供商的最大并发请求数
+    "decrease_factor": float(os.getenv("RATE_LIMIT_DECREASE_FACTOR", "0.5")),  # 拥塞时的降低系数
+}
+
+# 响应缓存配置 - 以媒体内容哈希+问题+模型为键缓存成功的查询结果，重跑数据集时不再重复上传和计费
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", "") or os.path.join(TEMP_DIR, "response_cache")
+RESPONSE_CACHE_MAX_MB = int(os.getenv("RESPONSE_CACHE_MAX_MB", "512"))  # 缓存总大小上限
+RESPONSE_CACHE_MAX_AGE_DAYS = float(os.getenv("RESPONSE_CACHE_MAX_AGE_DAYS", "30"))  # 条目有效期
+
+# 转码缓存配置 - 压缩后的视频按源视频内容哈希+压缩配置缓存，同一视频多次提问只转码一次
+TRANSCODE_CACHE_ENABLED = os.getenv("TRANSCODE_CACHE_ENABLED", "true").lower() == "true"
+TRANSCODE_CACHE_DIR = os.getenv("TRANSCODE_CACHE_DIR", "") or os.path.join(TEMP_DIR, "transcode_cache")
+TRANSCODE_CACHE_MAX_MB = int(os.getenv("TRANSCODE_CACHE_MAX_MB", "2048"))  # 缓存总大小上限，超出时淘汰最久未使用的视频
+
+# 视频压缩配置 - 先获取时长/分辨率/音频信息，按目标大小一次算出码率和分辨率
+COMPRESSION_TARGET_MB = float(os.getenv("COMPRESSION_TARGET_MB", "7.0"))  # 压缩目标大小（Base64后约为1.33倍，需<10MB）
+COMPRESSION_TWO_PASS = os.getenv("COMPRESSION_TWO_PASS", "false").lower() == "true"  # 两遍编码，大小更精确但耗时约翻倍
+COMPRESSION_KEEP_AUDIO = os.getenv("COMPRESSION_KEEP_AUDIO", "false").lower() == "true"  # 是否保留音轨（视觉模型通常不需要）
+COMPRESSION_REMUX_ENABLED = os.getenv("COMPRESSION_REMUX_ENABLED", "true").lower() == "true"  # H.264视频只略超目标时流复制（去音轨/截尾），不重新编码
+COMPRESSION_REMUX_MAX_TRIM = float(os.getenv("COMPRESSION_REMUX_MAX_TRIM", "0"))  # 流复制时最多截掉的末尾时长比例（默认0不截断，超出部分改为重新编码/分段，不丢失视频结尾）
+COMPRESSION_PARALLEL_WORKERS = int(os.getenv("COMPRESSION_PARALLEL_WORKERS", "4"))  # 单个长视频在关键帧处切分后并行编码的段数（1为整段编码）
+COMPRESSION_PARALLEL_MIN_SECONDS = float(os.getenv("COMPRESSION_PARALLEL_MIN_SECONDS", "300"))  # 时长不低于此值的视频才分段并行编码
+
+# 媒体处理后端 - subprocess: ffprobe/ffmpeg子进程；pyav: PyAV进程内编解码（需安装av）；auto: 已安装PyAV时使用pyav
+MEDIA_BACKEND = os.getenv("MEDIA_BACKEND", "subprocess")
+VIDEO_ENCODER = os.getenv("VIDEO_ENCODER", "auto")  # auto: 启动时探测可用的最快H.264编码器（硬件编码器优先）；也可指定如 libx264
+
+# 长视频分段模式 - 整段压缩后分辨率过低时，按时间分段分别压缩并发查询，再汇总各段回答
+LONG_VIDEO_SEGMENT_ENABLED = os.getenv("LONG_VIDEO_SEGMENT_ENABLED", "true").lower() == "true"
+LONG_VIDEO_MIN_HEIGHT = int(os.getenv("LONG_VIDEO_MIN_HEIGHT", "360"))  # 整段压缩后预计高度低于此值时分段
+LONG_VIDEO_MAX_SEGMENTS = int(os.getenv("LONG_VIDEO_MAX_SEGMENTS", "8"))  # 单个视频最多分段数
+LONG_VIDEO_SEGMENT_WORKERS = int(os.getenv("LONG_VIDEO_SEGMENT_WORKERS", "3"))  # 同一视频同时压缩/查询的分段数
+
+# 视频查询策略 - video: 上传整段视频；frames: 抽取代表帧以多图请求发送（可按任务覆盖）
+VIDEO_QUERY_STRATEGY = os.getenv("VIDEO_QUERY_STRATEGY", "video")
+FRAME_SAMPLE_COUNT = int(os.getenv("FRAME_SAMPLE_COUNT", "8"))  # 抽帧数量
+FRAME_SAMPLE_SIZE = int(os.getenv("FRAME_SAMPLE_SIZE", "768"))  # 帧的最长边（像素）
+FRAME_SAMPLE_METHOD = os.getenv("FRAME_SAMPLE_METHOD", "scene")  # scene: 场景切换检测（不足时均匀补足）；uniform: 均匀采样
+FRAME_SCENE_THRESHOLD = float(os.getenv("FRAME_SCENE_THRESHOLD", "0.3"))  # 场景切换阈值（0-1，越小越敏感）
+
+# 数据集元数据目录（python dataset_catalog.py <数据集目录> 建立），压缩规划优先从中读取视频时长/分辨率
+DATASET_CATALOG_PATH = os.getenv("DATASET_CATALOG_PATH", "") or os.path.join(TEMP_DIR, "dataset_catalog.db")
+
 # 模型选择 (moondream, openai, claude, gemini, qwen)
 # 注意：视频处理推荐使用 openai 或 claude，它们对视频支持更好
 # Moondream 专门用于目标检测功能，其他模型用于视频/图像问答
 MODEL_TYPE = os.getenv("MODEL_TYPE", "qwen")  # 使用通义千问，已有有效API Key
 
+
+def _api_keys(name, primary):
+    """读取 <name>_API_KEYS（逗号分隔的多个API Key），与 <name>_API_KEY 合并去重，单个Key在前"""
+    keys = [primary] if primary else []
+    for key in os.getenv(f"{name}_API_KEYS", "").split(","):
+        key = key.strip()
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+# 每个提供商可配置多个API Key（<提供商>_API_KEYS，逗号分隔），每个Key独立限流，请求分配给负载最低的可用Key
 # Moondream API 配置
 MOONDREAM_API_KEY = os.getenv("MOONDREAM_API_KEY", "")
+MOONDREAM_API_KEYS = _api_keys("MOONDREAM", MOONDREAM_API_KEY)
 
 # OpenAI API 配置
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+OPENAI_API_KEYS = _api_keys("OPENAI", OPENAI_API_KEY)
 OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")  # 或自定义代理地址
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")  # 或 gpt-4-vision-preview
 
 # Claude API 配置
 CLAUDE_API_KEY = os.getenv("CLAUDE_API_KEY", "")
+CLAUDE_API_KEYS = _api_keys("CLAUDE", CLAUDE_API_KEY)
 CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "claude-3-5-sonnet-20241022")
 
 # Gemini API 配置
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+GEMINI_API_KEYS = _api_keys("GEMINI", GEMINI_API_KEY)
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
 
 # 通义千问 API 配置
 QWEN_API_KEY = os.getenv("QWEN_API_KEY", "")
+QWEN_API_KEYS = _api_keys("QWEN", QWEN_API_KEY)
 QWEN_MODEL = os.getenv("QWEN_MODEL", "qwen3-vl-plus-2025-09-23")  # Qwen3-VL-Plus 最新模型
 
 # 图像配置
@@ -59,27 +170,64 @@ DEFAULT_IMAGE_PATH = os.getenv("DEFAULT_IMAGE_PATH", "")
 # 模型配置
 MODEL_CONFIG = {
     "moondream": {
-        "api_key": MOONDREAM_API_KEY,
+        "api_key": MOONDREAM_API_KEYS[0] if MOONDREAM_API_KEYS else "",
+        "api_keys": MOONDREAM_API_KEYS,
     },
     "openai": {
-        "api_key": OPENAI_API_KEY,
+        "api_key": OPENAI_API_KEYS[0] if OPENAI_API_KEYS else "",
+        "api_keys": OPENAI_API_KEYS,
         "base_url": OPENAI_BASE_URL,
         "model": OPENAI_MODEL,
     },
     "claude": {
-        "api_key": CLAUDE_API_KEY,
+        "api_key": CLAUDE_API_KEYS[0] if CLAUDE_API_KEYS else "",
+        "api_keys": CLAUDE_API_KEYS,
         "model": CLAUDE_MODEL,
     },
     "gemini": {
-        "api_key": GEMINI_API_KEY,
+        "api_key": GEMINI_API_KEYS[0] if GEMINI_API_KEYS else "",
+        "api_keys": GEMINI_API_KEYS,
         "model": GEMINI_MODEL,
     },
     "qwen": {
-        "api_key": QWEN_API_KEY,
+        "api_key": QWEN_API_KEYS[0] if QWEN_API_KEYS else "",
+        "api_keys": QWEN_API_KEYS,
         "model": QWEN_MODEL,
     }
 }
 
+# 多提供商路由 - 参与路由的提供商（逗号分隔，如 "qwen,gemini,claude"），为空时只使用 MODEL_TYPE
+# 每个请求按请求体大小和各提供商的健康状况（p50/p95延迟、连续失败）选择提供商，失败时自动切换到下一个
+ROUTER_PROVIDERS = [p.strip() for p in os.getenv("ROUTER_PROVIDERS", "").split(",") if p.strip()] or [MODEL_TYPE]
+ROUTER_FAILURE_THRESHOLD = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "3"))  # 连续失败多少次后暂时降级
+ROUTER_COOLDOWN_SECONDS = float(os.getenv("ROUTER_COOLDOWN_SECONDS", "60"))  # 降级期间优先使用其他提供商的秒数
+
+# 提供商能力 - video: 是否支持整段视频；text: 是否支持纯文本请求（汇总分段回答）
+# max_payload_mb: Base64编码后的视频请求体上限，超出时先压缩（压缩目标按 COMPRESSION_TARGET_MB / 10MB 等比例调整）
+# cost: 相对成本，延迟相同时优先使用低成本的提供商
+PROVIDER_CAPABILITIES = {
+    "moondream": {
+        "video": False, "text": False, "max_payload_mb": 0,
+        "cost": float(os.getenv("MOONDREAM_COST", "1.0")),
+    },
+    "openai": {
+        "video": True, "text": True, "max_payload_mb": float(os.getenv("OPENAI_MAX_PAYLOAD_MB", "20")),
+        "cost": float(os.getenv("OPENAI_COST", "3.0")),
+    },
+    "claude": {
+        "video": True, "text": True, "max_payload_mb": float(os.getenv("CLAUDE_MAX_PAYLOAD_MB", "32")),
+        "cost": float(os.getenv("CLAUDE_COST", "3.0")),
+    },
+    "gemini": {
+        "video": True, "text": True, "max_payload_mb": float(os.getenv("GEMINI_MAX_PAYLOAD_MB", "20")),
+        "cost": float(os.getenv("GEMINI_COST", "2.0")),
+    },
+    "qwen": {  # 通义千问：Base64编码视频必须<10MB
+        "video": True, "text": True, "max_payload_mb": float(os.getenv("QWEN_MAX_PAYLOAD_MB", "10")),
+        "cost": float(os.getenv("QWEN_COST", "1.0")),
+    },
+}
+
 # 常见问题模板
 QUESTION_TEMPLATES = [
     "What's in this image?",
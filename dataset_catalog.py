@@ -0,0 +1,308 @@
+"""
+数据集元数据目录
+扫描一次数据集，把每个视频的路径层级（大洲/国家/城市）、时长、分辨率、编码、码率和大小
+保存到本地SQLite目录中；再次扫描时只探测新增或变化的视频，并删除已不存在的视频记录。
+批量处理脚本、视频预处理工具和压缩规划器查询目录，不再重复遍历文件夹和调用ffprobe
+
+用法:
+    python dataset_catalog.py <数据集目录> [--db dataset_catalog.db] [--workers 8]
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v')
+
+# 数据集根目录名，路径中出现时其后依次为 大洲/国家/城市
+DATASET_ROOT_NAMES = ('dataset', 'dataset_output')
+
+UNKNOWN_CONTINENT = '未知大洲'
+UNKNOWN_COUNTRY = '未知国家'
+UNKNOWN_CITY = '未知城市'
+
+
+def find_video_files(folder_path, extensions=VIDEO_EXTENSIONS):
+    """递归查找文件夹中的所有视频文件（按路径排序）"""
+    video_files = []
+    for root, dirs, files in os.walk(folder_path):
+        for file in files:
+            if file.lower().endswith(extensions):
+                video_files.append(os.path.join(root, file))
+    return sorted(video_files)
+
+
+def parse_dataset_path(path, root=None):
+    """
+    从视频路径中解析 大洲/国家/城市
+
+    解析顺序：
+    1. 路径中包含 dataset / dataset_output 时，取其后的三级目录
+    2. 指定 root 时，取相对 root 的前三级目录
+    3. 相对路径（如浏览器上传的 webkitRelativePath）取前三级目录
+    4. 绝对路径取视频所在目录及其上两级（.../大洲/国家/城市/视频.mp4）
+    城市目录名带年份前缀时去掉前缀（如 "2023布里斯班" -> "布里斯班"）
+
+    Returns:
+        dict: continent / country / city / city_dir（城市目录原名） / location（大洲/国家/城市目录，用于输出路径）
+    """
+    dir_parts = [part for part in path.replace('\\', '/').split('/')[:-1] if part and part != '.']
+
+    dataset_index = next((i for i, part in enumerate(dir_parts) if part in DATASET_ROOT_NAMES), -1)
+    if dataset_index != -1:
+        levels = dir_parts[dataset_index + 1:dataset_index + 4]
+    elif root:
+        relative = os.path.relpath(path, root).replace('\\', '/')
+        levels = [part for part in relative.split('/')[:-1] if part and part != '.'][:3]
+    elif not os.path.isabs(path):
+        levels = dir_parts[:3]
+    else:
+        levels = dir_parts[-3:]
+
+    continent = country = None
+    city_dir = None
+    if len(levels) >= 3:
+        continent, country, city_dir = levels[:3]
+    elif dir_parts:
+        # 路径不完整时，使用最后一级目录作为城市
+        city_dir = dir_parts[-1]
+
+    city = city_dir or UNKNOWN_CITY
+    match = re.match(r'^\d+(.+)$', city)
+    if match:
+        city = match.group(1)
+
+    return {
+        'continent': continent or UNKNOWN_CONTINENT,
+        'country': country or UNKNOWN_COUNTRY,
+        'city': city,
+        'city_dir': city_dir or '',
+        'location': '/'.join(levels[:3]) if len(levels) >= 3 else '',
+    }
+
+
+class DatasetCatalog:
+    """基于SQLite的视频元数据目录，每个视频一条记录，以绝对路径为键"""
+
+    COLUMNS = ('path', 'root', 'relative_path', 'continent', 'country', 'city', 'city_dir',
+               'size', 'mtime_ns', 'duration', 'width', 'height', 'fps', 'video_codec',
+               'bit_rate', 'has_audio', 'probe_error', 'indexed_at',
+               'pix_fmt', 'audio_codec', 'audio_bit_rate', 'format_name')
+
+    # 旧版本创建的目录缺少的列（流复制判断需要像素格式和音频码率）
+    ADDED_COLUMNS = (('pix_fmt', 'TEXT'), ('audio_codec', 'TEXT'), ('audio_bit_rate', 'INTEGER'),
+                     ('format_name', 'TEXT'))
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """首次使用时创建数据库（调用方需持有锁）"""
+        if self._conn is None:
+            directory = os.path.dirname(os.path.abspath(self.db_path))
+            os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS videos (
+                    path TEXT PRIMARY KEY,
+                    root TEXT NOT NULL,
+                    relative_path TEXT NOT NULL,
+                    continent TEXT,
+                    country TEXT,
+                    city TEXT,
+                    city_dir TEXT,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    duration REAL,
+                    width INTEGER,
+                    height INTEGER,
+                    fps REAL,
+                    video_codec TEXT,
+                    bit_rate INTEGER,
+                    has_audio INTEGER,
+                    probe_error TEXT,
+                    indexed_at REAL NOT NULL,
+                    pix_fmt TEXT,
+                    audio_codec TEXT,
+                    audio_bit_rate INTEGER,
+                    format_name TEXT
+                )
+            ''')
+            columns = {row['name'] for row in self._conn.execute('PRAGMA table_info(videos)')}
+            for column, column_type in self.ADDED_COLUMNS:
+                if column not in columns:
+                    self._conn.execute(f'ALTER TABLE videos ADD COLUMN {column} {column_type}')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_videos_root ON videos (root)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_videos_city ON videos (city)')
+            self._conn.commit()
+        return self._conn
+
+    def refresh(self, root, workers=8, probe=True):
+        """
+        扫描数据集目录并增量更新目录：只探测新增或大小/修改时间变化的视频，删除已不存在的视频记录
+
+        Args:
+            workers: 并行ffprobe的线程数
+            probe: 是否获取时长/分辨率等信息（只需要文件列表和城市信息时可关闭）
+
+        Returns:
+            dict: scanned / indexed / unchanged / removed / failed / seconds
+        """
+        from compression_planner import probe_video
+
+        start_time = time.time()
+        root = os.path.abspath(root)
+        with self._lock:
+            conn = self._connect()
+            # 需要探测时，旧版本记录（没有像素格式）也重新探测
+            known = {row['path']: (row['size'], row['mtime_ns'],
+                                   (row['duration'] is not None and row['pix_fmt'] is not None) or not probe)
+                     for row in conn.execute('SELECT path, size, mtime_ns, duration, pix_fmt FROM videos WHERE root = ?',
+                                             (root,))}
+
+        pending = []
+        seen = set()
+        for path in find_video_files(root):
+            stat = os.stat(path)
+            seen.add(path)
+            previous = known.get(path)
+            if previous and previous[0] == stat.st_size and previous[1] == stat.st_mtime_ns and previous[2]:
+                continue
+            pending.append((path, stat))
+
+        def index(item):
+            path, stat = item
+            info, error = None, None
+            if probe:
+                try:
+                    info = probe_video(path)
+                    if not info:
+                        error = 'ffprobe未返回视频信息'
+                except Exception as e:
+                    error = str(e)
+            location = parse_dataset_path(path, root)
+            info = info or {}
+            return (path, root, os.path.relpath(path, root), location['continent'], location['country'],
+                    location['city'], location['city_dir'], stat.st_size, stat.st_mtime_ns,
+                    info.get('duration'), info.get('width'), info.get('height'), info.get('fps'),
+                    info.get('video_codec'), info.get('bit_rate'),
+                    int(info['has_audio']) if 'has_audio' in info else None, error, time.time(),
+                    info.get('pix_fmt'), info.get('audio_codec'), info.get('audio_bit_rate'), info.get('format_name'))
+
+        rows = []
+        if pending:
+            with ThreadPoolExecutor(max_workers=max(1, int(workers))) as executor:
+                rows = list(executor.map(index, pending))
+
+        removed = [path for path in known if path not in seen]
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(f"INSERT OR REPLACE INTO videos ({', '.join(self.COLUMNS)}) "
+                             f"VALUES ({', '.join('?' * len(self.COLUMNS))})", rows)
+            conn.executemany('DELETE FROM videos WHERE path = ?', [(path,) for path in removed])
+            conn.commit()
+
+        stats = {
+            'scanned': len(seen),
+            'indexed': len(rows),
+            'unchanged': len(seen) - len(rows),
+            'removed': len(removed),
+            'failed': sum(1 for row in rows if row[16]),
+            'seconds': round(time.time() - start_time, 2),
+        }
+        print(f"📚 数据集目录已更新: 扫描 {stats['scanned']} 个视频，索引 {stats['indexed']} 个，"
+              f"未变化 {stats['unchanged']} 个，删除 {stats['removed']} 个，失败 {stats['failed']} 个，"
+              f"耗时 {stats['seconds']}秒")
+        return stats
+
+    def list_videos(self, root=None, continent=None, country=None, city=None):
+        """按条件查询视频记录（按相对路径排序）"""
+        conditions, params = [], []
+        for column, value in (('root', os.path.abspath(root) if root else None), ('continent', continent),
+                              ('country', country), ('city', city)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        sql = 'SELECT * FROM videos'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        with self._lock:
+            rows = self._connect().execute(sql + ' ORDER BY root, relative_path', params).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, path):
+        """查询单个视频的记录；文件大小或修改时间与记录不一致（记录已过期）时返回 None"""
+        path = os.path.abspath(path)
+        with self._lock:
+            row = self._connect().execute('SELECT * FROM videos WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if stat.st_size != row['size'] or stat.st_mtime_ns != row['mtime_ns']:
+            return None
+        return dict(row)
+
+    def get_info(self, path):
+        """
+        返回与 compression_planner.probe_video 格式相同的视频信息，
+        目录中没有有效记录（或为旧版本记录，缺少像素格式等流复制判断需要的字段）时返回 None
+        """
+        record = self.get(path)
+        if not record or record['duration'] is None or record['pix_fmt'] is None:
+            return None
+        return {
+            'duration': record['duration'],
+            'width': record['width'] or 0,
+            'height': record['height'] or 0,
+            'fps': record['fps'] or 0.0,
+            'video_codec': record['video_codec'] or '',
+            'pix_fmt': record['pix_fmt'],
+            'has_audio': bool(record['has_audio']),
+            'audio_codec': record['audio_codec'] or '',
+            'audio_bit_rate': record['audio_bit_rate'] or 0,
+            'bit_rate': record['bit_rate'] or 0,
+            'size': record['size'],
+            'format_name': record['format_name'] or '',
+        }
+
+    def get_stats(self):
+        with self._lock:
+            conn = self._connect()
+            videos, size, duration = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(duration), 0) FROM videos').fetchone()
+            cities = conn.execute('SELECT COUNT(DISTINCT continent || country || city) FROM videos').fetchone()[0]
+        return {
+            'videos': videos,
+            'cities': cities,
+            'size_gb': round(size / 1024 ** 3, 2),
+            'duration_hours': round(duration / 3600, 2),
+        }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='扫描数据集并建立视频元数据目录')
+    parser.add_argument('root', help='数据集目录')
+    parser.add_argument('--db', default=os.getenv('DATASET_CATALOG_PATH', 'dataset_catalog.db'), help='目录数据库路径')
+    parser.add_argument('--workers', type=int, default=8, help='并行ffprobe的线程数')
+    args = parser.parse_args()
+
+    catalog = DatasetCatalog(args.db)
+    catalog.refresh(args.root, workers=args.workers)
+    print(catalog.get_stats())
+
+
+if __name__ == '__main__':
+    main()
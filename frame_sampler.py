@@ -0,0 +1,135 @@
+"""
+视频帧采样
+按场景切换检测或均匀间隔从视频中抽取少量代表帧，以多图请求代替整段视频上传；
+不支持视频输入的模型（如 Moondream）使用按时间顺序拼接的缩略图墙
+"""
+
+import math
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+from PIL import Image, ImageDraw
+
+from compression_planner import resolve_ffmpeg_path, probe_video
+from config import ensure_temp_dir
+
+
+SAMPLE_METHODS = ('scene', 'uniform')
+
+
+def _run_extract(ffmpeg_path, video_path, output_dir, video_filter, prefix, seek=None, timeout=600):
+    """
+    单次ffmpeg解码，按 video_filter 选择帧并写入 output_dir，
+    返回 [(时间戳, 文件路径), ...]（时间戳由 showinfo 输出解析）
+    """
+    cmd = [ffmpeg_path, '-hide_banner', '-nostdin']
+    if seek:
+        cmd += ['-ss', f"{seek:.3f}"]
+    cmd += ['-i', video_path, '-an', '-vf', f"{video_filter},showinfo", '-vsync', 'vfr', '-q:v', '3',
+            os.path.join(output_dir, f"{prefix}_%04d.jpg")]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(f"抽帧失败: {result.stderr[-500:]}")
+
+    timestamps = [float(t) + (seek or 0.0) for t in re.findall(r'pts_time:\s*([\d.]+)', result.stderr)]
+    files = sorted(name for name in os.listdir(output_dir) if name.startswith(f"{prefix}_"))
+    return [(timestamp, os.path.join(output_dir, name)) for timestamp, name in zip(timestamps, files)]
+
+
+def _pick_evenly(items, count):
+    """从按时间排序的列表中均匀挑选 count 个"""
+    if len(items) <= count:
+        return list(items)
+    step = len(items) / count
+    return [items[int(i * step + step / 2)] for i in range(count)]
+
+
+def sample_frames(video_path, count=8, max_size=768, method='scene', scene_threshold=0.3, info=None, backend=None):
+    """
+    从视频中抽取 count 个代表帧
+
+    Args:
+        count: 帧数
+        max_size: 帧的最长边（像素），只缩小不放大
+        method: 'scene' 场景切换检测（不足 count 帧时用均匀采样补足）/ 'uniform' 均匀采样
+        scene_threshold: 场景切换阈值（0-1，越小越敏感）
+        info: 已获取的视频信息（probe_video 结果）
+        backend: 媒体处理后端（media_backend），提供时均匀采样直接按时间点取帧，不写临时文件
+
+    Returns:
+        list: [{'timestamp': 秒, 'image': PIL.Image}, ...]，按时间排序
+    """
+    if method not in SAMPLE_METHODS:
+        raise ValueError(f"不支持的采样方式: {method}（可选: {', '.join(SAMPLE_METHODS)}）")
+
+    info = info or probe_video(video_path)
+    if not info or not info.get('duration'):
+        raise RuntimeError("无法获取视频时长，不能抽帧")
+
+    count = max(1, int(count))
+    duration = info['duration']
+    interval = duration / count
+    if method == 'uniform' and backend is not None:
+        return backend.read_frames(video_path, [interval * (i + 0.5) for i in range(count)], max_size)
+
+    ffmpeg_path = resolve_ffmpeg_path()
+    # 抽帧临时目录放在 TEMP_DIR 下（原地读取的视频所在目录可能只读或为NFS挂载）
+    output_dir = tempfile.mkdtemp(prefix='frames_', dir=ensure_temp_dir())
+    try:
+        selected = []
+        if method == 'scene':
+            # 第一帧 + 场景切换帧，一次解码完成
+            scene_frames = _run_extract(ffmpeg_path, video_path, output_dir,
+                                        f"select='eq(n\\,0)+gt(scene\\,{scene_threshold})'", 'scene')
+            selected = _pick_evenly(scene_frames, count)
+
+        if len(selected) < count:
+            # 均匀采样：从半个间隔处开始，每个间隔取一帧
+            uniform_frames = _run_extract(ffmpeg_path, video_path, output_dir,
+                                          f"select='isnan(prev_selected_t)+gte(t-prev_selected_t\\,{interval:.3f})'",
+                                          'uniform', seek=interval / 2)
+            # 跳过与已选场景帧距离过近的均匀帧
+            for timestamp, path in uniform_frames:
+                if len(selected) >= count:
+                    break
+                if all(abs(timestamp - t) >= interval / 2 for t, _ in selected):
+                    selected.append((timestamp, path))
+            selected.sort()
+
+        frames = []
+        for timestamp, path in selected:
+            with Image.open(path) as image:
+                image = image.convert('RGB')
+            image.thumbnail((max_size, max_size))
+            frames.append({'timestamp': round(timestamp, 3), 'image': image})
+        return frames
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def format_timestamp(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def make_contact_sheet(frames, max_size=1536):
+    """把帧按时间顺序从左到右、从上到下拼接为一张图，并在每格左上角标注时间"""
+    columns = math.ceil(math.sqrt(len(frames)))
+    rows = math.ceil(len(frames) / columns)
+    cell_width = max(frame['image'].width for frame in frames)
+    cell_height = max(frame['image'].height for frame in frames)
+
+    sheet = Image.new('RGB', (columns * cell_width, rows * cell_height), 'black')
+    draw = ImageDraw.Draw(sheet)
+    for i, frame in enumerate(frames):
+        x, y = (i % columns) * cell_width, (i // columns) * cell_height
+        sheet.paste(frame['image'], (x, y))
+        label = f"{i + 1} {format_timestamp(frame['timestamp'])}"
+        draw.rectangle([x, y, x + 8 * len(label) + 6, y + 16], fill='black')
+        draw.text((x + 3, y + 2), label, fill='white')
+
+    sheet.thumbnail((max_size, max_size))
+    return sheet
@@ -20,7 +20,8 @@ def install_ai_dependencies():
         "moondream",
         "opencv-python",
         "imageio",
-        "imageio-ffmpeg"
+        "imageio-ffmpeg",
+        "av"
     ]
     
     print("开始安装 AI 模型依赖...")
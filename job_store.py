@@ -0,0 +1,167 @@
+"""
+批量任务持久化存储
+任务、任务项和每个视频的结果在处理完成时立即写入SQLite（WAL），
+服务重启后从第一个未完成的视频继续处理，崩溃时最多重做正在处理的视频
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class JobStore:
+    """基于SQLite的批量任务存储（单连接 + 锁，供多个工作线程共用）"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """首次使用时创建目录和数据库（调用方需持有锁）"""
+        if self._conn is None:
+            db_dir = os.path.dirname(os.path.abspath(self.db_path))
+            os.makedirs(db_dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    question TEXT NOT NULL,
+                    skip_export INTEGER NOT NULL,
+                    video_options TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS job_items (
+                    job_id TEXT NOT NULL,
+                    item_index INTEGER NOT NULL,
+                    filename TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    city TEXT,
+                    in_place INTEGER NOT NULL DEFAULT 0,
+                    done INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    export TEXT,
+                    completed_at REAL,
+                    PRIMARY KEY (job_id, item_index)
+                )
+            ''')
+            # 旧版本创建的数据库没有 in_place 列（原地读取的服务器文件）
+            columns = {row['name'] for row in self._conn.execute('PRAGMA table_info(job_items)')}
+            if 'in_place' not in columns:
+                self._conn.execute('ALTER TABLE job_items ADD COLUMN in_place INTEGER NOT NULL DEFAULT 0')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)')
+            self._conn.commit()
+        return self._conn
+
+    def save_job(self, job):
+        """保存新提交的任务和全部任务项（一个事务）"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO jobs (job_id, question, skip_export, video_options, status, created_at, '
+                    'started_at, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (job.job_id, job.question, int(job.skip_export), json.dumps(job.video_options, ensure_ascii=False),
+                     job.status, job.created_at, job.started_at, job.finished_at)
+                )
+                conn.executemany(
+                    'INSERT OR REPLACE INTO job_items (job_id, item_index, filename, path, city, in_place) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [(job.job_id, index, item['filename'], item['path'], item.get('city'), int(item.get('in_place', False)))
+                     for index, item in enumerate(job.items)]
+                )
+
+    def add_item(self, job_id, index, item):
+        """保存流式上传中陆续加入的任务项"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO job_items (job_id, item_index, filename, path, city, in_place) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', (job_id, index, item['filename'], item['path'], item.get('city'),
+                                                          int(item.get('in_place', False))))
+
+    def mark_started(self, job_id, started_at):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("UPDATE jobs SET status = CASE WHEN status = 'queued' THEN 'running' ELSE status END, "
+                             "started_at = ? WHERE job_id = ? AND started_at IS NULL", (started_at, job_id))
+
+    def record_result(self, job_id, index, video_result, export_result=None):
+        """保存单个视频的结果"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    'UPDATE job_items SET done = 1, result = ?, export = ?, completed_at = ? '
+                    'WHERE job_id = ? AND item_index = ?',
+                    (json.dumps(video_result, ensure_ascii=False),
+                     json.dumps(export_result, ensure_ascii=False) if export_result else None,
+                     time.time(), job_id, index)
+                )
+
+    def update_status(self, job_id, status, finished_at=None):
+        """更新任务状态（暂停/恢复/取消/完成）"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('UPDATE jobs SET status = ?, finished_at = ? WHERE job_id = ?',
+                             (status, finished_at, job_id))
+
+    def load_unfinished(self):
+        """
+        读取未结束的任务（包括已暂停的任务，已完成和已取消的任务除外）
+
+        Returns:
+            list: [{'job_id', 'question', 'skip_export', 'video_options', 'status', 'created_at', 'started_at',
+                    'items': [{'filename', 'path', 'city', 'in_place', 'done', 'result', 'export'}, ...]}, ...]
+        """
+        with self._lock:
+            conn = self._connect()
+            jobs = [dict(row) for row in conn.execute(
+                "SELECT * FROM jobs WHERE status NOT IN ('completed', 'cancelled') ORDER BY created_at")]
+            for job in jobs:
+                job['skip_export'] = bool(job['skip_export'])
+                job['video_options'] = json.loads(job['video_options'])
+                job['items'] = [
+                    {
+                        'filename': row['filename'],
+                        'path': row['path'],
+                        'city': row['city'],
+                        'in_place': bool(row['in_place']),
+                        'done': bool(row['done']),
+                        'result': json.loads(row['result']) if row['result'] else None,
+                        'export': json.loads(row['export']) if row['export'] else None,
+                    }
+                    for row in conn.execute('SELECT * FROM job_items WHERE job_id = ? ORDER BY item_index',
+                                            (job['job_id'],))
+                ]
+            return jobs
+
+    def prune(self, finished_before):
+        """删除在 finished_before 之前结束的任务，返回删除的任务数"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                expired = [row[0] for row in conn.execute(
+                    "SELECT job_id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (finished_before,))]
+                conn.executemany('DELETE FROM job_items WHERE job_id = ?', [(job_id,) for job_id in expired])
+                conn.executemany('DELETE FROM jobs WHERE job_id = ?', [(job_id,) for job_id in expired])
+            return len(expired)
+
+    def get_stats(self):
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(status NOT IN ('completed', 'cancelled')), 0) FROM jobs").fetchone()
+            return {'path': self.db_path, 'jobs': row[0], 'unfinished_jobs': row[1]}
@@ -0,0 +1,293 @@
+"""
+媒体处理后端
+统一视频信息获取、按时间点取帧和按规划参数转码的接口：
+- subprocess: 调用 ffprobe / ffmpeg 子进程（默认）
+- pyav: 通过 PyAV（libav）在进程内解码/编码，解码帧直接转为 NumPy 数组送入缩放和编码器，
+  不启动子进程、不写中间文件
+
+用法（对比两种后端的耗时）:
+    python media_backend.py <视频文件> [--runs 3]
+"""
+
+import io
+import os
+import subprocess
+import threading
+import time
+from fractions import Fraction
+
+from PIL import Image
+
+from compression_planner import resolve_ffmpeg_path, probe_video, encode_with_plan
+
+
+MEDIA_BACKENDS = ('subprocess', 'pyav')
+
+
+class SubprocessBackend:
+    """ffprobe / ffmpeg 子进程后端"""
+
+    name = 'subprocess'
+
+    def probe(self, video_path):
+        return probe_video(video_path)
+
+    def read_frames(self, video_path, timestamps, max_size=768):
+        """
+        按时间点取帧（每个时间点在 -i 前快速定位，只解码附近的一个GOP），
+        JPEG 通过管道读回，不写临时文件
+
+        Returns:
+            list: [{'timestamp': 秒, 'image': PIL.Image}, ...]
+        """
+        ffmpeg_path = resolve_ffmpeg_path()
+        frames = []
+        for timestamp in timestamps:
+            cmd = [ffmpeg_path, '-hide_banner', '-nostdin', '-ss', f"{timestamp:.3f}", '-i', video_path,
+                   '-frames:v', '1', '-an', '-f', 'image2pipe', '-c:v', 'mjpeg', '-q:v', '3', 'pipe:1']
+            result = subprocess.run(cmd, capture_output=True, timeout=120)
+            if result.returncode != 0 or not result.stdout:
+                continue
+            with Image.open(io.BytesIO(result.stdout)) as image:
+                image = image.convert('RGB')
+            image.thumbnail((max_size, max_size))
+            frames.append({'timestamp': round(timestamp, 3), 'image': image})
+        return frames
+
+    def transcode(self, video_path, output_path, plan, two_pass=False, start=None, duration=None, threads=None):
+        """按规划参数编码，返回实际执行的编码遍数（两遍编码只在 libx264 下生效），失败返回 0"""
+        return encode_with_plan(video_path, output_path, plan, two_pass=two_pass, start=start, duration=duration,
+                                threads=threads)
+
+
+class PyAVBackend:
+    """PyAV（libav）进程内后端，需要安装 av 包"""
+
+    name = 'pyav'
+
+    def __init__(self):
+        import av
+        self._av = av
+
+    def probe(self, video_path):
+        """获取与 compression_planner.probe_video 格式相同的视频信息，失败时返回 None"""
+        try:
+            with self._av.open(video_path) as container:
+                video_stream = next((s for s in container.streams if s.type == 'video'), None)
+                audio_stream = next((s for s in container.streams if s.type == 'audio'), None)
+                if video_stream is None:
+                    return None
+                if container.duration:
+                    duration = container.duration / self._av.time_base
+                elif video_stream.duration and video_stream.time_base:
+                    duration = float(video_stream.duration * video_stream.time_base)
+                else:
+                    return None
+                rate = video_stream.average_rate or video_stream.guessed_rate
+                return {
+                    'duration': float(duration),
+                    'width': video_stream.codec_context.width,
+                    'height': video_stream.codec_context.height,
+                    'fps': float(rate) if rate else 0.0,
+                    'video_codec': video_stream.codec_context.name,
+                    'pix_fmt': video_stream.codec_context.pix_fmt or '',
+                    'has_audio': audio_stream is not None,
+                    'audio_codec': audio_stream.codec_context.name if audio_stream else '',
+                    'audio_bit_rate': (audio_stream.bit_rate or 0) if audio_stream else 0,
+                    'bit_rate': container.bit_rate or 0,
+                    'size': os.path.getsize(video_path),
+                    'format_name': container.format.name,
+                }
+        except Exception as e:
+            print(f"⚠️  PyAV获取视频信息失败: {e}")
+            return None
+
+    def read_frames(self, video_path, timestamps, max_size=768):
+        """按时间点定位到前一个关键帧并解码到该时间点，解码帧直接转为 NumPy 数组"""
+        frames = []
+        with self._av.open(video_path) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = 'AUTO'
+            for timestamp in timestamps:
+                container.seek(int(timestamp / stream.time_base), stream=stream, backward=True)
+                for frame in container.decode(stream):
+                    if frame.time is None or frame.time + 1e-3 < timestamp:
+                        continue
+                    image = Image.fromarray(frame.to_ndarray(format='rgb24'))
+                    image.thumbnail((max_size, max_size))
+                    frames.append({'timestamp': round(timestamp, 3), 'image': image})
+                    break
+        return frames
+
+    def transcode(self, video_path, output_path, plan, two_pass=False, start=None, duration=None, threads=None):
+        """
+        按规划参数在进程内编码（可只编码 start 起 duration 秒），返回实际执行的编码遍数，失败返回 0
+        PyAV 不支持两遍编码，two_pass 被忽略，成功时总是返回 1（由调用方的大小检查和码率修正兜底）
+        """
+        av = self._av
+        try:
+            with av.open(video_path) as source, av.open(output_path, 'w', format='mp4',
+                                                        options={'movflags': '+faststart'}) as target:
+                in_video = source.streams.video[0]
+                in_video.thread_type = 'AUTO'
+                if threads:
+                    in_video.codec_context.thread_count = threads
+
+                fps = Fraction(plan['fps']).limit_denominator(1001)
+                out_video = target.add_stream('libx264', rate=fps)
+                out_video.width = plan['width']
+                out_video.height = plan['height']
+                out_video.pix_fmt = 'yuv420p'
+                out_video.bit_rate = plan['video_kbps'] * 1000
+                out_video.options = {
+                    'preset': 'fast',
+                    'maxrate': f"{int(plan['video_kbps'] * 1.5)}k",
+                    'bufsize': f"{plan['video_kbps'] * 2}k",
+                }
+                if threads:
+                    out_video.codec_context.thread_count = threads
+
+                in_audio = out_audio = resampler = None
+                if plan['keep_audio'] and source.streams.audio:
+                    in_audio = source.streams.audio[0]
+                    out_audio = target.add_stream('aac', rate=in_audio.codec_context.sample_rate or 44100)
+                    out_audio.bit_rate = plan['audio_kbps'] * 1000
+                    out_audio.layout = 'mono'
+                    resampler = av.AudioResampler(format='fltp', layout='mono', rate=out_audio.rate)
+
+                begin = start or 0.0
+                end = begin + duration if duration else None
+                if begin:
+                    source.seek(int(begin * av.time_base), backward=True)
+
+                frame_interval = 1 / float(fps)
+                next_frame_time = begin
+                frame_index = 0
+                finished = False
+                streams = [s for s in (in_video, in_audio) if s is not None]
+                for packet in source.demux(*streams):
+                    for frame in packet.decode():
+                        if frame.time is None or frame.time < begin:
+                            continue
+                        if end is not None and frame.time >= end:
+                            # 视频流超过结束时间后停止读取
+                            finished = finished or packet.stream is in_video
+                            continue
+                        if packet.stream is in_video:
+                            # 按目标帧率丢帧
+                            if frame.time + 1e-6 < next_frame_time:
+                                continue
+                            next_frame_time += frame_interval
+                            scaled = frame.reformat(width=plan['width'], height=plan['height'], format='yuv420p')
+                            scaled.pts = frame_index
+                            scaled.time_base = Fraction(1) / fps
+                            frame_index += 1
+                            target.mux(out_video.encode(scaled))
+                        else:
+                            for resampled in resampler.resample(frame):
+                                resampled.pts = None
+                                target.mux(out_audio.encode(resampled))
+                    if finished:
+                        break
+
+                target.mux(out_video.encode())
+                if out_audio is not None:
+                    target.mux(out_audio.encode())
+            return 1 if frame_index > 0 and os.path.exists(output_path) else 0
+        except Exception as e:
+            print(f"PyAV编码失败: {e}")
+            return 0
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_media_backend(name=None):
+    """
+    获取媒体处理后端（同名后端只创建一次）
+
+    Args:
+        name: subprocess / pyav / auto（已安装 PyAV 时使用 pyav），为空时使用配置 MEDIA_BACKEND
+    """
+    if name is None:
+        from config import MEDIA_BACKEND
+        name = MEDIA_BACKEND
+    if name == 'auto':
+        try:
+            import av  # noqa: F401
+            name = 'pyav'
+        except ImportError:
+            name = 'subprocess'
+    if name not in MEDIA_BACKENDS:
+        raise ValueError(f"不支持的媒体处理后端: {name}（可选: {', '.join(MEDIA_BACKENDS)}, auto）")
+
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = PyAVBackend() if name == 'pyav' else SubprocessBackend()
+        return _backends[name]
+
+
+def benchmark_backends(video_path, runs=3, frame_count=8):
+    """
+    对比各后端获取视频信息、按时间点取帧和转码的平均耗时（秒），未安装的后端跳过
+
+    Returns:
+        dict: 后端名 -> {'probe': 秒, 'read_frames': 秒, 'transcode': 秒, 'output_mb': MB}
+    """
+    from compression_planner import plan_compression
+
+    results = {}
+    for name in MEDIA_BACKENDS:
+        try:
+            backend = get_media_backend(name)
+        except ImportError:
+            print(f"⚠️  未安装 {name} 后端依赖，跳过")
+            continue
+
+        timings = {'probe': 0.0, 'read_frames': 0.0, 'transcode': 0.0}
+        output_path = f"{os.path.splitext(video_path)[0]}_bench_{name}.mp4"
+        info = None
+        try:
+            for _ in range(runs):
+                started = time.perf_counter()
+                info = backend.probe(video_path)
+                timings['probe'] += time.perf_counter() - started
+                if not info:
+                    raise RuntimeError(f"{name} 后端无法获取视频信息")
+
+                timestamps = [info['duration'] * (i + 0.5) / frame_count for i in range(frame_count)]
+                started = time.perf_counter()
+                backend.read_frames(video_path, timestamps)
+                timings['read_frames'] += time.perf_counter() - started
+
+                plan = plan_compression(info, info['size'] / 2)
+                started = time.perf_counter()
+                backend.transcode(video_path, output_path, plan)
+                timings['transcode'] += time.perf_counter() - started
+
+            results[name] = {key: round(value / runs, 3) for key, value in timings.items()}
+            results[name]['output_mb'] = round(os.path.getsize(output_path) / 1024 / 1024, 2)
+        finally:
+            if os.path.exists(output_path):
+                os.unlink(output_path)
+    return results
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='对比 subprocess / pyav 媒体处理后端的耗时')
+    parser.add_argument('video', help='测试视频文件')
+    parser.add_argument('--runs', type=int, default=3, help='每项测试的重复次数')
+    args = parser.parse_args()
+
+    results = benchmark_backends(args.video, args.runs)
+    print(f"{'后端':<12}{'获取信息(秒)':>14}{'取帧(秒)':>12}{'转码(秒)':>12}{'输出(MB)':>12}")
+    for name, timing in results.items():
+        print(f"{name:<12}{timing['probe']:>14}{timing['read_frames']:>12}{timing['transcode']:>12}"
+              f"{timing['output_mb']:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+媒体请求体编码
+分块把视频文件编码为Base64并直接拼上data URL前缀，
+避免整文件读入内存后再生成Base64字节串、字符串和data URL等多份完整拷贝
+
+运行 python media_payload.py [视频] 测量各种请求体构造方式的峰值RSS
+"""
+
+import base64
+import binascii
+import json
+import os
+import subprocess
+import sys
+
+
+# 每次读取的字节数，必须是3的倍数，保证各块的Base64编码结果可以直接拼接
+CHUNK_SIZE = 768 * 1024
+
+# measure_payload_memory 对比的请求体构造方式
+PAYLOAD_VARIANTS = ('whole_file', 'chunked', 'chunked_json', 'raw_bytes')
+
+
+def base64_encoded_size(size):
+    """Base64编码后的字节数"""
+    return 4 * ((size + 2) // 3)
+
+
+def encode_file_base64(path, prefix=''):
+    """
+    分块Base64编码文件，返回 prefix + Base64 字符串（如 data URL）
+
+    内存占用：编码过程中峰值约为Base64大小的2倍（各块字符串 + 拼接结果），返回后只保留一份；
+    SDK序列化JSON请求体时还会再产生一份JSON字符串和字节，请求期间峰值约为Base64大小的3倍。
+    原来的方式（整文件bytes + Base64 bytes + 字符串，调用方再拼接data URL）在请求期间会同时保留两份Base64字符串
+    """
+    parts = [prefix]
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            parts.append(binascii.b2a_base64(chunk, newline=False).decode('ascii'))
+    return ''.join(parts)
+
+
+def read_file_bytes(path):
+    """读取文件原始字节（用于直接接收字节的API，如Gemini），不经过Base64编码再解码"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _peak_rss_bytes():
+    """
+    当前进程的峰值常驻内存（RSS，字节）
+
+    Linux 上读取 /proc/self/status 的 VmHWM：ru_maxrss 在 exec 后会沿用父进程的峰值，
+    父进程占用较多内存时子进程的基线会被抬高；其他平台使用 ru_maxrss（macOS 以字节计）
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _build_payload(variant, path, prefix):
+    """按指定方式构造请求体，返回构造结果（调用方持有期间即为请求期间的常驻内存）"""
+    if variant == 'whole_file':
+        # 原方式：整文件读入 → Base64 bytes → 字符串 → 拼接data URL
+        with open(path, 'rb') as f:
+            data = f.read()
+        return prefix + base64.b64encode(data).decode('utf-8')
+    if variant == 'chunked':
+        return encode_file_base64(path, prefix)
+    if variant == 'chunked_json':
+        # SDK发送时还会把整个请求序列化为JSON字符串，再编码为字节
+        payload = encode_file_base64(path, prefix)
+        return payload, json.dumps({'url': payload}).encode('utf-8')
+    if variant == 'raw_bytes':
+        return read_file_bytes(path)
+    raise ValueError(f"未知的请求体构造方式: {variant}")
+
+
+def _measure_in_process(variant, path, prefix):
+    """在当前进程中构造一次请求体，返回峰值RSS相对构造前的增量（MB）"""
+    baseline = _peak_rss_bytes()
+    payload = _build_payload(variant, path, prefix)
+    peak = _peak_rss_bytes()
+    del payload
+    return round((peak - baseline) / 1024 / 1024, 2)
+
+
+def measure_payload_memory(path, prefix='', variants=PAYLOAD_VARIANTS):
+    """
+    测量各种请求体构造方式的峰值RSS增量（MB）
+
+    峰值RSS只增不减，每种方式在独立的子进程中测量（Linux / macOS）
+
+    Returns:
+        dict: file_mb / base64_mb，以及每种方式的峰值增量 {variant: peak_mb}
+    """
+    results = {
+        'file_mb': round(os.path.getsize(path) / 1024 / 1024, 2),
+        'base64_mb': round((base64_encoded_size(os.path.getsize(path)) + len(prefix)) / 1024 / 1024, 2),
+    }
+    for variant in variants:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--measure', variant, path, prefix],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results[variant] = float(output.strip().splitlines()[-1])
+    return results
+
+
+def main():
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='测量视频请求体编码的峰值内存（RSS）')
+    parser.add_argument('video', nargs='?', help='测试视频文件（默认生成随机内容的合成文件）')
+    parser.add_argument('--size-mb', type=float, default=7, help='合成文件大小（MB）')
+    parser.add_argument('--measure', nargs=2, metavar=('VARIANT', 'PATH'), help=argparse.SUPPRESS)
+    parser.add_argument('prefix', nargs='?', default='data:video/mp4;base64,', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        # 子进程：只测量一种方式
+        variant, path = args.measure
+        print(_measure_in_process(variant, path, args.prefix))
+        return
+
+    synthetic = None
+    video_path = args.video
+    if video_path is None:
+        fd, synthetic = tempfile.mkstemp(suffix='.mp4')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(os.urandom(int(args.size_mb * 1024 * 1024)))
+        video_path = synthetic
+    try:
+        results = measure_payload_memory(video_path, args.prefix)
+    finally:
+        if synthetic:
+            os.unlink(synthetic)
+
+    print(f"文件 {results['file_mb']}MB，Base64（含前缀） {results['base64_mb']}MB")
+    print(f"{'构造方式':<16}{'峰值RSS增量(MB)':>18}")
+    for variant in PAYLOAD_VARIANTS:
+        print(f"{variant:<16}{results[variant]:>18}")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,94 +5,209 @@
 
 import base64
 import io
-import requests
-import time
+import os
 import threading
-from PIL import Image
-from config import MODEL_TYPE, MODEL_CONFIG
+import time
+from contextlib import ExitStack, contextmanager, asynccontextmanager
+from config import (MODEL_TYPE, MODEL_CONFIG, RATE_LIMITS, ADAPTIVE_RATE_CONTROL, API_KEY_COOLDOWN_SECONDS,
+                    RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_DIR, RESPONSE_CACHE_MAX_MB, RESPONSE_CACHE_MAX_AGE_DAYS,
+                    TRANSCODE_CACHE_ENABLED, TRANSCODE_CACHE_DIR, TRANSCODE_CACHE_MAX_MB,
+                    COMPRESSION_TARGET_MB, COMPRESSION_TWO_PASS, COMPRESSION_KEEP_AUDIO,
+                    COMPRESSION_REMUX_ENABLED, COMPRESSION_REMUX_MAX_TRIM,
+                    COMPRESSION_PARALLEL_WORKERS, COMPRESSION_PARALLEL_MIN_SECONDS,
+                    LONG_VIDEO_SEGMENT_ENABLED, LONG_VIDEO_MIN_HEIGHT, LONG_VIDEO_MAX_SEGMENTS,
+                    LONG_VIDEO_SEGMENT_WORKERS, VIDEO_QUERY_STRATEGY, FRAME_SAMPLE_COUNT, FRAME_SAMPLE_SIZE,
+                    FRAME_SAMPLE_METHOD, FRAME_SCENE_THRESHOLD, DATASET_CATALOG_PATH, ensure_temp_dir,
+                    ROUTER_PROVIDERS, ROUTER_FAILURE_THRESHOLD, ROUTER_COOLDOWN_SECONDS, PROVIDER_CAPABILITIES)
+from rate_limiter import RateLimiterRegistry, is_rate_limit_error, is_timeout_error, mask_api_key
+from response_cache import ResponseCache, file_sha256, image_sha256
+from transcode_cache import TranscodeCache
+from compression_planner import (CompressionStats, resolve_ffmpeg_path, get_encoder_capabilities, get_encoder_status,
+                                 PRESET_ENCODERS, plan_compression, plan_segments, plan_remux, remux_with_plan,
+                                 encode_parallel_with_plan)
+from media_payload import encode_file_base64, read_file_bytes
+from frame_sampler import sample_frames, make_contact_sheet, format_timestamp
+from dataset_catalog import DatasetCatalog
+from media_backend import get_media_backend
+from provider_router import ProviderRouter
+
+
+def compression_profile(target_mb):
+    """压缩配置标识（作为转码缓存键的一部分，修改压缩策略时需要同步修改）"""
+    return (f"planner-v1:target={target_mb}MB:"
+            f"two_pass={COMPRESSION_TWO_PASS}:audio={COMPRESSION_KEEP_AUDIO}:"
+            f"remux={COMPRESSION_REMUX_ENABLED}:trim={COMPRESSION_REMUX_MAX_TRIM}")
+
+
+# OpenAI / 通义千问视频请求使用的data URL前缀
+VIDEO_DATA_URL_PREFIX = "data:video/mp4;base64,"
 
 class ModelManager:
     def __init__(self):
         self.model_type = MODEL_TYPE
         self.config = MODEL_CONFIG.get(self.model_type, {})
-        self.model = None
         self.moondream_model = None  # 专门用于目标检测
+        
+        # 多提供商路由：按请求体大小和各提供商的健康状况选择提供商，失败时切换到下一个
+        self.router = ProviderRouter(ROUTER_PROVIDERS, PROVIDER_CAPABILITIES,
+                                     ROUTER_FAILURE_THRESHOLD, ROUTER_COOLDOWN_SECONDS)
+        self._providers = {}  # (提供商, API Key) -> 已初始化的客户端（初始化失败为 None）
         self.cuda_available = False
         
-        # 请求限流机制
-        self._rate_limit_lock = threading.Lock()  # 线程锁，确保线程安全
-        self._last_request_time = {}  # 记录每种API类型上次请求时间
-        self._request_interval = {
-            'qwen': 5.0,      # 通义千问：每5秒最多1次请求（更保守，避免触发频率限制）
-            'openai': 1.0,    # OpenAI：每1秒最多1次请求
-            'claude': 1.5,    # Claude：每1.5秒最多1次请求
-            'gemini': 1.0,    # Gemini：每1秒最多1次请求
-            'default': 5.0    # 默认：每5秒最多1次请求
-        }
+        # 请求限流机制：每个提供商一个API Key池，每个Key一个自适应限流控制器（令牌桶+并发上限），互不阻塞
+        api_keys = {provider: config.get("api_keys", []) for provider, config in MODEL_CONFIG.items()}
+        if len(api_keys.get("gemini", [])) > 1:
+            # google.generativeai 的API Key为进程级全局配置，无法按请求切换
+            print("⚠️  Gemini SDK只支持一个全局API Key，GEMINI_API_KEYS 中只使用第一个Key")
+            api_keys["gemini"] = api_keys["gemini"][:1]
+        self._rate_limiters = RateLimiterRegistry(RATE_LIMITS, ADAPTIVE_RATE_CONTROL, api_keys, API_KEY_COOLDOWN_SECONDS)
+        
+        # 响应缓存：相同媒体内容+问题+模型直接返回缓存结果
+        self.response_cache = None
+        if RESPONSE_CACHE_ENABLED:
+            self.response_cache = ResponseCache(
+                RESPONSE_CACHE_DIR,
+                max_bytes=RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+                max_age=RESPONSE_CACHE_MAX_AGE_DAYS * 24 * 3600
+            )
+        
+        # 转码缓存：同一视频按同一压缩配置只压缩一次
+        self.transcode_cache = None
+        if TRANSCODE_CACHE_ENABLED:
+            self.transcode_cache = TranscodeCache(TRANSCODE_CACHE_DIR, max_bytes=TRANSCODE_CACHE_MAX_MB * 1024 * 1024)
+        
+        # 规划压缩统计（一次命中率）
+        self.compression_stats = CompressionStats()
+        
+        # 媒体处理后端：获取视频信息、抽帧和规划压缩使用 ffmpeg 子进程或 PyAV 进程内编解码
+        try:
+            self.media_backend = get_media_backend()
+        except ImportError:
+            print("⚠️  未安装PyAV，媒体处理后端回退为ffmpeg子进程")
+            self.media_backend = get_media_backend('subprocess')
+        
+        # 文件内容哈希缓存：(路径, 大小, 修改时间) -> SHA-256，避免同一文件重复读取计算
+        self._hash_memo = {}
+        self._hash_lock = threading.Lock()
+        
+        # 视频信息缓存：优先查询数据集目录（dataset_catalog.py 建立），其次按 (路径, 大小, 修改时间) 缓存ffprobe结果
+        self.catalog = None
+        self._probe_memo = {}
+        
+        # 压缩/抽帧的临时文件目录（导入配置时不再创建）
+        ensure_temp_dir()
+        
+        # 提供商SDK和Moondream在首次使用时初始化（线程安全），服务启动时不导入SDK
+        self._init_lock = threading.Lock()
+        self._moondream_initialized = False
+        self.init_timings = {}  # 初始化阶段 -> 耗时（秒）
         
-        self._check_cuda_availability()
-        self._initialize_model()
-        self._initialize_moondream()
+        # 编码器/硬件加速探测在后台线程进行，不阻塞启动
+        threading.Thread(target=self._check_cuda_availability, name="encoder-probe", daemon=True).start()
     
-    def _initialize_model(self):
-        """初始化指定的模型"""
+    def _get_provider(self, provider, api_key=None):
+        """
+        获取提供商使用指定API Key的客户端（默认为第一个Key），首次调用时初始化（每个Key只初始化一次），
+        初始化失败返回 None
+        """
+        if api_key is None:
+            api_key = MODEL_CONFIG.get(provider, {}).get("api_key", "")
+        key = (provider, api_key)
+        if key not in self._providers:
+            with self._init_lock:
+                if key not in self._providers:
+                    started = time.perf_counter()
+                    self._providers[key] = self._initialize_provider(provider, api_key)
+                    self.init_timings.setdefault(provider, round(time.perf_counter() - started, 3))
+        return self._providers[key]
+    
+    def _ensure_moondream(self):
+        """首次调用目标检测时初始化Moondream模型（只初始化一次）"""
+        if not self._moondream_initialized:
+            with self._init_lock:
+                if not self._moondream_initialized:
+                    started = time.perf_counter()
+                    self._initialize_moondream()
+                    self.init_timings['moondream_detect'] = round(time.perf_counter() - started, 3)
+                    self._moondream_initialized = True
+        return self.moondream_model is not None
+    
+    def get_init_status(self):
+        """获取延迟初始化状态和各阶段耗时"""
+        # 其他线程可能正在初始化客户端，先在锁内复制一份再统计
+        with self._init_lock:
+            providers = list(self._providers.items())
+        counts = {}
+        for (provider, _), client in providers:
+            counts[provider] = counts.get(provider, 0) + (client is not None)
+        return {
+            "providers": counts,
+            "moondream_initialized": self._moondream_initialized,
+            "timings": dict(self.init_timings),
+        }
+    
+    def _initialize_provider(self, provider, api_key):
+        """初始化指定提供商使用指定API Key的客户端"""
+        config = MODEL_CONFIG.get(provider, {})
         try:
-            if self.model_type == "moondream":
+            if provider == "moondream":
                 import moondream as md
-                self.model = md.vl(api_key=self.config["api_key"])
-                print(f"✓ {self.model_type} 模型初始化成功")
+                client = md.vl(api_key=api_key)
                 
-            elif self.model_type == "openai":
+            elif provider == "openai":
                 import openai
-                self.client = openai.OpenAI(
-                    api_key=self.config["api_key"],
-                    base_url=self.config.get("base_url", "https://api.openai.com/v1")
+                client = openai.OpenAI(
+                    api_key=api_key,
+                    base_url=config.get("base_url", "https://api.openai.com/v1")
                 )
-                print(f"✓ {self.model_type} 模型初始化成功")
                 
-            elif self.model_type == "claude":
+            elif provider == "claude":
                 import anthropic
-                self.client = anthropic.Anthropic(api_key=self.config["api_key"])
-                print(f"✓ {self.model_type} 模型初始化成功")
+                client = anthropic.Anthropic(api_key=api_key)
                 
-            elif self.model_type == "gemini":
+            elif provider == "gemini":
                 import google.generativeai as genai
-                genai.configure(api_key=self.config["api_key"])
-                self.model = genai.GenerativeModel(self.config["model"])
-                print(f"✓ {self.model_type} 模型初始化成功")
+                genai.configure(api_key=api_key)
+                client = genai.GenerativeModel(config["model"])
                 
-            elif self.model_type == "qwen":
+            elif provider == "qwen":
                 import dashscope
-                dashscope.api_key = self.config["api_key"]
-                self.model = "qwen"  # 设置模型标识
-                print(f"✓ {self.model_type} 模型初始化成功")
+                dashscope.api_key = dashscope.api_key or api_key
+                client = "qwen"  # 通义千问每次调用直接传递API Key，这里只作为已初始化标识
                 
             else:
-                raise ValueError(f"不支持的模型类型: {self.model_type}")
-                
+                raise ValueError(f"不支持的模型类型: {provider}")
+            
+            print(f"✓ {provider} 模型初始化成功 (API Key {mask_api_key(api_key)})")
+            return client
         except Exception as e:
-            print(f"❌ {self.model_type} 模型初始化失败: {e}")
-            self.model = None
+            print(f"❌ {provider} 模型初始化失败 (API Key {mask_api_key(api_key)}): {e}")
+            return None
     
     def _check_cuda_availability(self):
-        """检测CUDA是否可用"""
+        """
+        检测CUDA是否可用：启动时探测一次ffmpeg的编码器和硬件加速（结果缓存），
+        不导入torch，视频压缩直接使用探测时选出的编码器
+        """
         try:
-            import torch
-            self.cuda_available = torch.cuda.is_available()
+            capabilities = get_encoder_capabilities()
+            self.cuda_available = capabilities['cuda_available']
             if self.cuda_available:
-                gpu_count = torch.cuda.device_count()
-                gpu_name = torch.cuda.get_device_name(0)
-                print(f"✅ CUDA检测: 发现 {gpu_count} 个GPU - {gpu_name}")
+                print(f"✅ CUDA检测: ffmpeg支持CUDA硬件加速，视频编码器 {capabilities['video_codec']}")
             else:
-                print("⚠️  CUDA检测: 未发现可用GPU，将使用CPU处理")
-        except ImportError:
-            print("⚠️  CUDA检测: 未安装PyTorch，将使用CPU处理")
-            self.cuda_available = False
+                print(f"⚠️  CUDA检测: 未发现可用的CUDA硬件加速，视频编码器 {capabilities['video_codec']}")
         except Exception as e:
             print(f"⚠️  CUDA检测失败: {e}，将使用CPU处理")
             self.cuda_available = False
         
         return self.cuda_available
+    
+    def get_encoder_status(self):
+        """
+        获取启动时探测到的视频编码器和硬件加速信息（供健康检查使用）
+        不触发也不等待探测：探测未完成时只返回 status 为 'pending' / 'probing'
+        """
+        return get_encoder_status()
 
     def _initialize_moondream(self):
         """初始化Moondream模型（专门用于目标检测）"""
@@ -104,29 +219,105 @@ class ModelManager:
             print(f"❌ Moondream 目标检测模型初始化失败: {e}")
             self.moondream_model = None
     
-    def _wait_for_rate_limit(self, api_type='default'):
+    @contextmanager
+    def _rate_limited(self, api_type='default'):
         """
-        请求限流：确保API调用之间有足够的间隔，避免触发频率限制
+        请求限流：进入时从该API类型的Key池中选择负载最低的可用API Key，获取该Key的并发名额和令牌，
+        产出选中的API Key，退出时把结果反馈给该Key的自适应控制器
+        - 正常退出：记录延迟，逐步提高速率和并发
+        - 抛出429/配额错误：降低速率和并发，该Key进入冷却期
+        - 抛出超时错误：降低速率和并发
+        - 其他错误（如视频无效）不影响限流
+        令牌在锁内预约、在锁外等待，等待中的线程不会阻塞其他API类型的请求
+        
+        用法:
+            with self._rate_limited('openai') as api_key:
+                response = self._get_provider('openai', api_key).chat.completions.create(...)
         
         Args:
             api_type: API类型 ('qwen', 'openai', 'claude', 'gemini', 'default')
         """
-        with self._rate_limit_lock:
-            current_time = time.time()
-            interval = self._request_interval.get(api_type, self._request_interval['default'])
-            
-            # 获取该API类型上次请求时间
-            last_time = self._last_request_time.get(api_type, 0)
-            
-            # 计算需要等待的时间
-            elapsed = current_time - last_time
-            if elapsed < interval:
-                wait_time = interval - elapsed
-                print(f"⏳ 请求限流：距离上次{api_type} API调用仅过了{elapsed:.2f}秒，等待{wait_time:.2f}秒后继续...")
-                time.sleep(wait_time)
-            
-            # 更新最后请求时间
-            self._last_request_time[api_type] = time.time()
+        pool = self._rate_limiters.get(api_type)
+        key, wait_time = pool.acquire()
+        if wait_time > 0:
+            print(f"⏳ 请求限流：{api_type} API令牌不足（Key {mask_api_key(key.api_key)}），已等待{wait_time:.2f}秒")
+        
+        start_time = time.monotonic()
+        try:
+            yield key.api_key
+        except BaseException as e:
+            # 包括 KeyboardInterrupt 等非 Exception 异常，确保并发名额总能归还
+            throttled = is_rate_limit_error(e)
+            pool.release(key, throttled=throttled, timed_out=not throttled and is_timeout_error(e))
+            raise
+        else:
+            pool.release(key, latency=time.monotonic() - start_time)
+    
+    @asynccontextmanager
+    async def _rate_limited_async(self, api_type='default'):
+        """
+        _rate_limited 的协程版本，供并发工作协程在事件循环中使用
+        等待名额或令牌时被取消不会占用名额；请求过程中被取消（CancelledError）同样归还名额
+        """
+        pool = self._rate_limiters.get(api_type)
+        key, wait_time = await pool.acquire_async()
+        if wait_time > 0:
+            print(f"⏳ 请求限流：{api_type} API令牌不足（Key {mask_api_key(key.api_key)}），已等待{wait_time:.2f}秒")
+        
+        start_time = time.monotonic()
+        try:
+            yield key.api_key
+        except BaseException as e:
+            throttled = is_rate_limit_error(e)
+            pool.release(key, throttled=throttled, timed_out=not throttled and is_timeout_error(e))
+            raise
+        else:
+            pool.release(key, latency=time.monotonic() - start_time)
+    
+    def get_rate_limit_status(self):
+        """获取各API类型每个API Key的当前速率、并发上限、配额计数和冷却状态"""
+        return self._rate_limiters.get_state()
+    
+    def _file_hash(self, path):
+        """计算文件内容的SHA-256，同一文件（路径、大小、修改时间均未变）只计算一次"""
+        stat = os.stat(path)
+        memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._hash_lock:
+            digest = self._hash_memo.get(memo_key)
+        if digest:
+            return digest
+        
+        digest = file_sha256(path)
+        with self._hash_lock:
+            if len(self._hash_memo) >= 1024:
+                self._hash_memo.clear()
+            self._hash_memo[memo_key] = digest
+        return digest
+    
+    def _probe_video(self, path):
+        """获取视频时长/分辨率等信息：数据集目录中有有效记录时直接使用，否则调用ffprobe（同一文件只探测一次）"""
+        if self.catalog is None and DATASET_CATALOG_PATH and os.path.exists(DATASET_CATALOG_PATH):
+            self.catalog = DatasetCatalog(DATASET_CATALOG_PATH)
+        if self.catalog is not None:
+            try:
+                info = self.catalog.get_info(path)
+                if info:
+                    return info
+            except Exception as e:
+                print(f"⚠️  查询数据集目录失败: {e}")
+        
+        stat = os.stat(path)
+        memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._hash_lock:
+            if memo_key in self._probe_memo:
+                return self._probe_memo[memo_key]
+        
+        info = self.media_backend.probe(path)
+        with self._hash_lock:
+            if len(self._probe_memo) >= 1024:
+                self._probe_memo.clear()
+            self._probe_memo[memo_key] = info
+        return info
     
     def _image_to_base64(self, image):
         """将PIL图像转换为base64字符串"""
@@ -135,9 +326,20 @@ class ModelManager:
         img_str = base64.b64encode(buffer.getvalue()).decode()
         return img_str
     
-    def _video_to_base64(self, video_path):
-        """将视频文件转换为base64字符串，确保Base64编码后<10MB（通义千问限制）"""
-        import os
+    def _compression_target_mb(self, provider):
+        """
+        提供商的压缩目标大小：COMPRESSION_TARGET_MB 对应10MB的Base64请求体上限（通义千问），
+        其他提供商按各自的请求体上限等比例调整，上限较大的提供商不做不必要的压缩
+        """
+        return round(COMPRESSION_TARGET_MB * PROVIDER_CAPABILITIES[provider]['max_payload_mb'] / 10, 2)
+    
+    @contextmanager
+    def _prepared_video(self, video_path, provider):
+        """
+        准备待上传的视频文件：Base64编码后会超过该提供商的请求体上限（如通义千问10MB）时先压缩，
+        产出实际要上传的文件路径，退出时清理临时压缩文件（或释放转码缓存条目）
+        """
+        max_payload_mb = PROVIDER_CAPABILITIES[provider]['max_payload_mb']
         
         # 检查文件大小
         file_size = os.path.getsize(video_path)
@@ -147,25 +349,26 @@ class ModelManager:
         # 计算Base64编码后的大小
         base64_size_mb = size_mb * 1.33
         
-        compressed_path = None
-        original_video_path = video_path
+        # 压缩后的文件在上传结束前保持可用（转码缓存条目不会被淘汰），退出时一并释放
+        stack = ExitStack()
         
-        # 如果Base64编码后会超过10MB，需要压缩
-        if base64_size_mb > 10:
+        # 如果Base64编码后会超过请求体上限，需要压缩
+        if base64_size_mb > max_payload_mb:
             print(f"⚠️  视频文件({size_mb:.1f}MB)，Base64编码后将达到{base64_size_mb:.1f}MB")
-            print(f"📋 通义千问官方限制：Base64编码视频必须<10MB")
-            print(f"🔄 自动压缩视频以符合官方限制...")
+            print(f"📋 {provider} 请求体限制：Base64编码视频必须<{max_payload_mb:g}MB")
+            print(f"🔄 自动压缩视频以符合限制...")
             
-            compressed_path = self._compress_video(video_path)
+            compressed_path = stack.enter_context(
+                self._compressed_video(video_path, self._compression_target_mb(provider)))
             if compressed_path:
                 compressed_size = os.path.getsize(compressed_path)
                 compressed_size_mb = compressed_size / 1024 / 1024
                 compressed_base64_size_mb = compressed_size_mb * 1.33
                 
                 # 检查压缩后是否满足要求
-                if compressed_base64_size_mb < 10:
+                if compressed_base64_size_mb < max_payload_mb:
                     video_path = compressed_path
-                    print(f"✅ 压缩完成，新大小: {compressed_size_mb:.1f}MB (Base64后: {compressed_base64_size_mb:.2f}MB < 10MB)")
+                    print(f"✅ 压缩完成，新大小: {compressed_size_mb:.1f}MB (Base64后: {compressed_base64_size_mb:.2f}MB < {max_payload_mb:g}MB)")
                 else:
                     print(f"⚠️  压缩后Base64仍为{compressed_base64_size_mb:.2f}MB，需要进一步压缩...")
                     # 尝试更激进的压缩
@@ -173,54 +376,258 @@ class ModelManager:
                     print(f"🔄 继续处理，如果API失败请手动压缩视频")
             else:
                 print(f"❌ 压缩失败，建议：")
-                print(f"   1) 手动压缩视频到<7.5MB（Base64后<10MB）")
+                print(f"   1) 手动压缩视频到<{max_payload_mb / 1.33:.1f}MB（Base64后<{max_payload_mb:g}MB）")
                 print(f"   2) 或使用公网URL方式（支持<2GB）")
-                print(f"   3) 或切换到其他模型（如Claude/OpenAI）")
+                print(f"   3) 或在 ROUTER_PROVIDERS 中加入请求体上限更大的提供商（如Claude）")
                 print(f"⚠️  尝试使用原文件，可能会因文件过大而失败...")
         else:
-            print(f"✅ 视频文件大小: {size_mb:.1f}MB (Base64后: {base64_size_mb:.2f}MB < 10MB)，无需压缩")
+            print(f"✅ 视频文件大小: {size_mb:.1f}MB (Base64后: {base64_size_mb:.2f}MB < {max_payload_mb:g}MB)，{provider} 无需压缩")
         
         try:
-            with open(video_path, 'rb') as video_file:
-                video_bytes = video_file.read()
-                video_str = base64.b64encode(video_bytes).decode()
-            
-            # 最终验证Base64大小
-            final_base64_size_mb = len(video_str) / 1024 / 1024
-            if final_base64_size_mb > 10:
-                print(f"⚠️  警告：Base64编码后大小为{final_base64_size_mb:.2f}MB，超过10MB限制，API可能会拒绝")
-            else:
-                print(f"✅ Base64编码后大小: {final_base64_size_mb:.2f}MB，符合要求")
-            
-            return video_str
+            yield video_path
+        finally:
+            stack.close()
+    
+    def _video_to_base64(self, video_path, provider, prefix=''):
+        """
+        将视频文件转换为base64字符串，确保Base64编码后不超过该提供商的请求体上限
+        
+        Args:
+            prefix: 拼接在Base64前面的前缀（如 "data:video/mp4;base64,"），
+                    直接写入编码缓冲区，避免再拼接出一份完整的字符串拷贝
+        """
+        with self._prepared_video(video_path, provider) as upload_path:
+            video_str = encode_file_base64(upload_path, prefix)
+        
+        # 最终验证Base64大小
+        max_payload_mb = PROVIDER_CAPABILITIES[provider]['max_payload_mb']
+        final_base64_size_mb = (len(video_str) - len(prefix)) / 1024 / 1024
+        if final_base64_size_mb > max_payload_mb:
+            print(f"⚠️  警告：Base64编码后大小为{final_base64_size_mb:.2f}MB，超过{provider}的{max_payload_mb:g}MB限制，API可能会拒绝")
+        else:
+            print(f"✅ Base64编码后大小: {final_base64_size_mb:.2f}MB，符合要求")
+        
+        return video_str
+    
+    def _video_to_bytes(self, video_path, provider):
+        """读取（必要时先压缩的）视频原始字节，供直接接收字节的API使用，不经过Base64往返"""
+        with self._prepared_video(video_path, provider) as upload_path:
+            return read_file_bytes(upload_path)
+    
+    @contextmanager
+    def _compressed_video(self, video_path, target_mb=COMPRESSION_TARGET_MB):
+        """
+        压缩视频，产出压缩后的文件路径（失败时为 None）
+        启用转码缓存时同一源视频按同一压缩配置（含目标大小）只压缩一次，使用期间缓存条目不会被其他请求淘汰；
+        未启用时退出后删除临时压缩文件
+        """
+        if self.transcode_cache is not None:
+            cache_key = self.transcode_cache.make_key(self._file_hash(video_path), compression_profile(target_mb))
+            with self.transcode_cache.use(cache_key, lambda: self._compress_video(video_path, target_mb)) as compressed_path:
+                yield compressed_path
+            return
+        
+        compressed_path = self._compress_video(video_path, target_mb)
+        try:
+            yield compressed_path
         finally:
-            # 清理压缩后的临时文件
-            if compressed_path and compressed_path != original_video_path and os.path.exists(compressed_path):
+            if compressed_path and compressed_path != video_path and os.path.exists(compressed_path):
                 try:
                     os.unlink(compressed_path)
                     print(f"🧹 已清理临时压缩文件: {os.path.basename(compressed_path)}")
                 except Exception as e:
                     print(f"⚠️  清理临时文件失败: {e}")
     
-    def _compress_video(self, video_path):
-        """压缩视频文件以减少处理时间，支持CUDA加速"""
-        compressed_path = None
+    def _cleanup_compress_intermediates(self, compressed_path, keep=None):
+        """清理本次逐级压缩留下的中间文件（compressed_path 及其 _ultra / _final 文件），保留 keep"""
+        ultra_compressed_path = f"{os.path.splitext(compressed_path)[0]}_ultra.mp4"
+        final_compressed_path = f"{os.path.splitext(ultra_compressed_path)[0]}_final.mp4"
+        for path in (compressed_path, ultra_compressed_path, final_compressed_path):
+            if path != keep and os.path.exists(path):
+                try:
+                    os.unlink(path)
+                except Exception as e:
+                    print(f"⚠️  清理临时文件失败: {e}")
+    
+    def get_compression_status(self):
+        """获取规划压缩的一次命中率等统计"""
+        stats = self.compression_stats.get_stats()
+        stats.update({
+            "target_mb": COMPRESSION_TARGET_MB,
+            "provider_target_mb": {provider: self._compression_target_mb(provider)
+                                   for provider in self.router.candidates('video')},
+            "two_pass": COMPRESSION_TWO_PASS,
+            "keep_audio": COMPRESSION_KEEP_AUDIO,
+            "remux_enabled": COMPRESSION_REMUX_ENABLED,
+            "remux_max_trim": COMPRESSION_REMUX_MAX_TRIM,
+            "media_backend": self.media_backend.name,
+        })
+        return stats
+    
+    def get_transcode_cache_status(self):
+        """获取转码缓存的命中率和容量统计"""
+        if not self.transcode_cache:
+            return {"enabled": False}
+        
+        stats = self.transcode_cache.get_stats()
+        stats["enabled"] = True
+        return stats
+    
+    def _compress_video(self, video_path, target_mb=COMPRESSION_TARGET_MB):
+        """
+        压缩视频：编码兼容且只略超目标时先流复制（秒级），
+        否则按时长和分辨率规划参数一次编码，未达到目标大小时回退到逐级压缩策略
+        """
+        remuxed_path = self._compress_video_remux(video_path, target_mb=target_mb)
+        if remuxed_path:
+            return remuxed_path
+        
+        planned_path = self._compress_video_planned(video_path, target_mb=target_mb)
+        if planned_path:
+            return planned_path
+        
+        print("🔄 规划压缩未达到目标大小，回退到逐级压缩策略...")
+        return self._compress_video_cascade(video_path, target_mb=target_mb)
+    
+    def _compress_video_remux(self, video_path, info=None, target_mb=COMPRESSION_TARGET_MB):
+        """
+        流复制快速路径：视频已是 H.264 时只去掉音轨、在末尾截掉一小段，不重新编码
+        无法只靠流复制达到目标大小（或结果仍超出目标）时返回 None，由调用方重新编码
+        """
+        from config import TEMP_DIR
+        
+        if not COMPRESSION_REMUX_ENABLED:
+            return None
+        info = info or self._probe_video(video_path)
+        if not info:
+            return None
+        
+        target_bytes = target_mb * 1024 * 1024
+        remux_plan = plan_remux(info, target_bytes, COMPRESSION_REMUX_MAX_TRIM, COMPRESSION_KEEP_AUDIO)
+        if not remux_plan:
+            return None
+        
+        name = os.path.splitext(os.path.basename(video_path))[0]
+        output_path = os.path.join(TEMP_DIR, f"remux_{os.getpid()}_{threading.get_ident()}_{name}.mp4")
+        trim = remux_plan['trim_duration']
+        print(f"⚡ 视频编码为{info['video_codec']}，尝试流复制: "
+              f"{'移除音轨' if remux_plan['drop_audio'] else '保留音轨'}"
+              + (f", 截取前{trim:.1f}/{info['duration']:.1f}秒" if trim else ""))
+        
+        if remux_with_plan(video_path, output_path, remux_plan):
+            remuxed_size = os.path.getsize(output_path)
+            if remuxed_size <= target_bytes:
+                print(f"✅ 流复制成功: {remuxed_size/1024/1024:.1f}MB (Base64后: {remuxed_size*1.33/1024/1024:.2f}MB)")
+                self.compression_stats.record_remux(True)
+                return output_path
+            print(f"⚠️  流复制结果 {remuxed_size/1024/1024:.1f}MB 超出目标 {target_mb}MB，改为重新编码")
+        
+        self.compression_stats.record_remux(False)
+        if os.path.exists(output_path):
+            try:
+                os.unlink(output_path)
+            except Exception as e:
+                print(f"⚠️  清理临时文件失败: {e}")
+        return None
+    
+    def _compress_video_planned(self, video_path, info=None, segment=None, target_mb=COMPRESSION_TARGET_MB):
+        """
+        按视频时长、分辨率和音频信息计算码率与分辨率，一次编码落在目标大小内
+        第一次编码超出目标时按实际大小修正码率再编码一次，仍超出则返回 None
+        
+        Args:
+            info: 已获取的视频信息（probe_video 结果），为空时重新获取
+            segment: (start, end) 秒，只压缩该时间段（长视频分段模式）
+            target_mb: 目标大小（MB），按提供商的请求体上限确定
+        """
+        from config import TEMP_DIR
+        
+        info = info or self._probe_video(video_path)
+        if not info:
+            print("⚠️  无法获取视频时长和分辨率，跳过规划压缩")
+            return None
+        
+        start = duration = None
+        name = os.path.splitext(os.path.basename(video_path))[0]
+        if segment:
+            start, end = segment
+            duration = end - start
+            name = f"{name}_seg{start:.0f}-{end:.0f}"
+        
+        target_bytes = target_mb * 1024 * 1024
+        plan = plan_compression(dict(info, duration=duration) if segment else info, target_bytes, COMPRESSION_KEEP_AUDIO)
+        output_path = os.path.join(TEMP_DIR, f"planned_{os.getpid()}_{threading.get_ident()}_{name}.mp4")
+        print(f"📊 视频信息: 时长{info['duration']:.1f}秒, {info['width']}x{info['height']}, "
+              f"{info['fps']:.1f}fps, 音频: {'有' if info['has_audio'] else '无'}"
+              + (f", 分段: {start:.1f}-{end:.1f}秒" if segment else ""))
+        
+        # 整段压缩长视频时分段并行编码，缩短单个大视频的压缩耗时
+        parallel = (not segment and COMPRESSION_PARALLEL_WORKERS > 1 and self.media_backend.name == 'subprocess'
+                    and info['duration'] >= COMPRESSION_PARALLEL_MIN_SECONDS)
+        
+        encodes = 0
+        for attempt in (1, 2):
+            print(f"压缩参数(规划第{attempt}次): 分辨率={plan['width']}x{plan['height']}, "
+                  f"视频码率={plan['video_kbps']}k, 帧率={plan['fps']}, "
+                  f"音频={'%dk' % plan['audio_kbps'] if plan['keep_audio'] else '移除'}, "
+                  f"{'两遍编码' if COMPRESSION_TWO_PASS else '单遍编码'}")
+            # 按后端实际执行的编码遍数统计（PyAV和硬件编码器不做两遍编码）
+            if parallel:
+                passes = encode_parallel_with_plan(video_path, output_path, plan, info, COMPRESSION_PARALLEL_WORKERS,
+                                                   two_pass=COMPRESSION_TWO_PASS)
+            else:
+                passes = self.media_backend.transcode(video_path, output_path, plan, two_pass=COMPRESSION_TWO_PASS,
+                                                      start=start, duration=duration)
+            if not passes:
+                break
+            encodes += passes
+            
+            compressed_size = os.path.getsize(output_path)
+            if compressed_size <= target_bytes:
+                print(f"✅ 规划压缩成功(第{attempt}次编码): {compressed_size/1024/1024:.1f}MB "
+                      f"(Base64后: {compressed_size*1.33/1024/1024:.2f}MB)")
+                self.compression_stats.record(encodes, attempt)
+                return output_path
+            
+            # 按实际大小等比例修正码率，再留5%余量
+            print(f"⚠️  规划压缩结果 {compressed_size/1024/1024:.1f}MB 超出目标 {target_mb}MB，修正码率后重试")
+            plan = dict(plan, video_kbps=max(int(plan['video_kbps'] * target_bytes / compressed_size * 0.95), 16))
+        
+        self.compression_stats.record(encodes)
+        if os.path.exists(output_path):
+            try:
+                os.unlink(output_path)
+            except Exception as e:
+                print(f"⚠️  清理临时文件失败: {e}")
+        return None
+    
+    def _compress_video_cascade(self, video_path, target_mb=COMPRESSION_TARGET_MB):
+        """
+        逐级压缩策略：按文件大小选择参数压缩，超出目标大小时使用更激进的参数重新压缩，支持CUDA加速
+        输出文件名包含进程和线程标识：并发压缩不同城市目录下的同名视频（如 walking.mp4）时互不覆盖，
+        结束时只清理本次调用产生的中间文件
+        """
+        from config import TEMP_DIR
+        
+        name = os.path.splitext(os.path.basename(video_path))[0]
+        compressed_path = os.path.join(TEMP_DIR, f"compressed_{os.getpid()}_{threading.get_ident()}_{name}.mp4")
+        result_path = None
+        try:
+            result_path = self._cascade_compress(video_path, compressed_path, target_mb)
+            return result_path
+        finally:
+            self._cleanup_compress_intermediates(compressed_path, keep=result_path)
+    
+    def _cascade_compress(self, video_path, compressed_path, target_mb):
+        """逐级压缩，返回达到目标大小的输出文件（compressed_path 或其 _ultra / _final 文件），失败返回 None"""
         try:
             import subprocess
-            import os
-            from config import TEMP_DIR
             
-            # 创建临时压缩文件 - 使用配置的临时目录
-            temp_dir = TEMP_DIR
-            compressed_path = os.path.join(temp_dir, f"compressed_{os.path.basename(video_path)}")
-            
-            # 目标：压缩到<7MB，这样Base64后<9.3MB，留出安全边距
             original_size = os.path.getsize(video_path)
-            target_size_mb = 7.0  # 7MB（Base64后约9.3MB）
-            target_size = target_size_mb * 1024 * 1024
+            target_size = target_mb * 1024 * 1024
             
             original_size_mb = original_size / 1024 / 1024
-            print(f"📊 压缩目标：从 {original_size_mb:.1f}MB 压缩到 <{target_size_mb}MB（Base64后<10MB）")
+            print(f"📊 压缩目标：从 {original_size_mb:.1f}MB 压缩到 <{target_mb:g}MB（Base64后<{target_mb * 1.33:.1f}MB）")
             
             # 根据原始大小和Base64编码后的预期大小调整压缩参数
             # 更精确地根据文件大小计算压缩参数
@@ -241,27 +648,11 @@ class ModelManager:
                 bitrate = "600k"
                 fps = "15"
             
-            # 检查CUDA可用性并选择编码器
-            cuda_available = self._check_cuda_availability()
-            video_codec = 'h264_nvenc' if cuda_available else 'libx264'
+            # 使用启动时探测到的最快编码器（不再每次导入torch检测CUDA）
+            video_codec = get_encoder_capabilities()['video_codec']
             
-            # 首先尝试使用配置的ffmpeg路径
-            try:
-                from config import FFMPEG_PATH
-                if os.path.exists(FFMPEG_PATH):
-                    ffmpeg_path = FFMPEG_PATH
-                    print(f"✅ 使用配置的ffmpeg路径: {ffmpeg_path}")
-                else:
-                    raise FileNotFoundError("配置的ffmpeg路径不存在")
-            except Exception:
-                # 回退到imageio-ffmpeg
-                try:
-                    import imageio_ffmpeg
-                    ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
-                    print(f"✅ 使用imageio-ffmpeg路径: {ffmpeg_path}")
-                except Exception:
-                    ffmpeg_path = 'ffmpeg'  # 回退到系统ffmpeg
-                    print("⚠️  未找到imageio-ffmpeg，尝试系统ffmpeg")
+            # 配置的路径 / imageio-ffmpeg / 系统ffmpeg，进程内只查找一次
+            ffmpeg_path = resolve_ffmpeg_path()
             
             # 使用ffmpeg压缩视频，支持CUDA加速
             cmd = [
@@ -269,17 +660,13 @@ class ModelManager:
                 '-vf', f'scale={scale}',  # 动态分辨率
                 '-b:v', bitrate,          # 动态码率
                 '-r', fps,                # 动态帧率
-                '-c:v', video_codec,     # 使用CUDA加速的编码器（如果可用）
-                '-preset', 'fast',        # 快速编码
-                '-y',                     # 覆盖输出文件
-                compressed_path
+                '-c:v', video_codec,     # 使用硬件加速的编码器（如果可用）
             ]
+            if video_codec in PRESET_ENCODERS:
+                cmd += ['-preset', 'fast']  # 快速编码
+            cmd += ['-y', compressed_path]  # 覆盖输出文件
             
-            print(f"压缩参数: 分辨率={scale}, 码率={bitrate}, 帧率={fps}")
-            if cuda_available:
-                print("✅ 检测到CUDA，使用GPU加速视频压缩")
-            else:
-                print("⚠️  未检测到CUDA，使用CPU压缩")
+            print(f"压缩参数: 分辨率={scale}, 码率={bitrate}, 帧率={fps}, 编码器={video_codec}")
             
             # 执行压缩命令
             result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
@@ -289,14 +676,14 @@ class ModelManager:
                 compressed_size_mb = compressed_size / 1024 / 1024
                 compressed_base64_size_mb = compressed_size_mb * 1.33
                 
-                if compressed_base64_size_mb < 10:
-                    print(f"✅ 压缩成功: {compressed_size_mb:.1f}MB (Base64后: {compressed_base64_size_mb:.2f}MB < 10MB)")
+                if compressed_size <= target_size:
+                    print(f"✅ 压缩成功: {compressed_size_mb:.1f}MB (Base64后: {compressed_base64_size_mb:.2f}MB)")
                     return compressed_path
                 else:
-                    print(f"⚠️  压缩后Base64仍为{compressed_base64_size_mb:.2f}MB，超过10MB限制")
+                    print(f"⚠️  压缩后为{compressed_size_mb:.1f}MB，超过目标 {target_mb:g}MB")
                     print(f"🔄 尝试更激进的压缩参数...")
                     # 使用更激进的压缩参数重新压缩（从原始文件重新压缩）
-                    return self._aggressive_compress(video_path, compressed_path)
+                    return self._aggressive_compress(video_path, compressed_path, target_size)
             else:
                 print(f"ffmpeg压缩失败: {result.stderr}")
                 return self._compress_video_python(video_path, compressed_path)
@@ -305,31 +692,15 @@ class ModelManager:
             print(f"ffmpeg压缩出错: {e}")
             return self._compress_video_python(video_path, compressed_path)
     
-    def _aggressive_compress(self, video_path, compressed_path):
+    def _aggressive_compress(self, video_path, compressed_path, target_size):
         """更激进的压缩策略"""
         try:
             import subprocess
-            import os
             
-            # 首先尝试使用配置的ffmpeg路径
-            try:
-                from config import FFMPEG_PATH
-                if os.path.exists(FFMPEG_PATH):
-                    ffmpeg_path = FFMPEG_PATH
-                    print(f"✅ 使用配置的ffmpeg路径: {ffmpeg_path}")
-                else:
-                    raise FileNotFoundError("配置的ffmpeg路径不存在")
-            except Exception:
-                # 回退到imageio-ffmpeg
-                try:
-                    import imageio_ffmpeg
-                    ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
-                    print(f"✅ 使用imageio-ffmpeg路径: {ffmpeg_path}")
-                except Exception:
-                    ffmpeg_path = 'ffmpeg'  # 回退到系统ffmpeg
-                    print("⚠️  未找到imageio-ffmpeg，尝试系统ffmpeg")
-            
-            # 更激进的压缩参数 (确保Base64后<10MB)
+            # 配置的路径 / imageio-ffmpeg / 系统ffmpeg，进程内只查找一次
+            ffmpeg_path = resolve_ffmpeg_path()
+            
+            # 更激进的压缩参数
             cmd = [
                 ffmpeg_path, '-i', video_path,
                 '-vf', 'scale=240:180',  # 极小的分辨率
@@ -351,10 +722,10 @@ class ModelManager:
                 compressed_base64_size_mb = compressed_size_mb * 1.33
                 print(f"激进压缩完成: {compressed_size_mb:.1f}MB (Base64后: {compressed_base64_size_mb:.2f}MB)")
                 
-                # 检查Base64编码后是否仍然大于10MB
-                if compressed_base64_size_mb >= 10:
-                    print(f"⚠️  激进压缩后Base64仍为{compressed_base64_size_mb:.2f}MB >= 10MB，尝试超激进压缩")
-                    return self._ultra_aggressive_compress(video_path, compressed_path)
+                # 检查是否仍然大于目标大小
+                if compressed_size > target_size:
+                    print(f"⚠️  激进压缩后仍为{compressed_size_mb:.1f}MB > {target_size/1024/1024:g}MB，尝试超激进压缩")
+                    return self._ultra_aggressive_compress(video_path, compressed_path, target_size)
                 
                 return compressed_path
             else:
@@ -365,29 +736,13 @@ class ModelManager:
             print(f"激进压缩出错: {e}")
             return None
     
-    def _ultra_aggressive_compress(self, video_path, compressed_path):
-        """超激进压缩策略 - 确保5分半1080p视频也能压缩到10MB以下"""
+    def _ultra_aggressive_compress(self, video_path, compressed_path, target_size):
+        """超激进压缩策略 - 确保5分半1080p视频也能压缩到目标大小以下"""
         try:
             import subprocess
-            import os
             
-            # 首先尝试使用配置的ffmpeg路径
-            try:
-                from config import FFMPEG_PATH
-                if os.path.exists(FFMPEG_PATH):
-                    ffmpeg_path = FFMPEG_PATH
-                    print(f"✅ 使用配置的ffmpeg路径: {ffmpeg_path}")
-                else:
-                    raise FileNotFoundError("配置的ffmpeg路径不存在")
-            except Exception:
-                # 回退到imageio-ffmpeg
-                try:
-                    import imageio_ffmpeg
-                    ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
-                    print(f"✅ 使用imageio-ffmpeg路径: {ffmpeg_path}")
-                except Exception:
-                    ffmpeg_path = 'ffmpeg'  # 回退到系统ffmpeg
-                    print("⚠️  未找到imageio-ffmpeg，尝试系统ffmpeg")
+            # 配置的路径 / imageio-ffmpeg / 系统ffmpeg，进程内只查找一次
+            ffmpeg_path = resolve_ffmpeg_path()
             
             # 生成新的压缩文件路径，避免覆盖之前的文件
             base_name = os.path.splitext(compressed_path)[0]
@@ -416,12 +771,11 @@ class ModelManager:
                 compressed_size = os.path.getsize(ultra_compressed_path)
                 print(f"超激进压缩完成: {compressed_size/1024/1024:.1f}MB")
                 
-                # 检查是否仍然大于目标大小（7.5MB）
-                target_size = 7.5 * 1024 * 1024  # 7.5MB
+                # 检查是否仍然大于目标大小
                 if compressed_size > target_size:
-                    print(f"⚠️  超激进压缩后仍较大: {compressed_size/1024/1024:.1f}MB > 7.5MB")
+                    print(f"⚠️  超激进压缩后仍较大: {compressed_size/1024/1024:.1f}MB > {target_size/1024/1024:g}MB")
                     print("尝试终极压缩策略...")
-                    return self._final_aggressive_compress(video_path, ultra_compressed_path)
+                    return self._final_aggressive_compress(video_path, ultra_compressed_path, target_size)
                 
                 return ultra_compressed_path
             else:
@@ -432,29 +786,13 @@ class ModelManager:
             print(f"超激进压缩出错: {e}")
             return None
     
-    def _final_aggressive_compress(self, video_path, compressed_path):
+    def _final_aggressive_compress(self, video_path, compressed_path, target_size):
         """终极压缩策略 - 最后的手段"""
         try:
             import subprocess
-            import os
             
-            # 首先尝试使用配置的ffmpeg路径
-            try:
-                from config import FFMPEG_PATH
-                if os.path.exists(FFMPEG_PATH):
-                    ffmpeg_path = FFMPEG_PATH
-                    print(f"✅ 使用配置的ffmpeg路径: {ffmpeg_path}")
-                else:
-                    raise FileNotFoundError("配置的ffmpeg路径不存在")
-            except Exception:
-                # 回退到imageio-ffmpeg
-                try:
-                    import imageio_ffmpeg
-                    ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
-                    print(f"✅ 使用imageio-ffmpeg路径: {ffmpeg_path}")
-                except Exception:
-                    ffmpeg_path = 'ffmpeg'  # 回退到系统ffmpeg
-                    print("⚠️  未找到imageio-ffmpeg，尝试系统ffmpeg")
+            # 配置的路径 / imageio-ffmpeg / 系统ffmpeg，进程内只查找一次
+            ffmpeg_path = resolve_ffmpeg_path()
             
             # 生成最终的压缩文件路径
             base_name = os.path.splitext(compressed_path)[0]
@@ -483,8 +821,7 @@ class ModelManager:
                 compressed_size = os.path.getsize(final_compressed_path)
                 print(f"终极压缩完成: {compressed_size/1024/1024:.1f}MB")
                 
-                # 检查是否仍然大于目标大小（7.5MB）
-                target_size = 7.5 * 1024 * 1024  # 7.5MB
+                # 检查是否仍然大于目标大小
                 if compressed_size > target_size:
                     print(f"❌ 所有压缩策略均失败，文件仍过大: {compressed_size/1024/1024:.1f}MB")
                     print("建议: 1. 检查视频内容 2. 考虑分段处理 3. 使用更高压缩率的编码器")
@@ -521,30 +858,113 @@ class ModelManager:
             print(f"ffmpeg-python压缩出错: {e}")
             return None
     
-    def query(self, image, question):
-        """统一的查询接口"""
-        if not self.model and not hasattr(self, 'client'):
-            return {"answer": "模型未初始化", "error": "模型未初始化"}
+    def _get_cached_response(self, hash_func, media, question):
+        """
+        查询响应缓存，返回 (缓存键, 缓存结果)；未启用缓存时返回 (None, None)
+        
+        Args:
+            hash_func: 计算媒体内容哈希的函数（file_sha256 / image_sha256），仅在启用缓存时调用
+            media: 视频路径或PIL图像
+            question: 问题
+        """
+        if not self.response_cache:
+            return None, None
+        
+        try:
+            media_hash = hash_func(media)
+            providers = self.router.providers
+            if len(providers) == 1:
+                model_type = providers[0]
+                model_name = MODEL_CONFIG.get(model_type, {}).get("model", model_type)
+            else:
+                # 多提供商路由时结果可能来自任一提供商，以参与路由的提供商列表为键
+                model_type, model_name = "router", ",".join(providers)
+            cache_key = self.response_cache.make_key(media_hash, question, model_type, model_name)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                print(f"✅ 命中响应缓存，跳过{model_type} API调用")
+                cached["cached"] = True
+            return cache_key, cached
+        except Exception as e:
+            print(f"⚠️  读取响应缓存失败: {e}")
+            return None, None
+    
+    def _store_cached_response(self, cache_key, result):
+        """只缓存成功的查询结果"""
+        if not cache_key or not isinstance(result, dict) or result.get("error"):
+            return
+        
+        try:
+            self.response_cache.put(cache_key, result)
+        except Exception as e:
+            print(f"⚠️  写入响应缓存失败: {e}")
+    
+    def get_cache_status(self):
+        """获取响应缓存的命中率和容量统计"""
+        if not self.response_cache:
+            return {"enabled": False}
         
         try:
-            if self.model_type == "moondream":
-                return self._query_moondream(image, question)
-            elif self.model_type == "openai":
-                return self._query_openai(image, question)
-            elif self.model_type == "claude":
-                return self._query_claude(image, question)
-            elif self.model_type == "gemini":
-                return self._query_gemini(image, question)
-            elif self.model_type == "qwen":
-                return self._query_qwen(image, question)
+            stats = self.response_cache.get_stats()
+        except Exception as e:
+            return {"enabled": True, "error": str(e)}
+        stats["enabled"] = True
+        return stats
+    
+    def query(self, image, question):
+        """统一的查询接口（先查询响应缓存）"""
+        try:
+            cache_key, cached = self._get_cached_response(image_sha256, image, question)
+            if cached is not None:
+                return cached
+            
+            result = self._route('image', lambda provider: self._dispatch_query(provider, image, question))
+            self._store_cached_response(cache_key, result)
+            return result
         except Exception as e:
             return {"answer": f"查询失败: {str(e)}", "error": str(e)}
     
-    def query_video(self, video_path, question):
-        """直接处理视频文件的接口"""
-        if not self.model and not hasattr(self, 'client'):
-            return {"answer": "模型未初始化", "error": "模型未初始化"}
+    def _route(self, kind, call, payload_bytes=None):
+        """
+        按路由顺序调用提供商（见 ProviderRouter.route）：网络、超时、5xx、429等提供商侧错误切换到下一个提供商，
+        视频损坏、格式不支持等请求本身的错误直接返回；成功时记录端到端延迟（含压缩耗时）
+        
+        Args:
+            kind: 请求类型 'image' / 'video' / 'text'
+            call: call(provider) -> 结果字典
+            payload_bytes: 视频原始大小，请求体上限足够的提供商优先（无需压缩）
+        """
+        return self.router.route(kind, call, payload_bytes,
+                                 is_available=lambda provider: self._get_provider(provider) is not None)
+    
+    def get_router_status(self):
+        """获取各提供商的能力、p50/p95延迟和降级状态"""
+        return self.router.get_status()
+    
+    def _dispatch_query(self, provider, image, question):
+        """按提供商调用相应的图像查询方法"""
+        if provider == "moondream":
+            return self._query_moondream(image, question)
+        elif provider == "openai":
+            return self._query_openai(image, question)
+        elif provider == "claude":
+            return self._query_claude(image, question)
+        elif provider == "gemini":
+            return self._query_gemini(image, question)
+        elif provider == "qwen":
+            return self._query_qwen(image, question)
+        return {"answer": f"{provider} 不支持图像查询", "error": "不支持的模型类型"}
+    
+    def query_video(self, video_path, question, strategy=None, frame_count=None, frame_size=None, frame_method=None):
+        """
+        直接处理视频文件的接口（先查询响应缓存）
         
+        Args:
+            strategy: 'video' 上传整段视频 / 'frames' 抽取代表帧以多图请求发送，默认为 VIDEO_QUERY_STRATEGY
+                      （参与路由的提供商都不支持视频时，如只有 Moondream，总是使用 'frames'）
+            frame_count / frame_size / frame_method: 抽帧数量、最长边像素、采样方式（'scene' / 'uniform'），
+                      仅 'frames' 策略使用，默认为 FRAME_SAMPLE_* 配置
+        """
         try:
             # 检查视频文件是否存在
             import os
@@ -555,35 +975,253 @@ class ModelManager:
             file_size = os.path.getsize(video_path)
             print(f"处理视频文件: {video_path}, 大小: {file_size/1024/1024:.1f}MB")
             
-            # 根据模型类型调用相应的视频查询方法
-            if self.model_type == "moondream":
-                return self._query_moondream_video(video_path, question)
-            elif self.model_type == "openai":
-                return self._query_openai_video(video_path, question)
-            elif self.model_type == "claude":
-                return self._query_claude_video(video_path, question)
-            elif self.model_type == "gemini":
-                return self._query_gemini_video(video_path, question)
-            elif self.model_type == "qwen":
-                return self._query_qwen_video(video_path, question)
+            strategy = strategy or VIDEO_QUERY_STRATEGY
+            if not self.router.candidates('video'):
+                strategy = "frames"
+            frame_options = None
+            cache_question = question
+            if strategy == "frames":
+                frame_options = (int(frame_count or FRAME_SAMPLE_COUNT), int(frame_size or FRAME_SAMPLE_SIZE),
+                                 frame_method or FRAME_SAMPLE_METHOD)
+                cache_question = f"{question}\n[frames:{frame_options[2]}:{frame_options[0]}:{frame_options[1]}]"
+            
+            # 相同视频内容+问题+模型（+抽帧参数）已有成功结果时直接返回
+            cache_key, cached = self._get_cached_response(self._file_hash, video_path, cache_question)
+            if cached is not None:
+                return cached
+            
+            if frame_options:
+                result = self._query_video_frames(video_path, question, *frame_options)
             else:
-                return {"answer": f"{self.model_type} 不支持视频查询", "error": "不支持的模型类型"}
+                # 请求体上限足够的提供商优先，可以不压缩直接上传
+                result = self._route('video', lambda provider: self._query_video_with(provider, video_path, question, file_size),
+                                     payload_bytes=file_size)
+            self._store_cached_response(cache_key, result)
+            return result
         except Exception as e:
             return {"answer": f"视频查询失败: {str(e)}", "error": str(e)}
     
+    def _query_video_with(self, provider, video_path, question, file_size):
+        """使用指定提供商上传整段视频查询；长视频整段压缩后画质过低时，分段并发查询后汇总"""
+        segment_plan = self._plan_video_segments(provider, video_path, file_size)
+        if segment_plan:
+            info, segments = segment_plan
+            return self._query_video_segmented(provider, video_path, question, info, segments)
+        return self._dispatch_video_query(provider, video_path, question)
+    
+    def _query_video_frames(self, video_path, question, frame_count, frame_size, frame_method):
+        """
+        抽帧模式：抽取代表帧后通过图像查询接口以多图请求发送（只抽帧一次，切换提供商时复用）
+        Moondream 只接受单张图像，把各帧拼接为一张缩略图墙
+        """
+        frames = sample_frames(video_path, frame_count, frame_size, frame_method, FRAME_SCENE_THRESHOLD,
+                               info=self._probe_video(video_path), backend=self.media_backend)
+        if not frames:
+            return {"answer": "未能从视频中抽取画面", "error": "抽帧失败"}
+        
+        timeline = "、".join(format_timestamp(frame['timestamp']) for frame in frames)
+        print(f"🖼️  抽帧模式({frame_method}): {len(frames)}帧，时间点 {timeline}")
+        
+        def query_frames(provider):
+            if provider == "moondream":
+                images = make_contact_sheet(frames)
+                frames_question = (f"这张图由同一段视频中的{len(frames)}个画面按时间顺序从左到右、从上到下拼接而成"
+                                   f"（时间点：{timeline}），请把它们作为整段视频来回答：{question}")
+            else:
+                images = [frame['image'] for frame in frames]
+                frames_question = (f"以下{len(frames)}张图片是按时间顺序从同一段视频中抽取的画面"
+                                   f"（时间点：{timeline}），请把它们作为整段视频来回答：{question}")
+            return self._dispatch_query(provider, images, frames_question)
+        
+        result = self._route('image', query_frames)
+        result["mode"] = "frames"
+        result["frames"] = [frame['timestamp'] for frame in frames]
+        return result
+    
+    def _plan_video_segments(self, provider, video_path, file_size):
+        """
+        判断是否使用长视频分段模式（按该提供商的压缩目标大小判断）
+        
+        Returns:
+            (info, segments)：需要分段时返回视频信息和分段边界，否则返回 None
+        """
+        if not LONG_VIDEO_SEGMENT_ENABLED:
+            return None
+        
+        target_bytes = self._compression_target_mb(provider) * 1024 * 1024
+        if file_size <= target_bytes:
+            return None
+        
+        info = self._probe_video(video_path)
+        if not info:
+            return None
+        
+        # 流复制即可达到目标大小时不需要分段
+        if COMPRESSION_REMUX_ENABLED and plan_remux(info, target_bytes, COMPRESSION_REMUX_MAX_TRIM, COMPRESSION_KEEP_AUDIO):
+            return None
+        
+        segments = plan_segments(info, target_bytes, LONG_VIDEO_MIN_HEIGHT, LONG_VIDEO_MAX_SEGMENTS, COMPRESSION_KEEP_AUDIO)
+        if not segments:
+            return None
+        return info, segments
+    
+    def _query_video_segmented(self, provider, video_path, question, info, segments):
+        """
+        长视频分段模式：按时间段分别压缩并并发查询，再用一次文本请求汇总各段回答
+        结果中的 segments 记录每段的起止时间和回答
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        
+        total = len(segments)
+        target_mb = self._compression_target_mb(provider)
+        print(f"🎞️  长视频分段模式: 时长{info['duration']:.1f}秒，分为{total}段并发查询（{provider}）")
+        
+        def query_segment(index):
+            start, end = segments[index]
+            segment_result = {"index": index + 1, "start": start, "end": end}
+            segment_path = self._compress_video_planned(video_path, info, (start, end), target_mb)
+            if not segment_path:
+                segment_result.update(answer="分段压缩失败", error="分段压缩失败")
+                return segment_result
+            
+            try:
+                segment_question = (f"这是一段长视频的第{index + 1}/{total}段"
+                                    f"（{format_timestamp(start)}-{format_timestamp(end)}）。{question}")
+                result = self._dispatch_video_query(provider, segment_path, segment_question)
+            except Exception as e:
+                result = {"answer": f"分段查询失败: {str(e)}", "error": str(e)}
+            finally:
+                try:
+                    os.unlink(segment_path)
+                except OSError:
+                    pass
+            
+            segment_result["answer"] = result.get("answer", "")
+            if result.get("error"):
+                segment_result["error"] = result["error"]
+            return segment_result
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(LONG_VIDEO_SEGMENT_WORKERS, total))) as executor:
+            segment_results = list(executor.map(query_segment, range(total)))
+        
+        succeeded = [r for r in segment_results if not r.get("error")]
+        if not succeeded:
+            error = segment_results[0].get("error", "分段查询失败")
+            return {"answer": f"视频分段查询全部失败: {error}", "error": error, "segments": segment_results}
+        
+        result = {"segments": segment_results, "mode": "segmented"}
+        try:
+            merged = self._merge_segment_answers(question, succeeded, total)
+            result.update(merged)
+        except Exception as e:
+            # 汇总失败时按时间顺序拼接各段回答
+            print(f"⚠️  汇总分段回答失败: {e}")
+            result["answer"] = "\n\n".join(
+                f"[{format_timestamp(r['start'])}-{format_timestamp(r['end'])}] {r['answer']}" for r in succeeded)
+            result["merge_error"] = str(e)
+        return result
+    
+    def _merge_segment_answers(self, question, segment_results, total):
+        """用一次文本请求把各段回答汇总为对整段视频的回答（可由任一支持文本的提供商完成），失败时抛出异常"""
+        lines = [f"下面是对同一段长视频按时间顺序分成{total}段后，对每段分别回答同一个问题的结果。",
+                 "请综合各段内容，给出对整段视频的完整回答；如果各段结论不一致，以多数段和更明确的描述为准。",
+                 f"问题：{question}", ""]
+        for r in segment_results:
+            lines.append(f"第{r['index']}段（{format_timestamp(r['start'])}-{format_timestamp(r['end'])}）：{r['answer']}")
+        prompt = "\n".join(lines)
+        
+        merged = self._route('text', lambda provider: self._query_text(provider, prompt))
+        if merged.get("error"):
+            raise Exception(merged["error"])
+        merged.pop("provider", None)
+        return merged
+    
+    def _query_text(self, provider, prompt):
+        """纯文本查询（用于汇总分段回答），失败时抛出异常"""
+        config = MODEL_CONFIG.get(provider, {})
+        if provider == "openai":
+            with self._rate_limited('openai') as api_key:
+                response = self._get_provider('openai', api_key).chat.completions.create(
+                    model=config["model"],
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=2000,
+                    temperature=0.3
+                )
+            return {"answer": response.choices[0].message.content, "request_id": response.id}
+        elif provider == "claude":
+            with self._rate_limited('claude') as api_key:
+                response = self._get_provider('claude', api_key).messages.create(
+                    model=config["model"],
+                    max_tokens=2000,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.3
+                )
+            return {"answer": response.content[0].text, "request_id": response.id}
+        elif provider == "gemini":
+            with self._rate_limited('gemini') as api_key:
+                response = self._get_provider('gemini', api_key).generate_content(prompt)
+            return {"answer": response.text, "request_id": "gemini_text_response"}
+        elif provider == "qwen":
+            from dashscope import MultiModalConversation
+            
+            with self._rate_limited('qwen') as api_key:
+                response = MultiModalConversation.call(
+                    api_key=api_key,
+                    model=config["model"],
+                    messages=[{"role": "user", "content": [{"text": prompt}]}],
+                    stream=False
+                )
+                if getattr(response, 'status_code', None) is not None and response.status_code >= 400:
+                    raise Exception(f"{response.status_code} {getattr(response, 'code', 'Unknown')}: {getattr(response, 'message', '')}")
+            
+            if getattr(response, 'output', None) is None or not response.output.choices:
+                raise Exception(f"{getattr(response, 'code', 'InternalError')}: {getattr(response, 'message', 'API返回output为空')}")
+            content = response.output.choices[0].message.content[0]
+            if hasattr(content, 'text'):
+                answer = content.text
+            elif isinstance(content, dict) and 'text' in content:
+                answer = content['text']
+            else:
+                answer = str(content)
+            return {"answer": answer, "request_id": getattr(response, 'request_id', '')}
+        raise Exception(f"{provider} 不支持文本查询")
+    
+    def _dispatch_video_query(self, provider, video_path, question):
+        """根据提供商调用相应的视频查询方法"""
+        if provider == "moondream":
+            return self._query_moondream_video(video_path, question)
+        elif provider == "openai":
+            return self._query_openai_video(video_path, question)
+        elif provider == "claude":
+            return self._query_claude_video(video_path, question)
+        elif provider == "gemini":
+            return self._query_gemini_video(video_path, question)
+        elif provider == "qwen":
+            return self._query_qwen_video(video_path, question)
+        else:
+            return {"answer": f"{provider} 不支持视频查询", "error": "不支持的模型类型"}
+    
     def get_video_support_info(self):
-        """获取各模型对视频的支持信息"""
+        """获取各模型对视频的支持信息（是否支持视频以提供商能力配置为准）"""
+        notes = {
+            "moondream": "仅支持图像，视频自动使用抽帧模式（拼接为缩略图墙）",
+            "openai": "GPT-4V支持视频，推荐使用",
+            "claude": "Claude-3.5支持视频，推荐使用",
+            "gemini": "Gemini-1.5支持视频",
+            "qwen": "通义千问VL支持Base64视频",
+        }
         return {
-            "moondream": {"supported": False, "note": "仅支持图像"},
-            "openai": {"supported": True, "note": "GPT-4V支持视频，推荐使用"},
-            "claude": {"supported": True, "note": "Claude-3.5支持视频，推荐使用"},
-            "gemini": {"supported": True, "note": "Gemini-1.5支持视频"},
-            "qwen": {"supported": False, "note": "通义千问可能不支持视频，建议使用其他模型"}
+            provider: {
+                "supported": capability["video"],
+                "max_payload_mb": capability["max_payload_mb"],
+                "note": notes.get(provider, ""),
+            }
+            for provider, capability in PROVIDER_CAPABILITIES.items()
         }
     
     def _query_moondream(self, image, question):
         """Moondream查询"""
-        result = self.model.query(image, question)
+        result = self._get_provider('moondream').query(image, question)
         return {"answer": result.get('answer', ''), "request_id": result.get('request_id', '')}
     
     def _query_moondream_video(self, video_path, question):
@@ -591,30 +1229,30 @@ class ModelManager:
         return {"answer": "Moondream暂不支持直接视频分析，建议使用OpenAI、Claude、Gemini或通义千问模型", "error": "模型不支持视频"}
     
     def _query_openai(self, image, question):
-        """OpenAI GPT-4V查询"""
-        # 请求限流
-        self._wait_for_rate_limit('openai')
-        
-        base64_image = self._image_to_base64(image)
-        
-        response = self.client.chat.completions.create(
-            model=self.config["model"],
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": question},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-                    ]
+        """OpenAI GPT-4V查询（image 可以是多张图像的列表）"""
+        images = image if isinstance(image, list) else [image]
+        image_parts = [
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{self._image_to_base64(img)}"
                 }
-            ],
-            max_tokens=2000
-        )
+            }
+            for img in images
+        ]
+        
+        # 请求限流
+        with self._rate_limited('openai') as api_key:
+            response = self._get_provider('openai', api_key).chat.completions.create(
+                model=MODEL_CONFIG["openai"]["model"],
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [{"type": "text", "text": question}] + image_parts
+                    }
+                ],
+                max_tokens=2000
+            )
         
         return {
             "answer": response.choices[0].message.content,
@@ -623,34 +1261,33 @@ class ModelManager:
     
     def _query_openai_video(self, video_path, question):
         """OpenAI GPT-4V视频查询"""
-        # 请求限流
-        self._wait_for_rate_limit('openai')
-        
-        base64_video = self._video_to_base64(video_path)
+        video_data_url = self._video_to_base64(video_path, 'openai', prefix=VIDEO_DATA_URL_PREFIX)
         
-        response = self.client.chat.completions.create(
-            model=self.config["model"],
-            messages=[
-                {
-                    "role": "system",
-                    "content": "你是一个专业的视频分析师。请分析整个视频的内容，包括环境、人物、动作、时间变化等动态信息。"
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": question},
-                        {
-                            "type": "video_url",
-                            "video_url": {
-                                "url": f"data:video/mp4;base64,{base64_video}"
+        # 请求限流（压缩和编码完成后再占用名额）
+        with self._rate_limited('openai') as api_key:
+            response = self._get_provider('openai', api_key).chat.completions.create(
+                model=MODEL_CONFIG["openai"]["model"],
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "你是一个专业的视频分析师。请分析整个视频的内容，包括环境、人物、动作、时间变化等动态信息。"
+                    },
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": question},
+                            {
+                                "type": "video_url",
+                                "video_url": {
+                                    "url": video_data_url
+                                }
                             }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=2000,
-            temperature=0.7
-        )
+                        ]
+                    }
+                ],
+                max_tokens=2000,
+                temperature=0.7
+            )
         
         return {
             "answer": response.choices[0].message.content,
@@ -658,32 +1295,32 @@ class ModelManager:
         }
     
     def _query_claude(self, image, question):
-        """Claude查询"""
-        # 请求限流
-        self._wait_for_rate_limit('claude')
-        
-        base64_image = self._image_to_base64(image)
-        
-        response = self.client.messages.create(
-            model=self.config["model"],
-            max_tokens=2000,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": base64_image
-                            }
-                        },
-                        {"type": "text", "text": question}
-                    ]
+        """Claude查询（image 可以是多张图像的列表）"""
+        images = image if isinstance(image, list) else [image]
+        image_parts = [
+            {
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": "image/jpeg",
+                    "data": self._image_to_base64(img)
                 }
-            ]
-        )
+            }
+            for img in images
+        ]
+        
+        # 请求限流
+        with self._rate_limited('claude') as api_key:
+            response = self._get_provider('claude', api_key).messages.create(
+                model=MODEL_CONFIG["claude"]["model"],
+                max_tokens=2000,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": image_parts + [{"type": "text", "text": question}]
+                    }
+                ]
+            )
         
         return {
             "answer": response.content[0].text,
@@ -692,32 +1329,31 @@ class ModelManager:
     
     def _query_claude_video(self, video_path, question):
         """Claude视频查询"""
-        # 请求限流
-        self._wait_for_rate_limit('claude')
+        base64_video = self._video_to_base64(video_path, 'claude')
         
-        base64_video = self._video_to_base64(video_path)
-        
-        response = self.client.messages.create(
-            model=self.config["model"],
-            max_tokens=2000,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "video",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "video/mp4",
-                                "data": base64_video
-                            }
-                        },
-                        {"type": "text", "text": f"请分析这个视频的整体内容：{question}"}
-                    ]
-                }
-            ],
-            temperature=0.7
-        )
+        # 请求限流（压缩和编码完成后再占用名额）
+        with self._rate_limited('claude') as api_key:
+            response = self._get_provider('claude', api_key).messages.create(
+                model=MODEL_CONFIG["claude"]["model"],
+                max_tokens=2000,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "video",
+                                "source": {
+                                    "type": "base64",
+                                    "media_type": "video/mp4",
+                                    "data": base64_video
+                                }
+                            },
+                            {"type": "text", "text": f"请分析这个视频的整体内容：{question}"}
+                        ]
+                    }
+                ],
+                temperature=0.7
+            )
         
         return {
             "answer": response.content[0].text,
@@ -725,16 +1361,17 @@ class ModelManager:
         }
     
     def _query_gemini(self, image, question):
-        """Gemini查询"""
-        # 请求限流
-        self._wait_for_rate_limit('gemini')
-        
+        """Gemini查询（image 可以是多张图像的列表）"""
         # 将PIL图像转换为字节
-        buffer = io.BytesIO()
-        image.save(buffer, format='JPEG')
-        image_bytes = buffer.getvalue()
+        images_bytes = []
+        for img in (image if isinstance(image, list) else [image]):
+            buffer = io.BytesIO()
+            img.save(buffer, format='JPEG')
+            images_bytes.append(buffer.getvalue())
         
-        response = self.model.generate_content([question, image_bytes])
+        # 请求限流
+        with self._rate_limited('gemini') as api_key:
+            response = self._get_provider('gemini', api_key).generate_content([question] + images_bytes)
         
         return {
             "answer": response.text,
@@ -743,19 +1380,15 @@ class ModelManager:
     
     def _query_gemini_video(self, video_path, question):
         """Gemini视频查询"""
-        # 请求限流
-        self._wait_for_rate_limit('gemini')
-        
-        # 使用_video_to_base64方法，会自动压缩大文件
-        base64_video = self._video_to_base64(video_path)
-        
-        # 将base64转换回字节
-        video_bytes = base64.b64decode(base64_video)
+        # Gemini直接接收原始字节，自动压缩大文件后读取，无需Base64编码再解码
+        video_bytes = self._video_to_bytes(video_path, 'gemini')
         
         # 构建提示词
         enhanced_question = f"请分析这个视频的整体内容，包括环境、人物、动作、时间变化等动态信息：{question}"
         
-        response = self.model.generate_content([enhanced_question, video_bytes])
+        # 请求限流（压缩和编码完成后再占用名额）
+        with self._rate_limited('gemini') as api_key:
+            response = self._get_provider('gemini', api_key).generate_content([enhanced_question, video_bytes])
         
         return {
             "answer": response.text,
@@ -763,43 +1396,38 @@ class ModelManager:
         }
     
     def _query_qwen(self, image, question):
-        """通义千问查询"""
+        """通义千问查询（image 可以是多张图像的列表）"""
         from dashscope import MultiModalConversation
         import os
         
-        # 将PIL图像转换为字节
-        buffer = io.BytesIO()
-        image.save(buffer, format='JPEG')
-        image_bytes = buffer.getvalue()
+        # 将PIL图像转换为Base64
+        images = image if isinstance(image, list) else [image]
+        image_parts = [{"image": f"data:image/jpeg;base64,{self._image_to_base64(img)}"} for img in images]
         
         messages = [
             {
                 "role": "user",
-                "content": [
-                    {"image": f"data:image/jpeg;base64,{base64.b64encode(image_bytes).decode()}"},
-                    {"text": question}
-                ]
+                "content": image_parts + [{"text": question}]
             }
         ]
         
-        # 请求限流：确保不会超过API频率限制
-        self._wait_for_rate_limit('qwen')
-        
         # 使用官方推荐的调用方式
         try:
-            response = MultiModalConversation.call(
-                api_key=self.config["api_key"],  # 直接传递API Key
-                model=self.config["model"],
-                messages=messages,
-                stream=False  # 非流式调用
-            )
-            
-            # 检查响应状态码（API可能返回错误状态而不是抛出异常）
-            if hasattr(response, 'status_code') and response.status_code is not None:
-                if response.status_code >= 400:
-                    error_code = getattr(response, 'code', 'Unknown')
-                    error_message = getattr(response, 'message', f'API返回错误状态码: {response.status_code}')
-                    raise Exception(f"{error_code}: {error_message}")
+            # 请求限流：确保不会超过API频率限制，并把429/配额错误反馈给限流控制器
+            with self._rate_limited('qwen') as api_key:
+                response = MultiModalConversation.call(
+                    api_key=api_key,  # 直接传递选中的API Key
+                    model=MODEL_CONFIG["qwen"]["model"],
+                    messages=messages,
+                    stream=False  # 非流式调用
+                )
+                
+                # 检查响应状态码（API可能返回错误状态而不是抛出异常）
+                if hasattr(response, 'status_code') and response.status_code is not None:
+                    if response.status_code >= 400:
+                        error_code = getattr(response, 'code', 'Unknown')
+                        error_message = getattr(response, 'message', f'API返回错误状态码: {response.status_code}')
+                        raise Exception(f"{response.status_code} {error_code}: {error_message}")
             
             # 检查output是否为None（表示API调用失败）
             if not hasattr(response, 'output') or response.output is None:
@@ -849,8 +1477,8 @@ class ModelManager:
             file_size = os.path.getsize(video_path)
             print(f"通义千问处理视频，大小: {file_size/1024/1024:.1f}MB")
             
-            # 使用_video_to_base64方法，会自动压缩大文件
-            base64_video = self._video_to_base64(video_path)
+            # 使用_video_to_base64方法，会自动压缩大文件，并直接生成data URL
+            video_data_url = self._video_to_base64(video_path, 'qwen', prefix=VIDEO_DATA_URL_PREFIX)
             
             # 构建提示词
             enhanced_question = f"请分析这个视频的整体内容，包括环境、人物、动作、时间变化等动态信息：{question}"
@@ -859,7 +1487,7 @@ class ModelManager:
                 {
                     "role": "user",
                     "content": [
-                        {"video": f"data:video/mp4;base64,{base64_video}"},
+                        {"video": video_data_url},
                         {"text": enhanced_question}
                     ]
                 }
@@ -869,54 +1497,46 @@ class ModelManager:
             max_retries = 5  # 增加到5次重试
             for attempt in range(max_retries):
                 try:
-                    # 请求限流：确保不会超过API频率限制
-                    self._wait_for_rate_limit('qwen')
-                    
-                    print(f"正在调用通义千问API... (第{attempt+1}次尝试)")
-                    # 使用官方推荐的调用方式
-                    response = MultiModalConversation.call(
-                        api_key=self.config["api_key"],  # 直接传递API Key
-                        model=self.config["model"],
-                        messages=messages,
-                        stream=False,  # 非流式调用
-                        timeout=300  # 增加到300秒超时
-                    )
-                    
-                    # 检查响应状态码（API可能返回错误状态而不是抛出异常）
-                    if hasattr(response, 'status_code') and response.status_code is not None:
-                        if response.status_code >= 400:
-                            # API返回了错误状态码
-                            error_code = getattr(response, 'code', 'Unknown')
-                            error_message = getattr(response, 'message', f'API返回错误状态码: {response.status_code}')
+                    # 请求限流：确保不会超过API频率限制，并把429/配额错误反馈给限流控制器
+                    with self._rate_limited('qwen') as api_key:
+                        print(f"正在调用通义千问API... (第{attempt+1}次尝试)")
+                        # 使用官方推荐的调用方式
+                        response = MultiModalConversation.call(
+                            api_key=api_key,  # 直接传递选中的API Key
+                            model=MODEL_CONFIG["qwen"]["model"],
+                            messages=messages,
+                            stream=False,  # 非流式调用
+                            timeout=300  # 增加到300秒超时
+                        )
+                        
+                        # 检查响应状态码（API可能返回错误状态而不是抛出异常）
+                        if hasattr(response, 'status_code') and response.status_code is not None:
+                            if response.status_code >= 400:
+                                # API返回了错误状态码
+                                error_code = getattr(response, 'code', 'Unknown')
+                                error_message = getattr(response, 'message', f'API返回错误状态码: {response.status_code}')
+                                raise Exception(f"{response.status_code} {error_code}: {error_message}")
+                        
+                        # 检查output是否为None（表示API调用失败）
+                        if not hasattr(response, 'output') or response.output is None:
+                            error_message = getattr(response, 'message', 'API返回output为None')
+                            error_code = getattr(response, 'code', 'InternalError')
                             raise Exception(f"{error_code}: {error_message}")
                     
-                    # 检查output是否为None（表示API调用失败）
-                    if not hasattr(response, 'output') or response.output is None:
-                        error_message = getattr(response, 'message', 'API返回output为None')
-                        error_code = getattr(response, 'code', 'InternalError')
-                        raise Exception(f"{error_code}: {error_message}")
-                    
                     print("通义千问API调用成功")
                     break
                 except Exception as e:
                     if attempt < max_retries - 1:
-                        error_msg = str(e)
                         print(f"通义千问API调用失败，第{attempt+1}次重试: {e}")
                         
-                        # 检测是否是频率限制错误
-                        is_rate_limit = any(keyword in error_msg.lower() for keyword in 
-                                           ['rate limit', '频率', 'quota', 'limit exceeded', 'too many requests', '429'])
-                        
-                        if is_rate_limit:
-                            # 频率限制错误：等待更长时间
-                            sleep_time = 30 + (attempt * 10)  # 30秒起步，每次重试增加10秒
-                            print(f"⚠️ 检测到频率限制错误，等待{sleep_time}秒后重试...")
+                        if is_rate_limit_error(e):
+                            # 频率限制错误：限流控制器已降低速率，重试时由令牌桶控制等待时间
+                            print("⚠️ 检测到频率限制错误，已降低通义千问请求速率后重试...")
                         else:
                             # 普通错误：智能重试间隔
                             sleep_time = [3, 5, 10, 15][min(attempt, 3)]
-                        print(f"等待{sleep_time}秒后重试...")
-                        
-                        time.sleep(sleep_time)
+                            print(f"等待{sleep_time}秒后重试...")
+                            time.sleep(sleep_time)
                     else:
                         print(f"通义千问API调用失败，已达到最大重试次数{max_retries}次")
                         raise e
@@ -982,7 +1602,7 @@ class ModelManager:
     
     def detect(self, image, target):
         """目标检测接口（使用专门的Moondream模型）"""
-        if not self.moondream_model:
+        if not self._ensure_moondream():
             return {"objects": [], "error": "Moondream 目标检测模型未初始化"}
         
         try:
@@ -0,0 +1,118 @@
+"""
+服务器路径提交
+数据集与服务在同一台机器或同一NFS挂载上时，批量任务直接提交视频目录或路径清单，
+视频原地读取（不上传、不复制、处理后不删除）；只允许读取配置的目录（INGEST_ALLOWED_ROOTS）
+"""
+
+import os
+import stat
+
+from dataset_catalog import VIDEO_EXTENSIONS, find_video_files, parse_dataset_path
+
+
+def normalize_roots(roots):
+    """允许的根目录转换为真实路径（解析符号链接）"""
+    return [os.path.realpath(root) for root in roots if root]
+
+
+def find_allowed_root(real_path, allowed_roots):
+    """
+    返回包含 real_path 的允许根目录，不在任何允许根目录下时返回 None
+    real_path 需为真实路径（os.path.realpath），防止通过 ../ 或符号链接读取允许目录以外的文件
+    """
+    for root in allowed_roots:
+        if real_path == root or real_path.startswith(root.rstrip(os.sep) + os.sep):
+            return root
+    return None
+
+
+def _examples(paths, limit=5):
+    more = f" 等 {len(paths)} 个" if len(paths) > limit else ''
+    return ', '.join(paths[:limit]) + more
+
+
+def collect_video_items(allowed_roots, root=None, paths=None, extensions=VIDEO_EXTENSIONS):
+    """
+    解析服务器路径为批量任务项
+
+    Args:
+        allowed_roots: 允许读取的根目录（normalize_roots 的返回值）
+        root: 视频目录，未提供 paths 时递归查找其中的全部视频
+        paths: 视频路径清单，相对路径相对于 root
+        extensions: 查找目录时的视频扩展名
+
+    Returns:
+        list: 任务项 [{'filename', 'path', 'city', 'in_place': True}, ...]，
+              filename 为相对允许根目录的路径（与浏览器上传的相对路径一致，用于解析城市和导出目录）
+
+    Raises:
+        PermissionError: 未配置允许的目录，或有路径不在允许的目录下
+        ValueError: 参数无效、目录或文件不存在
+    """
+    if not allowed_roots:
+        raise PermissionError('未配置允许读取的服务器目录（INGEST_ALLOWED_ROOTS）')
+    if not root and not paths:
+        raise ValueError('需要提供视频目录 root 或路径清单 paths')
+
+    if root:
+        if not os.path.isabs(root):
+            raise ValueError(f'视频目录必须为绝对路径: {root}')
+        if find_allowed_root(os.path.realpath(root), allowed_roots) is None:
+            raise PermissionError(f'视频目录不在允许读取的目录下: {root}')
+        if not os.path.isdir(root):
+            raise ValueError(f'视频目录不存在: {root}')
+        if not paths:
+            paths = find_video_files(root, extensions)
+
+    items = []
+    seen = set()
+    outside = []
+    missing = []
+    real_dirs = {}  # 目录 -> 真实路径（同一目录下的视频只解析一次，每个文件只需一次lstat）
+    for path in paths:
+        if not os.path.isabs(path):
+            if not root:
+                raise ValueError(f'未提供 root 时路径必须为绝对路径: {path}')
+            path = os.path.join(root, path)
+        directory, name = os.path.split(path)
+        if directory not in real_dirs:
+            real_dirs[directory] = os.path.realpath(directory)
+        real_path = os.path.join(real_dirs[directory], name)
+        try:
+            mode = os.lstat(real_path).st_mode
+        except OSError:
+            missing.append(path)
+            continue
+        if stat.S_ISLNK(mode):
+            # 文件本身是符号链接时按链接目标判断
+            real_path = os.path.realpath(real_path)
+            if not os.path.isfile(real_path):
+                missing.append(path)
+                continue
+        elif not stat.S_ISREG(mode):
+            missing.append(path)
+            continue
+        allowed_root = find_allowed_root(real_path, allowed_roots)
+        if allowed_root is None:
+            outside.append(path)
+            continue
+        if real_path in seen:
+            continue
+        seen.add(real_path)
+
+        # 已确认在允许根目录下，直接截取相对路径
+        filename = real_path[len(allowed_root.rstrip(os.sep)) + 1:].replace(os.sep, '/')
+        items.append({
+            'filename': filename,
+            'path': real_path,
+            'city': parse_dataset_path(filename)['city'],
+            'in_place': True,
+        })
+
+    if outside:
+        raise PermissionError(f'路径不在允许读取的目录下: {_examples(outside)}')
+    if missing:
+        raise ValueError(f'文件不存在: {_examples(missing)}')
+    if not items:
+        raise ValueError('未找到视频文件')
+    return items
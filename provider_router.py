@@ -0,0 +1,230 @@
+"""
+多提供商路由
+按提供商能力（是否支持视频/文本、请求体上限、相对成本）和观测到的健康状况（p50/p95延迟、连续失败）
+为每个请求排序候选提供商：请求体不超过上限的提供商优先（无需压缩），其次延迟低、成本低；
+连续失败的提供商进入冷却期，冷却期内排在最后，请求失败时自动切换到下一个提供商；
+请求本身无效（如视频损坏、格式不支持）时不切换，也不计入提供商的失败次数
+"""
+
+import re
+import threading
+import time
+from collections import deque
+
+from rate_limiter import is_rate_limit_error, is_timeout_error
+
+
+# 请求类型
+QUERY_KINDS = ('image', 'video', 'text')
+
+# Base64编码后的大小约为原始大小的1.33倍
+BASE64_RATIO = 1.33
+
+# 请求本身无效（视频损坏、格式不支持、参数错误、内容审核未通过）的错误关键词：换提供商也会失败
+REQUEST_ERROR_KEYWORDS = ['invalidparameter', 'invalid_request', 'invalid request', 'bad request',
+                          'datainspectionfailed', 'unsupported', 'corrupt', 'invalid data found',
+                          'moov atom not found', 'content policy', 'content_filter',
+                          '文件不存在', '格式不支持', '无法解码', '抽帧失败']
+
+# 由提供商处理、与请求内容无关的HTTP状态码（认证、请求体过大等），其余4xx视为请求本身无效
+PROVIDER_STATUS_CODES = (401, 403, 408, 413, 429)
+
+
+def _status_code(error):
+    """从SDK异常（status_code / response.status_code）或以状态码开头的错误信息中取出HTTP状态码"""
+    for value in (getattr(error, 'status_code', None), getattr(getattr(error, 'response', None), 'status_code', None)):
+        if isinstance(value, int):
+            return value
+    match = re.match(r'\s*(\d{3})\b', str(error))
+    return int(match.group(1)) if match else None
+
+
+def classify_error(error):
+    """
+    判断失败应归因于请求本身还是提供商
+
+    Args:
+        error: 异常，或结果中的错误信息
+
+    Returns:
+        str: 'request'（请求本身无效，不切换提供商、不计入失败） /
+             'provider'（网络、超时、5xx、429/配额等提供商侧错误，以及无法判断的错误，切换到下一个提供商）
+    """
+    if is_rate_limit_error(error) or is_timeout_error(error):
+        return 'provider'
+    status = _status_code(error)
+    if status is not None and 400 <= status < 500:
+        return 'provider' if status in PROVIDER_STATUS_CODES else 'request'
+    if status is not None and status >= 500:
+        return 'provider'
+    error_msg = str(error).lower()
+    if any(keyword in error_msg for keyword in REQUEST_ERROR_KEYWORDS):
+        return 'request'
+    return 'provider'
+
+
+def percentile(values, fraction):
+    """计算分位数（values 非空）"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class ProviderHealth:
+    """单个提供商单类请求的健康状况：最近的成功延迟、连续失败次数和冷却期"""
+
+    def __init__(self, window=100):
+        self.latencies = deque(maxlen=window)
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.degraded_until = 0.0
+        self.last_error = ''
+
+    def is_degraded(self, now=None):
+        return (now or time.monotonic()) < self.degraded_until
+
+    def get_state(self):
+        return {
+            'p50_latency': round(percentile(self.latencies, 0.5), 3) if self.latencies else None,
+            'p95_latency': round(percentile(self.latencies, 0.95), 3) if self.latencies else None,
+            'successes': self.successes,
+            'failures': self.failures,
+            'consecutive_failures': self.consecutive_failures,
+            'degraded': self.is_degraded(),
+            'degraded_for': round(max(0.0, self.degraded_until - time.monotonic()), 1),
+            'last_error': self.last_error,
+        }
+
+
+class ProviderRouter:
+    """按请求体大小和健康状况选择提供商"""
+
+    def __init__(self, providers, capabilities, failure_threshold=3, cooldown_seconds=60):
+        """
+        Args:
+            providers: 参与路由的提供商名称列表（顺序为同等条件下的优先顺序）
+            capabilities: {provider: {'video': bool, 'text': bool, 'max_payload_mb': Base64请求体上限, 'cost': 相对成本}}
+            failure_threshold: 连续失败多少次后进入冷却期
+            cooldown_seconds: 冷却期秒数，冷却期结束后重新参与路由，再次失败时立即重新冷却
+        """
+        unknown = [p for p in providers if p not in capabilities]
+        if unknown:
+            raise ValueError(f"不支持的提供商: {', '.join(unknown)}")
+        self.providers = list(providers)
+        self.capabilities = capabilities
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown_seconds = cooldown_seconds
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def _get_health(self, provider, kind):
+        """调用方需持有锁"""
+        key = (provider, kind)
+        if key not in self._health:
+            self._health[key] = ProviderHealth()
+        return self._health[key]
+
+    def supports(self, provider, kind):
+        capability = self.capabilities[provider]
+        if kind == 'video':
+            return capability.get('video', False)
+        if kind == 'text':
+            return capability.get('text', True)
+        return True
+
+    def max_upload_bytes(self, provider):
+        """视频原始文件的大小上限（Base64请求体上限 / 1.33）"""
+        return self.capabilities[provider]['max_payload_mb'] * 1024 * 1024 / BASE64_RATIO
+
+    def candidates(self, kind, payload_bytes=None):
+        """
+        按优先级返回支持该类请求的提供商列表
+
+        排序依据：未处于冷却期 > 原始请求体不超过上限（无需压缩） > p50延迟低 > 成本低 > 配置顺序
+        没有延迟数据的提供商按已观测提供商的平均p50计，由成本和配置顺序决定先后
+        """
+        now = time.monotonic()
+        with self._lock:
+            eligible = [(i, p) for i, p in enumerate(self.providers) if self.supports(p, kind)]
+            observed = {p: percentile(self._get_health(p, kind).latencies, 0.5)
+                        for _, p in eligible if self._get_health(p, kind).latencies}
+            prior = sum(observed.values()) / len(observed) if observed else 0.0
+
+            def sort_key(item):
+                index, provider = item
+                fits = payload_bytes is None or payload_bytes <= self.max_upload_bytes(provider)
+                return (self._get_health(provider, kind).is_degraded(now), not fits, observed.get(provider, prior),
+                        self.capabilities[provider].get('cost', 1.0), index)
+
+            return [provider for _, provider in sorted(eligible, key=sort_key)]
+
+    def record_success(self, provider, kind, latency):
+        with self._lock:
+            health = self._get_health(provider, kind)
+            health.latencies.append(latency)
+            health.successes += 1
+            health.consecutive_failures = 0
+            health.degraded_until = 0.0
+
+    def record_failure(self, provider, kind, error):
+        with self._lock:
+            health = self._get_health(provider, kind)
+            health.failures += 1
+            health.consecutive_failures += 1
+            health.last_error = str(error)[:200]
+            if health.consecutive_failures >= self.failure_threshold:
+                health.degraded_until = time.monotonic() + self.cooldown_seconds
+                print(f"⚠️ 提供商 {provider} 的{kind}请求连续失败{health.consecutive_failures}次，"
+                      f"{self.cooldown_seconds:.0f}秒内优先使用其他提供商")
+
+    def route(self, kind, call, payload_bytes=None, is_available=None):
+        """
+        按路由顺序调用提供商：提供商侧错误记录失败并切换到下一个提供商，
+        请求本身无效时直接返回错误（不切换、不计入失败），成功时记录端到端延迟，结果中的 provider 为实际使用的提供商
+
+        Args:
+            kind: 请求类型 'image' / 'video' / 'text'
+            call: call(provider) -> 结果字典（失败时包含 error），也可直接抛出异常
+            payload_bytes: 视频原始大小，请求体上限足够的提供商优先（无需压缩）
+            is_available: is_available(provider) -> bool，不可用（如未初始化）的提供商记为失败并跳过
+        """
+        candidates = self.candidates(kind, payload_bytes)
+        if not candidates:
+            return {"answer": "没有支持该请求的模型提供商", "error": "没有可用的模型提供商"}
+
+        result = None
+        for provider in candidates:
+            if is_available is not None and not is_available(provider):
+                result = {"answer": f"{provider} 模型未初始化", "error": "模型未初始化"}
+                error = result["error"]
+            else:
+                started = time.monotonic()
+                try:
+                    result = call(provider)
+                    error = result.get("error")
+                except Exception as e:
+                    result = {"answer": f"{provider} 查询失败: {str(e)}", "error": str(e)}
+                    error = e
+                if not error:
+                    self.record_success(provider, kind, time.monotonic() - started)
+                    result["provider"] = provider
+                    return result
+                if classify_error(error) == 'request':
+                    print(f"❌ {provider} 请求本身无效（如视频损坏或格式不支持），不切换提供商: {str(error)[:100]}")
+                    return result
+
+            self.record_failure(provider, kind, error)
+            if provider != candidates[-1]:
+                print(f"🔀 {provider} 请求失败，切换到下一个提供商: {str(error)[:100]}")
+        return result
+
+    def get_status(self):
+        """各提供商的能力和各类请求的健康状况"""
+        with self._lock:
+            status = {}
+            for provider in self.providers:
+                status[provider] = dict(self.capabilities[provider])
+                status[provider]['health'] = {kind: self._health[(provider, kind)].get_state()
+                                              for kind in QUERY_KINDS if (provider, kind) in self._health}
+            return status
@@ -0,0 +1,449 @@
+"""
+请求限流器
+按提供商的每个API Key维护独立的令牌桶，支持持续速率和突发容量，
+并根据429/配额错误和请求超时自适应调整速率与并发（AIMD），请求分配给负载最低的可用Key
+"""
+
+import asyncio
+import threading
+import time
+
+
+# 频率限制/配额错误关键词
+RATE_LIMIT_KEYWORDS = ['rate limit', '频率', 'quota', 'limit exceeded', 'too many requests', '429', 'throttling']
+
+# 请求超时关键词
+TIMEOUT_KEYWORDS = ['timed out', 'timeout', '超时']
+
+
+def is_rate_limit_error(error):
+    """判断异常或错误信息是否为频率限制/配额错误"""
+    error_msg = str(error).lower()
+    return any(keyword in error_msg for keyword in RATE_LIMIT_KEYWORDS)
+
+
+def is_timeout_error(error):
+    """判断异常是否为请求超时（requests/httpx/各SDK的超时异常类名均包含 Timeout）"""
+    if isinstance(error, TimeoutError) or 'timeout' in type(error).__name__.lower():
+        return True
+    error_msg = str(error).lower()
+    return any(keyword in error_msg for keyword in TIMEOUT_KEYWORDS)
+
+
+class TokenBucket:
+    """
+    令牌桶限流器
+
+    - rate: 持续速率（每秒补充的令牌数）
+    - burst: 桶容量（允许的突发请求数）
+
+    令牌在锁内预约、在锁外等待：令牌数允许为负，每个调用者预约一个令牌后
+    按欠账计算自己的等待时间，因此调用者按预约顺序依次放行（公平），
+    且任何线程都不会持锁睡眠
+    """
+
+    def __init__(self, rate, burst=1, clock=time.monotonic):
+        if rate <= 0:
+            raise ValueError(f"令牌桶速率必须大于0: {rate}")
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        """按经过的时间补充令牌（调用方需持有锁）"""
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """预约一个令牌，返回放行前需要等待的秒数（不睡眠）"""
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """阻塞直到获得令牌，返回实际等待的秒数"""
+        wait_time = self.reserve()
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return wait_time
+
+    async def acquire_async(self):
+        """acquire 的协程版本，等待期间不阻塞事件循环；等待中被取消时退还预约的令牌"""
+        wait_time = self.reserve()
+        if wait_time > 0:
+            try:
+                await asyncio.sleep(wait_time)
+            except BaseException:
+                self.refund()
+                raise
+        return wait_time
+
+    def refund(self):
+        """退还一个已预约但未使用的令牌"""
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens = min(self.burst, self._tokens + 1)
+
+    def set_rate(self, rate, burst=None):
+        """调整速率和容量（已预约的令牌不受影响）"""
+        if rate <= 0:
+            raise ValueError(f"令牌桶速率必须大于0: {rate}")
+        with self._lock:
+            self._refill(self._clock())
+            self.rate = float(rate)
+            if burst is not None:
+                self.burst = max(1, int(burst))
+                self._tokens = min(self._tokens, self.burst)
+
+    def drain(self):
+        """清空可用令牌（被限流后，下一次请求至少等待一个令牌周期）"""
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens = min(self._tokens, 0.0)
+
+    def get_state(self):
+        with self._lock:
+            self._refill(self._clock())
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'available_tokens': round(self._tokens, 3),
+            }
+
+
+class AdaptiveRateController:
+    """
+    自适应限流控制器（AIMD）
+
+    - 请求成功：速率加性增加 rate_step，并发上限每轮增加1
+    - 429/配额错误或请求超时：速率和并发上限按 decrease_factor 乘性减少
+    同一个冷却周期内的多次拥塞信号只触发一次减少，避免并发请求同时失败时速率崩塌
+    成功请求的延迟只用于统计和计算冷却周期，不作为拥塞信号：各请求的视频大小相差一个数量级，
+    整次调用的延迟主要反映负载大小而不是提供商的拥塞程度
+    """
+
+    def __init__(self, rate, burst=1, min_rate=None, max_rate=None, max_concurrency=4, initial_concurrency=None,
+                 rate_step=None, decrease_factor=0.5, latency_alpha=0.2,
+                 clock=time.monotonic):
+        """
+        Args:
+            rate: 初始速率（每秒请求数）
+            burst: 令牌桶容量
+            min_rate / max_rate: 速率上下限，默认为初始速率的 1/10 和 10 倍
+            max_concurrency: 并发请求上限的最大值
+            initial_concurrency: 初始并发上限，默认等于 max_concurrency
+            rate_step: 每次成功后增加的速率，默认为初始速率的 1/10
+            decrease_factor: 拥塞时的乘性减少系数
+            latency_alpha: 延迟基线的指数平滑系数
+            clock: 单调时钟（测试时可替换）
+        """
+        self.bucket = TokenBucket(rate, burst, clock)
+        self._clock = clock
+        self.min_rate = min_rate if min_rate is not None else rate / 10
+        self.max_rate = max_rate if max_rate is not None else rate * 10
+        self.rate_step = rate_step if rate_step is not None else rate / 10
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.decrease_factor = decrease_factor
+        self.latency_alpha = latency_alpha
+
+        self.concurrency_limit = float(initial_concurrency or self.max_concurrency)
+        self.in_flight = 0
+        self.latency_baseline = None
+        self.success_count = 0
+        self.throttle_count = 0
+        self.timeout_count = 0
+        self._cooldown_until = 0.0
+        self._cond = threading.Condition()
+
+    def _acquire_slot(self):
+        """等待并发名额（Condition.wait 期间释放锁）"""
+        with self._cond:
+            while self.in_flight >= int(self.concurrency_limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def _try_acquire_slot(self):
+        """不等待地获取并发名额，名额已满时返回 False"""
+        with self._cond:
+            if self.in_flight >= int(self.concurrency_limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self):
+        """获取并发名额和速率令牌，返回令牌等待的秒数"""
+        self._acquire_slot()
+        try:
+            return self.bucket.acquire()
+        except BaseException:
+            self._release_slot()
+            raise
+
+    async def acquire_async(self, poll_interval=0.05):
+        """
+        acquire 的协程版本，等待期间不阻塞事件循环，也不占用线程池中的线程
+        并发名额已满时每隔 poll_interval 秒重试；等待中被取消时不持有名额，
+        获得名额后在等待令牌时被取消则归还名额和令牌
+        """
+        while not self._try_acquire_slot():
+            await asyncio.sleep(poll_interval)
+        try:
+            return await self.bucket.acquire_async()
+        except BaseException:
+            self._release_slot()
+            raise
+
+    def _release_slot(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def release(self, latency=None, throttled=False, timed_out=False):
+        """
+        请求结束后反馈结果
+        
+        Args:
+            latency: 成功请求的耗时（秒），失败时为 None
+            throttled: 是否为429/配额错误
+            timed_out: 是否为请求超时
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.throttle_count += 1
+                self._decrease()
+            elif timed_out:
+                self.timeout_count += 1
+                self._decrease()
+            elif latency is not None:
+                self.success_count += 1
+                self._increase()
+                self._update_latency(latency)
+            self._cond.notify_all()
+
+    def _update_latency(self, latency):
+        if self.latency_baseline is None:
+            self.latency_baseline = latency
+        else:
+            self.latency_baseline += self.latency_alpha * (latency - self.latency_baseline)
+
+    def _increase(self):
+        """加性增加（调用方需持有锁）"""
+        new_rate = min(self.max_rate, self.bucket.rate + self.rate_step)
+        if new_rate != self.bucket.rate:
+            self.bucket.set_rate(new_rate)
+        self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1.0 / self.concurrency_limit)
+
+    def _decrease(self):
+        """乘性减少（调用方需持有锁），一个冷却周期内只生效一次"""
+        now = self._clock()
+        if now < self._cooldown_until:
+            return
+        new_rate = max(self.min_rate, self.bucket.rate * self.decrease_factor)
+        self.bucket.set_rate(new_rate)
+        self.bucket.drain()
+        self.concurrency_limit = max(1.0, self.concurrency_limit * self.decrease_factor)
+        # 冷却周期：新速率下的一个令牌周期，且不短于当前延迟基线
+        self._cooldown_until = now + max(1.0 / new_rate, self.latency_baseline or 0.0)
+        print(f"⚠️ 限流控制：检测到拥塞，速率降至 {new_rate:.3f} 次/秒，并发上限降至 {int(self.concurrency_limit)}")
+
+    def get_state(self):
+        state = self.bucket.get_state()
+        with self._cond:
+            state.update({
+                'concurrency_limit': int(self.concurrency_limit),
+                'in_flight': self.in_flight,
+                'min_rate': self.min_rate,
+                'max_rate': self.max_rate,
+                'latency_baseline': round(self.latency_baseline, 3) if self.latency_baseline is not None else None,
+                'success_count': self.success_count,
+                'throttle_count': self.throttle_count,
+                'timeout_count': self.timeout_count,
+            })
+        return state
+
+
+def mask_api_key(api_key):
+    """只显示API Key的末4位，用于日志和状态接口"""
+    return f"...{api_key[-4:]}" if len(api_key) > 4 else ("***" if api_key else "")
+
+
+class ApiKeyState:
+    """单个API Key的限流控制器、配额计数和429冷却期"""
+
+    def __init__(self, api_key, controller):
+        self.api_key = api_key
+        self.controller = controller
+        self.pending = 0  # 已分配到此Key、尚未结束的请求数
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.throttles = 0
+        self.consecutive_throttles = 0
+        self.cooldown_until = 0.0
+
+    def get_state(self, now):
+        state = self.controller.get_state()
+        state.update({
+            'key': mask_api_key(self.api_key),
+            'pending': self.pending,
+            'requests': self.requests,
+            'successes': self.successes,
+            'failures': self.failures,
+            'throttles': self.throttles,
+            'cooling_down': now < self.cooldown_until,
+            'cooldown_remaining': round(max(0.0, self.cooldown_until - now), 1),
+        })
+        return state
+
+
+class ApiKeyPool:
+    """
+    同一提供商的多个API Key
+
+    每个Key有独立的自适应限流控制器（速率按单个Key的配额计），总吞吐随Key数量线性增加；
+    请求分配给负载最低（已分配请求数/并发上限最小、可用令牌最多）且不在冷却期的Key，
+    Key遇到429/配额错误后进入冷却期（连续被限流时冷却期成倍延长，最长8倍），
+    所有Key都在冷却时使用最早结束冷却的Key
+    """
+
+    def __init__(self, api_keys, controller_factory, cooldown_seconds=60, clock=time.monotonic):
+        """
+        Args:
+            api_keys: API Key列表，为空时使用一个空Key（只做限流）
+            controller_factory: 为每个Key创建 AdaptiveRateController 的函数
+            cooldown_seconds: Key被限流后的基础冷却秒数
+            clock: 单调时钟（测试时可替换）
+        """
+        self.cooldown_seconds = cooldown_seconds
+        self._clock = clock
+        self._keys = [ApiKeyState(api_key, controller_factory()) for api_key in (list(api_keys) or [''])]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _select(self):
+        """选择负载最低的可用Key并计入已分配请求数"""
+        now = self._clock()
+        with self._lock:
+            available = [k for k in self._keys if now >= k.cooldown_until]
+            if available:
+                key = min(available, key=lambda k: (k.pending / max(1, int(k.controller.concurrency_limit)),
+                                                    -k.controller.bucket.get_state()['available_tokens']))
+            else:
+                key = min(self._keys, key=lambda k: k.cooldown_until)
+            key.pending += 1
+            key.requests += 1
+            return key
+
+    def _unselect(self, key):
+        with self._lock:
+            key.pending -= 1
+
+    def acquire(self):
+        """
+        选择Key并获取该Key的并发名额和速率令牌
+
+        Returns:
+            (ApiKeyState, 令牌等待秒数)
+        """
+        key = self._select()
+        try:
+            return key, key.controller.acquire()
+        except BaseException:
+            self._unselect(key)
+            raise
+
+    async def acquire_async(self):
+        """acquire 的协程版本，等待中被取消时撤销对Key的分配"""
+        key = self._select()
+        try:
+            return key, await key.controller.acquire_async()
+        except BaseException:
+            self._unselect(key)
+            raise
+
+    def release(self, key, latency=None, throttled=False, timed_out=False):
+        """
+        请求结束后反馈结果
+
+        Args:
+            key: acquire 返回的 ApiKeyState
+            latency: 成功请求的耗时（秒），失败时为 None
+            throttled: 是否为429/配额错误（该Key进入冷却期）
+            timed_out: 是否为请求超时（只降低该Key的速率和并发，不进入冷却期）
+        """
+        key.controller.release(latency=latency, throttled=throttled, timed_out=timed_out)
+        with self._lock:
+            key.pending -= 1
+            if throttled:
+                key.throttles += 1
+                key.consecutive_throttles += 1
+                cooldown = self.cooldown_seconds * min(8, 2 ** (key.consecutive_throttles - 1))
+                key.cooldown_until = self._clock() + cooldown
+                if len(self._keys) > 1:
+                    print(f"⚠️ API Key {mask_api_key(key.api_key)} 被限流，{cooldown:.0f}秒内优先使用其他Key")
+            elif latency is not None:
+                key.successes += 1
+                key.consecutive_throttles = 0
+            else:
+                key.failures += 1
+
+    def get_state(self):
+        now = self._clock()
+        with self._lock:
+            keys = [key.get_state(now) for key in self._keys]
+        return {
+            'key_count': len(keys),
+            'available_keys': sum(1 for key in keys if not key['cooling_down']),
+            'total_rate': round(sum(key['rate'] for key in keys), 3),
+            'in_flight': sum(key['in_flight'] for key in keys),
+            'keys': keys,
+        }
+
+
+class RateLimiterRegistry:
+    """按提供商名称管理API Key池（每个Key一个自适应限流控制器），不同提供商之间互不阻塞"""
+
+    def __init__(self, limits, adaptive_options=None, api_keys=None, key_cooldown=60):
+        """
+        Args:
+            limits: {provider: {'rate': 每秒请求数, 'burst': 突发容量, ...}}，需包含 'default'，速率按单个Key计
+            adaptive_options: 所有提供商共用的 AdaptiveRateController 参数
+            api_keys: {provider: [API Key, ...]}，未配置的提供商使用一个空Key
+            key_cooldown: Key被限流后的基础冷却秒数
+        """
+        self.limits = limits
+        self.adaptive_options = adaptive_options or {}
+        self.api_keys = api_keys or {}
+        self.key_cooldown = key_cooldown
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _create_controller(self, api_type):
+        limit = self.limits.get(api_type, self.limits['default'])
+        options = dict(self.adaptive_options)
+        options.update({k: v for k, v in limit.items() if k not in ('rate', 'burst')})
+        return AdaptiveRateController(limit['rate'], limit.get('burst', 1), **options)
+
+    def get(self, api_type):
+        """获取提供商的API Key池"""
+        with self._lock:
+            pool = self._pools.get(api_type)
+            if pool is None:
+                pool = ApiKeyPool(self.api_keys.get(api_type, []), lambda: self._create_controller(api_type),
+                                  self.key_cooldown)
+                self._pools[api_type] = pool
+            return pool
+
+    def get_state(self):
+        with self._lock:
+            pools = dict(self._pools)
+        return {api_type: pool.get_state() for api_type, pool in pools.items()}
@@ -0,0 +1,143 @@
+"""
+模型响应缓存
+以媒体内容的SHA-256 + 问题 + 模型类型 + 模型名称为键，把成功的查询结果持久化到磁盘，
+重跑同一数据集时直接返回缓存结果，不再重复上传和计费
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """分块计算文件内容的SHA-256"""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def image_sha256(image):
+    """计算PIL图像像素内容的SHA-256（包含模式和尺寸，避免不同图像像素字节相同）"""
+    sha256 = hashlib.sha256()
+    sha256.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    sha256.update(image.tobytes())
+    return sha256.hexdigest()
+
+
+class ResponseCache:
+    """
+    基于SQLite的持久化响应缓存
+    - 按条目年龄淘汰：超过 max_age 秒的条目视为失效
+    - 按总大小淘汰：超过 max_bytes 时优先删除最久未访问的条目
+    """
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024, max_age=30 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """首次使用时创建目录和数据库（调用方需持有锁）"""
+        if self._conn is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.cache_dir, 'responses.db'), check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)')
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(media_hash, question, model_type, model_name):
+        """由媒体哈希、问题、模型类型和模型名称生成缓存键"""
+        payload = json.dumps([media_hash, question, model_type, model_name], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """查询缓存，命中返回结果字典，未命中或已过期返回 None"""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute('SELECT response, created_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            response, created_at = row
+            if self.max_age and now - created_at > self.max_age:
+                conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                conn.commit()
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            conn.commit()
+            self.hits += 1
+        return json.loads(response)
+
+    def put(self, key, result):
+        """写入缓存，并按年龄和总大小淘汰旧条目"""
+        response = json.dumps(result, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                (key, response, len(response.encode('utf-8')), now, now)
+            )
+            self.writes += 1
+            self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn, now):
+        """淘汰过期条目和超出大小上限的最久未访问条目（调用方需持有锁）"""
+        if self.max_age:
+            cursor = conn.execute('DELETE FROM responses WHERE created_at < ?', (now - self.max_age,))
+            self.evictions += max(cursor.rowcount, 0)
+
+        total_size = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+
+        for key, size in conn.execute('SELECT key, size FROM responses ORDER BY accessed_at').fetchall():
+            if total_size <= self.max_bytes:
+                break
+            conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total_size -= size
+            self.evictions += 1
+
+    def get_stats(self):
+        with self._lock:
+            conn = self._connect()
+            entries, total_size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'size_mb': round(total_size / 1024 / 1024, 2),
+                'max_size_mb': round(self.max_bytes / 1024 / 1024, 2),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'writes': self.writes,
+                'evictions': self.evictions,
+            }
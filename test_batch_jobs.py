@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+测试批量任务的状态转换
+使用桩模型（可阻塞在指定视频上），验证暂停、恢复、取消、结束后的控制请求以及工作线程出错时的处理
+"""
+
+import os
+import threading
+import time
+
+import pytest
+
+from batch_jobs import BatchJobManager
+
+
+TIMEOUT = 5
+
+
+class StubModel:
+    """按调用顺序返回结果的桩模型；gate 未放行前阻塞在 query_video 中"""
+
+    def __init__(self, block=False):
+        self.calls = []
+        self.gate = threading.Event()
+        self.entered = threading.Event()
+        if not block:
+            self.gate.set()
+        self._lock = threading.Lock()
+
+    def query_video(self, video_path, question, **options):
+        with self._lock:
+            self.calls.append(video_path)
+        self.entered.set()
+        assert self.gate.wait(TIMEOUT)
+        return {'answer': f'answer for {video_path}', 'request_id': 'req'}
+
+
+def wait_until(predicate):
+    deadline = time.time() + TIMEOUT
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError('等待超时')
+        time.sleep(0.01)
+
+
+def make_items(tmp_path, count, in_place=False):
+    items = []
+    for i in range(count):
+        path = tmp_path / f'video_{i}.mp4'
+        path.write_bytes(b'video')
+        items.append({'filename': path.name, 'path': str(path), 'city': 'city', 'in_place': in_place})
+    return items
+
+
+@pytest.fixture
+def blocked_job(tmp_path):
+    """单个工作线程阻塞在第1个视频上的任务"""
+    model = StubModel(block=True)
+    manager = BatchJobManager(model, worker_count=1)
+    items = make_items(tmp_path, 3)
+    job = manager.submit('问题', items, skip_export=True)
+    assert model.entered.wait(TIMEOUT)
+    yield manager, job, model, items
+    model.gate.set()
+
+
+def test_job_completes(tmp_path):
+    model = StubModel()
+    manager = BatchJobManager(model, worker_count=2)
+    items = make_items(tmp_path, 3)
+
+    job = manager.submit('问题', items, skip_export=True)
+    wait_until(lambda: job.is_finished)
+
+    state = job.to_dict()
+    assert state['status'] == 'completed'
+    assert (state['completed'], state['succeeded'], state['failed']) == (3, 3, 0)
+    assert sorted(model.calls) == sorted(item['path'] for item in items)
+    # 上传的临时文件处理完成后删除
+    assert not any((tmp_path / item['filename']).exists() for item in items)
+
+
+def test_pause_parks_remaining_items_until_resume(blocked_job):
+    manager, job, model, items = blocked_job
+
+    assert manager.pause_job(job.job_id) is job
+    assert job.to_dict()['status'] == 'paused'
+    # 重复暂停不改变状态
+    assert not job.pause()
+
+    # 正在处理的视频继续完成，其余视频暂存到任务中
+    model.gate.set()
+    wait_until(lambda: job.completed == 1 and len(job._parked) == 2)
+    assert model.calls == [items[0]['path']]
+    assert job.to_dict()['status'] == 'paused'
+
+    manager.resume_job(job.job_id)
+    wait_until(lambda: job.is_finished)
+    assert job.to_dict()['status'] == 'completed'
+    assert len(model.calls) == 3
+
+
+def test_resume_without_pause_is_noop(blocked_job):
+    manager, job, model, _ = blocked_job
+
+    assert job.resume() is None
+    assert manager.resume_job('missing') is None
+    assert job.to_dict()['status'] == 'running'
+
+
+def test_cancel_skips_unprocessed_items(blocked_job):
+    manager, job, model, items = blocked_job
+
+    manager.cancel_job(job.job_id)
+    assert job.to_dict()['status'] == 'cancelled'
+    # 正在处理的视频完成前任务尚未结束
+    assert job.finished_at is None
+
+    model.gate.set()
+    wait_until(lambda: job.finished_at is not None)
+
+    state = job.to_dict()
+    assert state['status'] == 'cancelled'
+    assert (state['completed'], state['cancelled']) == (1, 2)
+    assert model.calls == [items[0]['path']]
+    assert not any(os.path.exists(item['path']) for item in items)
+
+
+def test_cancel_paused_job_releases_parked_items(blocked_job):
+    manager, job, model, items = blocked_job
+
+    manager.pause_job(job.job_id)
+    model.gate.set()
+    wait_until(lambda: job.completed == 1 and len(job._parked) == 2)
+
+    manager.cancel_job(job.job_id)
+
+    state = job.to_dict()
+    assert state['status'] == 'cancelled'
+    assert (state['completed'], state['cancelled']) == (1, 2)
+    assert job.finished_at is not None
+    assert job._parked == []
+
+
+def test_terminal_job_ignores_control_requests(tmp_path):
+    manager = BatchJobManager(StubModel(), worker_count=1)
+    job = manager.submit('问题', make_items(tmp_path, 2), skip_export=True)
+    wait_until(lambda: job.is_finished)
+    finished_at = job.finished_at
+
+    assert not job.pause()
+    assert job.resume() is None
+    assert job.cancel() == (None, False)
+    manager.pause_job(job.job_id)
+    manager.cancel_job(job.job_id)
+
+    assert job.to_dict()['status'] == 'completed'
+    assert job.finished_at == finished_at
+
+
+def test_export_failure_is_recorded(tmp_path):
+    def export_func(video_result):
+        raise OSError('磁盘已满')
+
+    manager = BatchJobManager(StubModel(), worker_count=1, export_func=export_func)
+    job = manager.submit('问题', make_items(tmp_path, 1))
+    wait_until(lambda: job.is_finished)
+
+    events, snapshot = job.subscribe()
+    assert snapshot['status'] == 'completed'
+    assert snapshot['succeeded'] == 1
+    assert snapshot['video_exports'] == []
+
+
+def test_worker_error_records_failure(tmp_path):
+    # 导出函数返回 None 时 _process_item 抛出异常，工作线程把该视频记为失败，任务仍能结束
+    manager = BatchJobManager(StubModel(), worker_count=1, export_func=lambda video_result: None)
+    job = manager.submit('问题', make_items(tmp_path, 2))
+    wait_until(lambda: job.is_finished)
+
+    state = job.to_dict()
+    assert state['status'] == 'completed'
+    assert (state['completed'], state['failed']) == (2, 2)
+    assert all(not result['success'] for result in state['results'])
+    assert job.has_result(0) and job.has_result(1)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+测试批量任务的持久化和重启恢复
+把部分完成的任务写入临时SQLite数据库，用新的 BatchJobManager 恢复，验证只重新处理未完成的视频
+"""
+
+import os
+
+from batch_jobs import BatchJob, BatchJobManager
+from job_store import JobStore
+from test_batch_jobs import StubModel, make_items, wait_until
+
+
+def persist_partial_job(tmp_path, items, done_indices, status='running'):
+    """模拟服务退出前的状态：任务已开始，done_indices 中的视频已保存结果"""
+    store = JobStore(str(tmp_path / 'jobs.db'))
+    job = BatchJob('问题', items, skip_export=True, video_options={'strategy': 'frames'})
+    store.save_job(job)
+    store.mark_started(job.job_id, job.created_at)
+    for index in done_indices:
+        store.record_result(job.job_id, index, {'filename': items[index]['filename'], 'answer': '旧结果',
+                                                'success': True, 'request_id': 'old'})
+    if status != 'running':
+        store.update_status(job.job_id, status)
+    return job.job_id
+
+
+def resume_from(tmp_path, model):
+    """用同一个数据库文件创建新的存储和管理器（相当于服务重启）"""
+    store = JobStore(str(tmp_path / 'jobs.db'))
+    manager = BatchJobManager(model, worker_count=2, store=store)
+    return manager, store, manager.resume()
+
+
+def test_resume_requeues_only_unfinished_items(tmp_path):
+    items = make_items(tmp_path, 4, in_place=True)
+    job_id = persist_partial_job(tmp_path, items, done_indices=[0, 2])
+
+    model = StubModel()
+    manager, store, resumed = resume_from(tmp_path, model)
+    assert resumed == 1
+
+    job = manager.get_job(job_id)
+    wait_until(lambda: job.is_finished)
+
+    assert sorted(model.calls) == [items[1]['path'], items[3]['path']]
+    state = job.to_dict()
+    assert state['status'] == 'completed'
+    assert state['resumed'] is True
+    assert state['video_options'] == {'strategy': 'frames'}
+    assert (state['completed'], state['succeeded']) == (4, 4)
+    assert [result['answer'] for result in state['results']][::2] == ['旧结果', '旧结果']
+
+    # 原地读取的服务器文件恢复后仍按原地处理，不会被删除
+    assert all(item['in_place'] for item in job.items)
+    assert all(os.path.exists(item['path']) for item in items)
+    assert store.load_unfinished() == []
+
+
+def test_resume_keeps_paused_job_parked(tmp_path):
+    items = make_items(tmp_path, 3)
+    job_id = persist_partial_job(tmp_path, items, done_indices=[0], status='paused')
+
+    model = StubModel()
+    manager, store, _ = resume_from(tmp_path, model)
+    job = manager.get_job(job_id)
+    wait_until(lambda: len(job._parked) == 2)
+
+    assert model.calls == []
+    assert job.to_dict()['status'] == 'paused'
+
+    manager.resume_job(job_id)
+    wait_until(lambda: job.is_finished)
+    assert sorted(model.calls) == [items[1]['path'], items[2]['path']]
+    # 上传的临时文件处理完成后删除
+    assert not any(os.path.exists(item['path']) for item in items[1:])
+
+
+def test_resume_marks_missing_files_failed(tmp_path):
+    items = make_items(tmp_path, 2, in_place=True)
+    job_id = persist_partial_job(tmp_path, items, done_indices=[0])
+    os.unlink(items[1]['path'])
+
+    model = StubModel()
+    manager, store, _ = resume_from(tmp_path, model)
+    job = manager.get_job(job_id)
+    wait_until(lambda: job.is_finished)
+
+    assert model.calls == []
+    assert job.results[1]['error'] == '服务重启后未找到视频文件'
+    assert store.get_stats()['unfinished_jobs'] == 0
+
+
+def test_resume_finishes_job_whose_results_were_all_saved(tmp_path):
+    items = make_items(tmp_path, 2)
+    job_id = persist_partial_job(tmp_path, items, done_indices=[0, 1])
+
+    model = StubModel()
+    manager, store, resumed = resume_from(tmp_path, model)
+
+    assert resumed == 1
+    assert manager.get_job(job_id).to_dict()['status'] == 'completed'
+    assert model.calls == []
+    assert store.load_unfinished() == []
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+测试视频请求体编码
+验证分块编码结果与整文件Base64一致，并在子进程中测量各构造方式的峰值RSS
+"""
+
+import base64
+import os
+import sys
+
+import pytest
+
+from media_payload import CHUNK_SIZE, base64_encoded_size, encode_file_base64, measure_payload_memory, read_file_bytes
+
+
+PREFIX = 'data:video/mp4;base64,'
+
+
+@pytest.mark.parametrize('size', [0, 1, 2, 3, CHUNK_SIZE - 1, CHUNK_SIZE, CHUNK_SIZE + 1, 2 * CHUNK_SIZE + 2])
+def test_chunked_encoding_matches_base64(tmp_path, size):
+    data = os.urandom(size)
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(data)
+
+    encoded = encode_file_base64(str(path), PREFIX)
+
+    assert encoded == PREFIX + base64.b64encode(data).decode('ascii')
+    assert len(encoded) - len(PREFIX) == base64_encoded_size(size)
+    assert read_file_bytes(str(path)) == data
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='峰值RSS测量需要 Linux / macOS')
+def test_measure_payload_memory(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(os.urandom(8 * 1024 * 1024))
+
+    results = measure_payload_memory(str(path), PREFIX)
+
+    base64_mb = results['base64_mb']
+    # 直接读取字节约占一份文件大小；分块编码在拼接时短暂同时存在两份Base64
+    assert results['raw_bytes'] == pytest.approx(results['file_mb'], rel=0.25)
+    assert 1.5 * base64_mb < results['chunked'] < 2.5 * base64_mb
+    assert results['chunked'] < results['whole_file'] < results['chunked_json']
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+测试服务器路径提交的路径校验
+使用临时目录，验证 ../、符号链接逃逸、非普通文件等情况被拒绝
+"""
+
+import os
+
+import pytest
+
+from path_ingest import collect_video_items, find_allowed_root, normalize_roots
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    """允许目录 allowed/亚洲/中国/北京 下两个视频，允许目录外 outside/secret.mp4"""
+    city_dir = tmp_path / 'allowed' / '亚洲' / '中国' / '北京'
+    city_dir.mkdir(parents=True)
+    (city_dir / 'a.mp4').write_bytes(b'a')
+    (city_dir / 'b.mp4').write_bytes(b'b')
+    outside = tmp_path / 'outside'
+    outside.mkdir()
+    (outside / 'secret.mp4').write_bytes(b's')
+    return tmp_path
+
+
+def roots(dataset):
+    return normalize_roots([str(dataset / 'allowed')])
+
+
+def test_find_allowed_root_requires_separator(tmp_path):
+    allowed = normalize_roots([str(tmp_path / 'data')])
+    assert find_allowed_root(str(tmp_path / 'data' / 'a.mp4'), allowed) == allowed[0]
+    # 同名前缀的目录不算在允许目录下
+    assert find_allowed_root(str(tmp_path / 'data2' / 'a.mp4'), allowed) is None
+
+
+def test_collect_directory(dataset):
+    items = collect_video_items(roots(dataset), root=str(dataset / 'allowed'))
+
+    assert sorted(item['filename'] for item in items) == ['亚洲/中国/北京/a.mp4', '亚洲/中国/北京/b.mp4']
+    assert all(item['in_place'] and os.path.isabs(item['path']) for item in items)
+    assert {item['city'] for item in items} == {'北京'}
+
+
+def test_relative_paths_and_dedupe(dataset):
+    root = str(dataset / 'allowed')
+    items = collect_video_items(roots(dataset), root=root, paths=[
+        '亚洲/中国/北京/a.mp4',
+        os.path.join(root, '亚洲', '中国', '北京', 'a.mp4'),
+        '亚洲/中国/../中国/北京/a.mp4',
+    ])
+
+    assert [item['filename'] for item in items] == ['亚洲/中国/北京/a.mp4']
+
+
+def test_no_allowed_roots(dataset):
+    with pytest.raises(PermissionError):
+        collect_video_items([], paths=[str(dataset / 'outside' / 'secret.mp4')])
+
+
+def test_dotdot_escape(dataset):
+    with pytest.raises(PermissionError):
+        collect_video_items(roots(dataset), root=str(dataset / 'allowed'), paths=['../outside/secret.mp4'])
+
+
+def test_root_outside_allowed(dataset):
+    with pytest.raises(PermissionError):
+        collect_video_items(roots(dataset), root=str(dataset / 'outside'))
+
+
+def test_symlink_file_escape(dataset):
+    link = dataset / 'allowed' / 'link.mp4'
+    link.symlink_to(dataset / 'outside' / 'secret.mp4')
+
+    with pytest.raises(PermissionError):
+        collect_video_items(roots(dataset), paths=[str(link)])
+
+
+def test_symlink_directory_escape(dataset):
+    link = dataset / 'allowed' / 'linked_dir'
+    link.symlink_to(dataset / 'outside', target_is_directory=True)
+
+    with pytest.raises(PermissionError):
+        collect_video_items(roots(dataset), paths=[str(link / 'secret.mp4')])
+
+
+def test_symlink_inside_allowed(dataset):
+    link = dataset / 'allowed' / 'alias.mp4'
+    link.symlink_to(dataset / 'allowed' / '亚洲' / '中国' / '北京' / 'a.mp4')
+
+    items = collect_video_items(roots(dataset), paths=[str(link)])
+    assert [item['filename'] for item in items] == ['亚洲/中国/北京/a.mp4']
+
+
+def test_non_regular_files(dataset):
+    city_dir = dataset / 'allowed' / '亚洲' / '中国' / '北京'
+    (city_dir / 'folder.mp4').mkdir()
+    with pytest.raises(ValueError):
+        collect_video_items(roots(dataset), paths=[str(city_dir / 'folder.mp4')])
+
+    if hasattr(os, 'mkfifo'):
+        os.mkfifo(city_dir / 'pipe.mp4')
+        with pytest.raises(ValueError):
+            collect_video_items(roots(dataset), paths=[str(city_dir / 'pipe.mp4')])
+
+
+def test_missing_file(dataset):
+    with pytest.raises(ValueError):
+        collect_video_items(roots(dataset), root=str(dataset / 'allowed'), paths=['亚洲/中国/北京/c.mp4'])
+
+
+def test_relative_path_without_root(dataset):
+    with pytest.raises(ValueError):
+        collect_video_items(roots(dataset), paths=['亚洲/中国/北京/a.mp4'])
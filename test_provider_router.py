@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+测试多提供商路由
+使用桩提供商（返回预设结果或抛出异常的函数），验证候选排序、失败切换和错误归因
+"""
+
+import pytest
+
+from provider_router import ProviderRouter, classify_error
+
+
+CAPABILITIES = {
+    'qwen': {'video': True, 'text': True, 'max_payload_mb': 10, 'cost': 1.0},
+    'gemini': {'video': True, 'text': True, 'max_payload_mb': 20, 'cost': 1.0},
+    'claude': {'video': True, 'text': True, 'max_payload_mb': 30, 'cost': 3.0},
+    'moondream': {'video': False, 'text': False, 'max_payload_mb': 5, 'cost': 0.5},
+}
+
+MB = 1024 * 1024
+
+
+class HTTPError(Exception):
+    """带 status_code 的SDK异常"""
+
+    def __init__(self, status_code, message=''):
+        super().__init__(f"{message}")
+        self.status_code = status_code
+
+
+def make_router(providers=('qwen', 'gemini', 'claude'), **options):
+    return ProviderRouter(list(providers), CAPABILITIES, **options)
+
+
+class StubProviders:
+    """按提供商返回预设结果的桩，记录调用顺序"""
+
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.calls = []
+
+    def __call__(self, provider):
+        self.calls.append(provider)
+        outcome = self.outcomes.get(provider, {'answer': f'{provider} ok'})
+        if isinstance(outcome, Exception):
+            raise outcome
+        return dict(outcome)
+
+
+def test_unknown_provider_rejected():
+    with pytest.raises(ValueError):
+        ProviderRouter(['qwen', 'nope'], CAPABILITIES)
+
+
+def test_candidates_follow_config_order_and_capability():
+    router = make_router(('moondream', 'qwen', 'gemini'))
+
+    assert router.candidates('video') == ['qwen', 'gemini']
+    assert router.candidates('image') == ['moondream', 'qwen', 'gemini']
+
+
+def test_candidates_prefer_providers_that_fit_payload():
+    router = make_router()
+
+    # 12MB 的视频Base64后超过通义千问的10MB上限，但不超过Gemini的20MB
+    assert router.candidates('video', payload_bytes=12 * MB) == ['gemini', 'claude', 'qwen']
+    assert router.candidates('video', payload_bytes=1 * MB) == ['qwen', 'gemini', 'claude']
+
+
+def test_candidates_prefer_lower_latency_then_cost():
+    router = make_router()
+    router.record_success('qwen', 'video', 9.0)
+    router.record_success('gemini', 'video', 2.0)
+
+    # claude 没有延迟数据，按已观测提供商的平均p50（5.5秒）计
+    assert router.candidates('video') == ['gemini', 'claude', 'qwen']
+
+
+def test_degraded_provider_goes_last():
+    router = make_router(failure_threshold=2, cooldown_seconds=60)
+    router.record_failure('qwen', 'video', 'HTTP 503')
+    assert router.candidates('video')[0] == 'qwen'
+
+    router.record_failure('qwen', 'video', 'HTTP 503')
+    assert router.candidates('video') == ['gemini', 'claude', 'qwen']
+    # 降级只影响该类请求
+    assert router.candidates('text')[0] == 'qwen'
+
+    router.record_success('qwen', 'video', 1.0)
+    assert router.get_status()['qwen']['health']['video']['degraded'] is False
+
+
+def test_route_returns_first_success():
+    router = make_router()
+    stub = StubProviders({})
+
+    result = router.route('video', stub)
+
+    assert stub.calls == ['qwen']
+    assert result['provider'] == 'qwen'
+    assert router.get_status()['qwen']['health']['video']['successes'] == 1
+
+
+def test_route_fails_over_on_provider_errors():
+    router = make_router()
+    stub = StubProviders({
+        'qwen': HTTPError(503, 'Service Unavailable'),
+        'gemini': {'answer': '', 'error': '429 Too Many Requests'},
+    })
+
+    result = router.route('video', stub)
+
+    assert stub.calls == ['qwen', 'gemini', 'claude']
+    assert result['provider'] == 'claude'
+    health = router.get_status()
+    assert health['qwen']['health']['video']['failures'] == 1
+    assert health['gemini']['health']['video']['failures'] == 1
+
+
+def test_route_skips_unavailable_provider():
+    router = make_router()
+    stub = StubProviders({})
+
+    result = router.route('video', stub, is_available=lambda provider: provider != 'qwen')
+
+    assert stub.calls == ['gemini']
+    assert result['provider'] == 'gemini'
+    assert router.get_status()['qwen']['health']['video']['failures'] == 1
+
+
+def test_route_does_not_fail_over_on_request_errors():
+    router = make_router()
+    stub = StubProviders({'qwen': HTTPError(400, 'InvalidParameter: video file is corrupt')})
+
+    result = router.route('video', stub)
+
+    # 视频本身无效：不再发送给其他提供商，也不计入提供商的失败次数
+    assert stub.calls == ['qwen']
+    assert 'corrupt' in result['error']
+    assert 'provider' not in result
+    health = router.get_status()['qwen']['health']['video']
+    assert (health['failures'], health['consecutive_failures'], health['successes']) == (0, 0, 0)
+
+
+def test_route_all_providers_fail():
+    router = make_router()
+    stub = StubProviders({provider: ConnectionError('Connection aborted') for provider in CAPABILITIES})
+
+    result = router.route('video', stub)
+
+    assert stub.calls == ['qwen', 'gemini', 'claude']
+    assert result['error'] == 'Connection aborted'
+
+
+def test_route_without_candidates():
+    router = make_router(('moondream',))
+
+    assert router.route('video', StubProviders({}))['error'] == '没有可用的模型提供商'
+
+
+@pytest.mark.parametrize('error, expected', [
+    (HTTPError(400, 'bad'), 'request'),
+    (HTTPError(422, 'unprocessable'), 'request'),
+    (HTTPError(413, 'payload too large'), 'provider'),
+    (HTTPError(429, 'slow down'), 'provider'),
+    (HTTPError(502, 'bad gateway'), 'provider'),
+    (TimeoutError(), 'provider'),
+    (ConnectionError('Connection reset by peer'), 'provider'),
+    ('400 InvalidParameter: The video format is not supported', 'request'),
+    ('DataInspectionFailed: Input data may contain inappropriate content', 'request'),
+    ('Invalid data found when processing input', 'request'),
+    ('API内部算法错误: InternalError.Algo', 'provider'),
+    ('Throttling.RateQuota: Requests rate limit exceeded', 'provider'),
+    ('模型未初始化', 'provider'),
+])
+def test_classify_error(error, expected):
+    assert classify_error(error) == expected
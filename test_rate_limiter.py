@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+测试请求限流器
+令牌桶、自适应限流控制器（AIMD）和API Key池使用可手动推进的时钟，结果与运行速度无关
+"""
+
+import asyncio
+
+import pytest
+
+from rate_limiter import AdaptiveRateController, ApiKeyPool, TokenBucket, is_rate_limit_error, is_timeout_error
+
+
+class FakeClock:
+    """手动推进的单调时钟"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def make_controller(clock, **options):
+    options.setdefault('max_concurrency', 4)
+    return AdaptiveRateController(options.pop('rate', 2.0), options.pop('burst', 1), clock=clock, **options)
+
+
+def test_is_rate_limit_error():
+    assert is_rate_limit_error(Exception('HTTP 429 Too Many Requests'))
+    assert is_rate_limit_error('Quota exceeded')
+    assert not is_rate_limit_error(ValueError('invalid video'))
+
+
+def test_bucket_burst_then_fair_queue(clock):
+    bucket = TokenBucket(rate=2.0, burst=3, clock=clock)
+
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    # 令牌耗尽后按预约顺序排队，每个调用者的等待时间依次增加一个令牌周期
+    assert [bucket.reserve() for _ in range(3)] == [0.5, 1.0, 1.5]
+
+
+def test_bucket_refill_is_capped_at_burst(clock):
+    bucket = TokenBucket(rate=2.0, burst=2, clock=clock)
+    bucket.reserve()
+    bucket.reserve()
+
+    clock.advance(0.5)
+    assert bucket.get_state()['available_tokens'] == 1.0
+    clock.advance(100)
+    assert bucket.get_state()['available_tokens'] == 2.0
+
+
+def test_bucket_refund_and_drain(clock):
+    bucket = TokenBucket(rate=1.0, burst=2, clock=clock)
+    bucket.reserve()
+    bucket.refund()
+    assert bucket.get_state()['available_tokens'] == 2.0
+    # 退还不会超过桶容量
+    bucket.refund()
+    assert bucket.get_state()['available_tokens'] == 2.0
+
+    bucket.drain()
+    assert bucket.reserve() == 1.0
+
+
+def test_bucket_rejects_invalid_rate(clock):
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0, clock=clock)
+    with pytest.raises(ValueError):
+        TokenBucket(rate=1.0, clock=clock).set_rate(-1)
+
+
+def test_bucket_async_cancel_refunds_token(clock):
+    bucket = TokenBucket(rate=0.1, burst=1, clock=clock)
+    bucket.reserve()
+
+    async def cancel_waiter():
+        task = asyncio.ensure_future(bucket.acquire_async())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_waiter())
+    # 被取消的调用者退还了预约的令牌，下一个调用者不用为它多等一个周期
+    assert bucket.reserve() == 10.0
+
+
+def test_controller_additive_increase(clock):
+    controller = make_controller(clock, rate=2.0, rate_step=0.5, initial_concurrency=2)
+
+    controller.acquire()
+    controller.release(latency=1.0)
+
+    assert controller.bucket.rate == 2.5
+    assert controller.concurrency_limit == 2.5
+    assert controller.success_count == 1
+    assert controller.in_flight == 0
+
+
+def test_controller_increase_respects_limits(clock):
+    controller = make_controller(clock, rate=2.0, max_rate=2.2, rate_step=0.5, max_concurrency=2)
+
+    for _ in range(5):
+        controller.acquire()
+        controller.release(latency=1.0)
+        clock.advance(1.0)
+
+    assert controller.bucket.rate == 2.2
+    assert controller.concurrency_limit == 2
+
+
+def test_controller_multiplicative_decrease_once_per_cooldown(clock):
+    controller = make_controller(clock, rate=4.0, min_rate=0.5, max_concurrency=8)
+
+    controller.acquire()
+    controller.release(throttled=True)
+    assert controller.bucket.rate == 2.0
+    assert controller.concurrency_limit == 4
+    # 降速后清空令牌，下一次请求至少等待一个令牌周期
+    assert controller.bucket.get_state()['available_tokens'] <= 0
+
+    # 同一冷却周期内的其他拥塞信号不再降低
+    controller._try_acquire_slot()
+    controller.release(throttled=True)
+    assert controller.bucket.rate == 2.0
+    assert controller.throttle_count == 2
+
+    clock.advance(1.0)
+    controller._try_acquire_slot()
+    controller.release(throttled=True)
+    assert controller.bucket.rate == 1.0
+    assert controller.concurrency_limit == 2
+
+    clock.advance(10.0)
+    controller._try_acquire_slot()
+    controller.release(throttled=True)
+    assert controller.bucket.rate == 0.5
+    assert controller.concurrency_limit == 1
+
+
+def test_controller_slot_limit(clock):
+    controller = make_controller(clock, max_concurrency=2)
+
+    assert controller._try_acquire_slot()
+    assert controller._try_acquire_slot()
+    assert not controller._try_acquire_slot()
+    controller.release(latency=1.0)
+    assert controller._try_acquire_slot()
+
+
+def test_controller_async_cancel_while_waiting_for_slot(clock):
+    controller = make_controller(clock, max_concurrency=1)
+    assert controller._try_acquire_slot()
+
+    async def cancel_waiter():
+        task = asyncio.ensure_future(controller.acquire_async(poll_interval=0.01))
+        await asyncio.sleep(0.03)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_waiter())
+    assert controller.in_flight == 1
+
+
+def test_controller_async_cancel_while_waiting_for_token(clock):
+    controller = make_controller(clock, rate=0.1, max_concurrency=2)
+    controller.bucket.reserve()
+
+    async def cancel_waiter():
+        task = asyncio.ensure_future(controller.acquire_async())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_waiter())
+    assert controller.in_flight == 0
+    assert controller.bucket.reserve() == 10.0
+
+
+def make_pool(clock, keys=('key-a', 'key-b'), cooldown=60, **options):
+    return ApiKeyPool(list(keys), lambda: make_controller(clock, **options), cooldown, clock=clock)
+
+
+def test_pool_spreads_requests_across_keys(clock):
+    pool = make_pool(clock, burst=4)
+
+    first, _ = pool.acquire()
+    second, _ = pool.acquire()
+
+    assert {first.api_key, second.api_key} == {'key-a', 'key-b'}
+    assert pool.get_state()['in_flight'] == 2
+
+
+def test_pool_throttled_key_cools_down(clock):
+    pool = make_pool(clock, cooldown=60)
+
+    key, _ = pool.acquire()
+    pool.release(key, throttled=True)
+    other, _ = pool.acquire()
+    pool.release(other, latency=1.0)
+    assert other.api_key != key.api_key
+
+    state = pool.get_state()
+    assert state['available_keys'] == 1
+    clock.advance(61)
+    assert pool.get_state()['available_keys'] == 2
+
+
+def test_pool_cooldown_doubles_and_resets(clock):
+    pool = make_pool(clock, keys=['only'], cooldown=10)
+
+    for expected in (10, 20, 40, 80, 80):
+        key, wait_time = pool.acquire()
+        assert wait_time == 0.0
+        pool.release(key, throttled=True)
+        assert key.cooldown_until - clock() == expected
+        clock.advance(5.0)
+
+    # 所有Key都在冷却时仍使用最早结束冷却的Key
+    key, _ = pool.acquire()
+    pool.release(key, latency=1.0)
+    assert key.consecutive_throttles == 0
+    assert (key.requests, key.successes, key.throttles) == (6, 1, 5)
+
+
+def test_pool_failure_counts(clock):
+    pool = make_pool(clock, keys=['only'])
+
+    key, _ = pool.acquire()
+    pool.release(key)
+
+    assert (key.failures, key.pending, key.controller.in_flight) == (1, 0, 0)
+
+
+def test_pool_async_cancel_unselects_key(clock):
+    pool = make_pool(clock, keys=['only'], rate=0.1)
+    pool._keys[0].controller.bucket.reserve()
+
+    async def cancel_waiter():
+        task = asyncio.ensure_future(pool.acquire_async())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_waiter())
+    key = pool._keys[0]
+    assert (key.pending, key.controller.in_flight) == (0, 0)
+
+
+def test_is_timeout_error():
+    class ReadTimeout(Exception):
+        pass
+
+    assert is_timeout_error(TimeoutError())
+    assert is_timeout_error(ReadTimeout('read'))
+    assert is_timeout_error(Exception('Request timed out'))
+    assert not is_timeout_error(ValueError('invalid video'))
+
+
+def test_controller_latency_is_not_a_congestion_signal(clock):
+    controller = make_controller(clock, rate=2.0, rate_step=0.5)
+
+    # 大视频的请求耗时是小视频的几十倍，不应触发降速
+    for latency in (1.0, 40.0, 2.0, 60.0):
+        controller._try_acquire_slot()
+        controller.release(latency=latency)
+
+    assert controller.bucket.rate == 4.0
+    assert controller.success_count == 4
+
+
+def test_controller_timeout_decreases(clock):
+    controller = make_controller(clock, rate=2.0, max_concurrency=4)
+
+    controller._try_acquire_slot()
+    controller.release(timed_out=True)
+
+    assert controller.bucket.rate == 1.0
+    assert controller.concurrency_limit == 2
+    assert controller.timeout_count == 1
+
+
+def test_pool_timeout_does_not_cool_down_key(clock):
+    pool = make_pool(clock, keys=['only'], rate=2.0)
+
+    key, _ = pool.acquire()
+    pool.release(key, timed_out=True)
+
+    assert key.controller.bucket.rate == 1.0
+    assert (key.failures, key.throttles, key.cooldown_until) == (1, 0, 0.0)
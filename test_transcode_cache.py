@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+测试转码结果缓存
+验证按最近最少使用（LRU）淘汰、正在使用的条目不被淘汰、并发请求只转码一次以及重启后恢复LRU顺序
+"""
+
+import os
+import threading
+import time
+
+from transcode_cache import TranscodeCache
+
+
+def produce(tmp_path, name, size=100):
+    """模拟转码产物"""
+    path = tmp_path / f'{name}.tmp'
+    path.write_bytes(b'x' * size)
+    return str(path)
+
+
+def make_cache(tmp_path, max_bytes=250):
+    return TranscodeCache(str(tmp_path / 'cache'), max_bytes=max_bytes)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put('a', produce(tmp_path, 'a'))
+    cache.put('b', produce(tmp_path, 'b'))
+    # 访问 a 后 b 成为最久未使用的条目
+    assert cache.get('a')
+
+    cache.put('c', produce(tmp_path, 'c'))
+
+    assert cache.get('b') is None
+    assert cache.get('a') and cache.get('c')
+    stats = cache.get_stats()
+    assert (stats['entries'], stats['evictions']) == (2, 1)
+    assert sorted(os.listdir(cache.cache_dir)) == ['a.mp4', 'c.mp4']
+
+
+def test_pinned_entry_survives_eviction(tmp_path):
+    cache = make_cache(tmp_path)
+
+    with cache.use('a', lambda: produce(tmp_path, 'a')) as path:
+        cache.put('b', produce(tmp_path, 'b'))
+        cache.put('c', produce(tmp_path, 'c'))
+        # a 最久未使用，但正在使用中：改为淘汰 b，a 的文件仍可读取
+        assert os.path.exists(path)
+        assert cache.get('b') is None
+        assert cache.get_stats()['pinned'] == 1
+
+    assert cache.get_stats()['pinned'] == 0
+    assert cache.get('a') == path
+
+
+def test_release_runs_deferred_eviction(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=150)
+
+    with cache.use('a', lambda: produce(tmp_path, 'a')) as path:
+        # 唯一可淘汰的 a 正在使用中，暂时超出预算
+        cache.put('b', produce(tmp_path, 'b'))
+        assert os.path.exists(path)
+        assert cache.get_stats()['entries'] == 2
+
+    assert not os.path.exists(path)
+    assert cache.get('a') is None
+    assert cache.get('b')
+
+
+def test_pins_are_reference_counted(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=150)
+    cache.put('a', produce(tmp_path, 'a'))
+
+    path = cache.get('a', pin=True)
+    assert cache.get('a', pin=True) == path
+    cache.put('b', produce(tmp_path, 'b'))
+
+    cache.release('a')
+    assert os.path.exists(path)
+    cache.release('a')
+    assert not os.path.exists(path)
+    assert cache.get('b')
+
+
+def test_failed_producer_is_not_pinned(tmp_path):
+    cache = make_cache(tmp_path)
+
+    with cache.use('a', lambda: None) as path:
+        assert path is None
+
+    assert cache.get_stats()['pinned'] == 0
+    assert cache.get_stats()['misses'] == 1
+
+
+def test_concurrent_requests_transcode_once(tmp_path):
+    cache = make_cache(tmp_path)
+    calls = []
+    results = []
+
+    def producer():
+        calls.append(1)
+        time.sleep(0.05)
+        return produce(tmp_path, 'a')
+
+    def worker():
+        with cache.use('a', producer) as path:
+            results.append(path)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(set(results)) == 1
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['misses'], stats['pinned']) == (3, 1, 0)
+
+
+def test_restores_lru_order_after_restart(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put('a', produce(tmp_path, 'a'))
+    cache.put('b', produce(tmp_path, 'b'))
+    now = time.time()
+    os.utime(cache._path('a'), (now, now))
+    os.utime(cache._path('b'), (now - 60, now - 60))
+
+    restarted = make_cache(tmp_path)
+    restarted.put('c', produce(tmp_path, 'c'))
+
+    assert restarted.get('b') is None
+    assert restarted.get('a')
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+测试批量上传的流式multipart解析
+使用内存中的请求体，验证请求体不完整、字段过大、字段在文件之后到达等情况
+"""
+
+import io
+import os
+
+import pytest
+
+from upload_stream import MAX_FIELD_SIZE, parse_boundary, stream_multipart
+
+
+BOUNDARY = 'test-boundary'
+
+
+def build_body(parts, closed=True):
+    """构造multipart请求体，parts 为 [(字段名, 值或 (文件名, 内容)), ...]"""
+    body = b''
+    for name, value in parts:
+        body += f'--{BOUNDARY}\r\n'.encode()
+        if isinstance(value, tuple):
+            filename, content = value
+            body += (f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: video/mp4\r\n\r\n').encode('utf-8') + content + b'\r\n'
+        else:
+            body += f'Content-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+    if closed:
+        body += f'--{BOUNDARY}--\r\n'.encode()
+    return body
+
+
+def parse(body, temp_dir, chunk_size=7):
+    """解析请求体，返回 (事件列表, 写入的文件数)；chunk_size 较小以覆盖跨块的边界"""
+    events = []
+    count = stream_multipart(io.BytesIO(body), BOUNDARY.encode(), 'videos', str(temp_dir),
+                             on_field=lambda name, value: events.append(('field', name, value)),
+                             on_file=lambda filename, path: events.append(('file', filename, path)),
+                             chunk_size=chunk_size)
+    return events, count
+
+
+def test_parse_boundary():
+    assert parse_boundary(f'multipart/form-data; boundary={BOUNDARY}') == BOUNDARY.encode()
+    assert parse_boundary('application/json') is None
+    assert parse_boundary(None) is None
+
+
+def test_files_and_fields_in_order(tmp_path):
+    body = build_body([
+        ('question', '描述街景'),
+        ('videos', ('亚洲/中国/北京/a.mp4', b'a' * 100)),
+        ('other', ('ignored.bin', b'x' * 10)),
+        ('videos', ('b.mp4', b'b' * 50)),
+    ])
+    events, count = parse(body, tmp_path)
+
+    assert count == 2
+    assert [event[:2] for event in events] == [('field', 'question'), ('file', '亚洲/中国/北京/a.mp4'), ('file', 'b.mp4')]
+    assert events[0][2] == '描述街景'
+    with open(events[1][2], 'rb') as f:
+        assert f.read() == b'a' * 100
+    with open(events[2][2], 'rb') as f:
+        assert f.read() == b'b' * 50
+    # 其他字段的文件内容直接丢弃，不写入临时目录
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_field_after_files(tmp_path):
+    body = build_body([
+        ('videos', ('a.mp4', b'a' * 20)),
+        ('question', '晚到的问题'),
+    ])
+    events, count = parse(body, tmp_path)
+
+    assert count == 1
+    assert [event[:2] for event in events] == [('file', 'a.mp4'), ('field', 'question')]
+    assert events[1][2] == '晚到的问题'
+
+
+def test_truncated_body_removes_partial_file(tmp_path):
+    body = build_body([('question', 'q'), ('videos', ('a.mp4', b'a' * 1000))], closed=False)
+    # 在文件内容中间断开（客户端断开连接）
+    truncated = body[:body.index(b'a' * 1000) + 500]
+
+    with pytest.raises(ValueError):
+        parse(truncated, tmp_path)
+    assert os.listdir(tmp_path) == []
+
+
+def test_missing_closing_boundary(tmp_path):
+    body = build_body([('videos', ('a.mp4', b'a' * 10))], closed=False)
+
+    with pytest.raises(ValueError):
+        parse(body, tmp_path)
+
+
+def test_oversized_field(tmp_path):
+    body = build_body([('question', 'q' * (MAX_FIELD_SIZE + 1))])
+
+    with pytest.raises(ValueError, match='过大'):
+        parse(body, tmp_path, chunk_size=64 * 1024)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+测试视频预处理工具
+抽帧部分用桩函数代替ffmpeg，验证新帧替换旧帧、失败时保留旧帧，以及均匀取帧的ffmpeg命令；
+增量处理清单验证跳过未变化的视频和清理源视频已删除的输出
+"""
+
+import os
+import subprocess
+
+import pytest
+
+import 视频预处理工具 as preprocess
+
+
+def write_frames(output_dir, count):
+    frames = []
+    for i in range(count):
+        path = os.path.join(output_dir, f'frame_{i + 1:03d}.jpg')
+        with open(path, 'wb') as f:
+            f.write(b'jpg')
+        frames.append(path)
+    return frames
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    processor = preprocess.VideoPreprocessor()
+    monkeypatch.setattr(processor, 'check_ffmpeg', lambda: True)
+    return processor
+
+
+def test_reextract_replaces_old_frames(tmp_path, processor, monkeypatch):
+    output_dir = tmp_path / 'video'
+    output_dir.mkdir()
+    write_frames(str(output_dir), 5)
+    (output_dir / 'notes.txt').write_text('keep')
+
+    monkeypatch.setattr(processor, '_extract_uniform_frames',
+                        lambda input_path, work_dir, frame_count, threads, duration: write_frames(work_dir, 3))
+    frames = processor.extract_key_frames('video.mp4', str(output_dir), frame_count=3)
+
+    assert [os.path.basename(f) for f in frames] == ['frame_001.jpg', 'frame_002.jpg', 'frame_003.jpg']
+    # 上次多出的帧被删除，其他文件和临时目录不残留
+    assert sorted(os.listdir(output_dir)) == ['frame_001.jpg', 'frame_002.jpg', 'frame_003.jpg', 'notes.txt']
+
+
+def test_failed_extraction_keeps_old_frames(tmp_path, processor, monkeypatch):
+    output_dir = tmp_path / 'video'
+    output_dir.mkdir()
+    write_frames(str(output_dir), 2)
+
+    def fail(input_path, work_dir, frame_count, scene_threshold, threads):
+        write_frames(work_dir, 1)
+        raise RuntimeError('ffmpeg crashed')
+
+    monkeypatch.setattr(processor, '_extract_scene_frames', fail)
+
+    assert processor.extract_key_frames('video.mp4', str(output_dir), selection='scene') == []
+    assert sorted(os.listdir(output_dir)) == ['frame_001.jpg', 'frame_002.jpg']
+
+
+def test_uniform_extraction_uses_single_input(tmp_path, processor, monkeypatch):
+    commands = []
+
+    def fake_run(cmd, **kwargs):
+        commands.append(cmd)
+        write_frames(cmd[-1].rsplit(os.sep, 1)[0], 4)
+        return subprocess.CompletedProcess(cmd, 0, '', '')
+
+    monkeypatch.setattr(preprocess.subprocess, 'run', fake_run)
+    frames = processor.extract_key_frames('video.mp4', str(tmp_path / 'video'), frame_count=4, threads=2,
+                                          duration=120.0)
+
+    assert len(frames) == 4
+    cmd = commands[0]
+    assert cmd.count('-i') == 1 and '-ss' not in cmd
+    assert cmd[cmd.index('-vf') + 1] == 'fps=4/120.000'
+    assert cmd[cmd.index('-frames:v') + 1] == '4'
+
+
+def make_source(tmp_path, name, content=b'video'):
+    source = tmp_path / 'input' / name
+    source.parent.mkdir(parents=True, exist_ok=True)
+    source.write_bytes(content)
+    return source
+
+
+def make_output(tmp_path, name):
+    output = tmp_path / 'output' / name
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_bytes(b'compressed')
+    return str(output)
+
+
+def record(manifest, source, output, profile='compress:quality=medium'):
+    manifest.record(source.name, os.stat(source), preprocess.file_sha256(str(source)), profile, output)
+
+
+def test_manifest_skips_unchanged_video(tmp_path):
+    source = make_source(tmp_path, 'a.mp4')
+    output = make_output(tmp_path, 'a.mp4')
+    manifest = preprocess.PreprocessManifest(str(tmp_path / 'output'))
+    record(manifest, source, output)
+    manifest.save()
+
+    reloaded = preprocess.PreprocessManifest(str(tmp_path / 'output'))
+    assert reloaded.is_unchanged('a.mp4', str(source), 'compress:quality=medium', output)
+    # 配置变化或输出被删除时需要重新处理
+    assert not reloaded.is_unchanged('a.mp4', str(source), 'compress:quality=high', output)
+    assert not reloaded.is_unchanged('b.mp4', str(source), 'compress:quality=medium', output)
+    os.unlink(output)
+    assert not reloaded.is_unchanged('a.mp4', str(source), 'compress:quality=medium', output)
+
+
+def test_manifest_compares_hash_when_only_mtime_changed(tmp_path):
+    source = make_source(tmp_path, 'a.mp4', b'video-1')
+    output = make_output(tmp_path, 'a.mp4')
+    manifest = preprocess.PreprocessManifest(str(tmp_path / 'output'))
+    record(manifest, source, output)
+    stat = os.stat(source)
+
+    # 内容相同只是修改时间变化（如复制或touch过）：视为未变化并更新记录的修改时间
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert manifest.is_unchanged('a.mp4', str(source), 'compress:quality=medium', output)
+    assert manifest.entries['a.mp4']['mtime_ns'] == stat.st_mtime_ns + 10 ** 9
+
+    # 大小相同但内容变化
+    source.write_bytes(b'video-2')
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10 ** 9))
+    assert not manifest.is_unchanged('a.mp4', str(source), 'compress:quality=medium', output)
+
+    source.write_bytes(b'longer video')
+    assert not manifest.is_unchanged('a.mp4', str(source), 'compress:quality=medium', output)
+
+
+def test_manifest_prunes_outputs_of_deleted_videos(tmp_path):
+    kept = make_source(tmp_path, 'kept.mp4')
+    deleted = make_source(tmp_path, 'deleted.mp4')
+    frames_dir = tmp_path / 'output' / 'frames'
+    frames_dir.mkdir(parents=True)
+    write_frames(str(frames_dir), 2)
+    manifest = preprocess.PreprocessManifest(str(tmp_path / 'output'))
+    record(manifest, kept, make_output(tmp_path, 'kept.mp4'))
+    record(manifest, deleted, make_output(tmp_path, 'deleted.mp4'))
+    manifest.record('frames.mp4', os.stat(kept), 'sha', 'extract_frames', str(frames_dir))
+
+    assert manifest.prune({'kept.mp4'}) == 2
+
+    assert sorted(manifest.entries) == ['kept.mp4']
+    assert os.listdir(tmp_path / 'output') == ['kept.mp4']
+
+
+def test_manifest_ignores_corrupt_file(tmp_path):
+    (tmp_path / preprocess.MANIFEST_NAME).write_text('{not json')
+
+    assert preprocess.PreprocessManifest(str(tmp_path)).entries == {}
+
+
+def test_process_folder_is_incremental(tmp_path, processor, monkeypatch):
+    processed = []
+
+    def fake_task(task):
+        mode, video_file, output_path, relative_path, options, duration = task
+        processed.append(relative_path)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'wb') as f:
+            f.write(b'compressed')
+        return relative_path, True, 0.0, None, preprocess.file_sha256(video_file)
+
+    monkeypatch.setattr(preprocess, '_process_video_task', fake_task)
+    input_folder, output_folder = str(tmp_path / 'input'), str(tmp_path / 'output')
+    make_source(tmp_path, 'a.mp4')
+    make_source(tmp_path, 'b.mp4')
+
+    summary = processor.process_folder(input_folder, output_folder)
+    assert sorted(processed) == ['a.mp4', 'b.mp4']
+    assert (summary['succeeded'], summary['skipped']) == (2, 0)
+
+    # 重跑：未变化的视频跳过，新增的视频处理，源视频已删除的输出被清理
+    processed.clear()
+    os.unlink(tmp_path / 'input' / 'b.mp4')
+    make_source(tmp_path, 'c.mp4')
+    summary = processor.process_folder(input_folder, output_folder)
+
+    assert processed == ['c.mp4']
+    assert (summary['succeeded'], summary['skipped'], summary['pruned']) == (1, 1, 1)
+    assert sorted(os.listdir(output_folder)) == [preprocess.MANIFEST_NAME, 'a.mp4', 'c.mp4']
@@ -0,0 +1,190 @@
+"""
+转码结果缓存
+以源视频内容哈希 + 压缩配置为键，把压缩后的视频保存在 TEMP_DIR 下，
+同一个视频按同一配置最多只转码一次；总大小超过预算时按最近最少使用（LRU）淘汰，
+正在使用（use）的条目不会被淘汰
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class TranscodeCache:
+    """磁盘上的转码结果缓存，条目为 <key>.mp4 文件"""
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = None  # key -> 文件大小，按访问顺序排列（最久未访问在前）
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._pins = {}  # key -> 正在使用该条目的请求数，引用计数大于0的条目不会被淘汰
+
+    def _load(self):
+        """首次使用时扫描缓存目录，按文件修改时间恢复LRU顺序（调用方需持有锁）"""
+        if self._entries is not None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.mp4') and os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name[:-4], stat.st_size))
+        self._entries = OrderedDict()
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+        self._total_bytes = sum(self._entries.values())
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp4")
+
+    @staticmethod
+    def make_key(source_hash, profile):
+        """由源视频内容哈希和压缩配置生成缓存键"""
+        return hashlib.sha256(f"{source_hash}:{profile}".encode('utf-8')).hexdigest()[:40]
+
+    def _pin(self, key):
+        """增加条目的引用计数（调用方需持有锁）"""
+        self._pins[key] = self._pins.get(key, 0) + 1
+
+    def release(self, key):
+        """释放 get / put / get_or_create 以 pin=True 取得的条目，超出预算时补做被推迟的淘汰"""
+        with self._lock:
+            count = self._pins.get(key, 0) - 1
+            if count > 0:
+                self._pins[key] = count
+                return
+            self._pins.pop(key, None)
+            if self._entries is not None:
+                self._evict()
+
+    def get(self, key, pin=False):
+        """
+        查询缓存，命中返回缓存文件路径并标记为最近使用，未命中返回 None
+
+        Args:
+            pin: 命中时同时增加引用计数，调用 release(key) 前该条目不会被淘汰
+        """
+        with self._lock:
+            self._load()
+            if key not in self._entries:
+                return None
+            path = self._path(key)
+            if not os.path.exists(path):
+                self._total_bytes -= self._entries.pop(key)
+                return None
+            self._entries.move_to_end(key)
+            if pin:
+                self._pin(key)
+        try:
+            now = time.time()
+            os.utime(path, (now, now))  # 持久化访问顺序，重启后仍按LRU淘汰
+        except OSError:
+            pass
+        return path
+
+    def put(self, key, produced_path, pin=False):
+        """把转码产物移动到缓存目录，返回缓存文件路径；pin 同 get"""
+        with self._lock:
+            self._load()
+            path = self._path(key)
+            shutil.move(produced_path, path)
+            size = os.path.getsize(path)
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            if pin:
+                self._pin(key)
+            self._evict(keep=key)
+        return path
+
+    def get_or_create(self, key, producer, pin=False):
+        """
+        命中时直接返回缓存文件；未命中时调用 producer() 转码并写入缓存
+        同一个键的并发请求只会转码一次，其余请求等待并复用结果
+
+        Args:
+            key: 缓存键
+            producer: 无参函数，返回转码产物路径，失败时返回 None
+            pin: 同 get，返回路径时已增加引用计数（转码失败返回 None 时不增加）
+        """
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        try:
+            with key_lock:
+                path = self.get(key, pin=pin)
+                if path:
+                    with self._lock:
+                        self.hits += 1
+                    print(f"✅ 命中转码缓存: {os.path.basename(path)}")
+                    return path
+
+                with self._lock:
+                    self.misses += 1
+                produced_path = producer()
+                if not produced_path or not os.path.exists(produced_path):
+                    return None
+                return self.put(key, produced_path, pin=pin)
+        finally:
+            # 结果已写入缓存（或转码失败），之后的请求直接查询缓存
+            with self._lock:
+                if self._key_locks.get(key) is key_lock:
+                    del self._key_locks[key]
+
+    @contextmanager
+    def use(self, key, producer):
+        """
+        get_or_create 的上下文管理器形式：产出缓存文件路径（转码失败时为 None），
+        退出前该条目不会被其他请求的 put 淘汰或删除
+        """
+        path = self.get_or_create(key, producer, pin=True)
+        try:
+            yield path
+        finally:
+            if path:
+                self.release(key)
+
+    def _evict(self, keep=None):
+        """超出字节预算时删除最久未使用、且没有请求正在使用的条目（调用方需持有锁）"""
+        for key in list(self._entries.keys()):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if key == keep or key in self._pins:
+                continue
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                # 文件可能正在被其他请求读取（Windows下无法删除），下次再淘汰
+                print(f"⚠️  淘汰转码缓存失败: {e}")
+                continue
+            self._total_bytes -= self._entries.pop(key)
+            self.evictions += 1
+
+    def get_stats(self):
+        with self._lock:
+            self._load()
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'size_mb': round(self._total_bytes / 1024 / 1024, 2),
+                'max_size_mb': round(self.max_bytes / 1024 / 1024, 2),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'pinned': len(self._pins),
+            }
@@ -0,0 +1,96 @@
+"""
+批量上传的流式解析
+不等待整个multipart请求体到达（Flask的 request.files 会先解析完整个请求体）：
+逐块读取请求流，每个文件分段到达时直接写入临时文件，文件写完立即回调入队处理，
+上传和处理同时进行，文件也不再从Werkzeug的临时文件再复制一次
+"""
+
+import os
+import tempfile
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+
+# 每次从请求流读取的字节数
+CHUNK_SIZE = 1024 * 1024
+
+# 普通表单字段（问题、查询参数）的大小上限
+MAX_FIELD_SIZE = 1024 * 1024
+
+
+def parse_boundary(content_type):
+    """从Content-Type中取出multipart边界，不是 multipart/form-data 时返回 None"""
+    mimetype, options = parse_options_header(content_type or '')
+    if mimetype != 'multipart/form-data' or not options.get('boundary'):
+        return None
+    return options['boundary'].encode('latin-1')
+
+
+def stream_multipart(stream, boundary, file_field, temp_dir, on_field, on_file, chunk_size=CHUNK_SIZE):
+    """
+    流式解析multipart请求体
+
+    Args:
+        stream: 请求体流（request.stream）
+        boundary: multipart边界（parse_boundary 的返回值）
+        file_field: 视频文件的字段名，其他字段的文件内容直接丢弃
+        temp_dir: 临时文件目录
+        on_field: 普通字段解析完成时调用 on_field(name, value)
+        on_file: 文件写入完成时调用 on_file(filename, path)，之后由调用方负责删除临时文件
+        chunk_size: 每次读取的字节数
+
+    Returns:
+        int: 写入的文件数
+
+    请求体不完整（如客户端断开）或普通字段过大时抛出 ValueError，正在写入的临时文件会被删除
+    """
+    decoder = MultipartDecoder(boundary)
+    file_count = 0
+    field = None  # 正在接收的普通字段: (name, bytearray)
+    upload = None  # 正在接收的文件: (filename, 文件对象)
+    finished = False  # 请求流已读完
+
+    try:
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                if finished:
+                    raise ValueError('上传数据不完整')
+                chunk = stream.read(chunk_size)
+                finished = not chunk
+                decoder.receive_data(chunk or None)
+            elif isinstance(event, File):
+                if event.name == file_field and event.filename:
+                    tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4', dir=temp_dir)
+                    upload = (event.filename, tmp_file)
+            elif isinstance(event, Field):
+                field = (event.name, bytearray())
+            elif isinstance(event, Data):
+                if upload is not None:
+                    filename, tmp_file = upload
+                    tmp_file.write(event.data)
+                    if not event.more_data:
+                        tmp_file.close()
+                        upload = None
+                        file_count += 1
+                        on_file(filename, tmp_file.name)
+                elif field is not None:
+                    name, value = field
+                    value.extend(event.data)
+                    if len(value) > MAX_FIELD_SIZE:
+                        raise ValueError(f'表单字段 {name} 过大')
+                    if not event.more_data:
+                        field = None
+                        on_field(name, value.decode('utf-8', errors='replace'))
+            elif isinstance(event, Epilogue):
+                return file_count
+    finally:
+        if upload is not None:
+            # 文件未接收完整（出错或客户端断开），删除不完整的临时文件
+            _, tmp_file = upload
+            tmp_file.close()
+            try:
+                os.unlink(tmp_file.name)
+            except OSError:
+                pass
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 视频批量处理脚本
-用于处理大量视频文件，自动分批上传到API
+用于处理大量视频文件：视频目录在服务器允许读取的目录（INGEST_ALLOWED_ROOTS）下时，
+一次提交全部视频路径由服务器原地读取；否则自动分批上传到API
 """
 
 import os
@@ -9,39 +10,41 @@ import requests
 import time
 import json
 import pandas as pd
-from pathlib import Path
+from dataset_catalog import DatasetCatalog, parse_dataset_path
 
 class VideoBatchProcessor:
-    def __init__(self, api_url="http://localhost:5000", max_files_per_batch=5):
+    def __init__(self, api_url="http://localhost:5000", max_files_per_batch=5, catalog_path=None,
+                 use_server_paths=True, probe_metadata=False):
         self.api_url = api_url
         self.max_files_per_batch = max_files_per_batch
+        # 优先提交服务器路径（不上传文件），服务器未允许该目录时改为分批上传
+        self.use_server_paths = use_server_paths
         self.results = []
+        # 数据集元数据目录：扫描一次后增量更新，城市信息直接从目录读取
+        self.catalog = DatasetCatalog(catalog_path or os.getenv("DATASET_CATALOG_PATH", "dataset_catalog.db"))
+        # 默认只建立文件列表，不在客户端对每个视频调用ffprobe（压缩前由服务器获取视频信息）
+        self.probe_metadata = probe_metadata
     
     def get_video_files(self, folder_path):
-        """获取文件夹中的所有视频文件"""
-        video_extensions = ['.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v']
-        video_files = []
-        
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                if any(file.lower().endswith(ext) for ext in video_extensions):
-                    video_files.append(os.path.join(root, file))
-        
-        return video_files
+        """获取文件夹中的所有视频文件（增量更新数据集目录后从目录读取）"""
+        self.catalog.refresh(folder_path, probe=self.probe_metadata)
+        return [record['path'] for record in self.catalog.list_videos(root=folder_path)]
+    
+    def get_location(self, video_path):
+        """获取视频的 大洲/国家/城市 信息（优先使用数据集目录中的记录）"""
+        record = self.catalog.get(video_path) if video_path and os.path.isabs(video_path) else None
+        if record:
+            record['location'] = f"{record['continent']}/{record['country']}/{record['city_dir']}" if record['city_dir'] else ''
+            return record
+        return parse_dataset_path(video_path)
     
     def group_videos_by_city(self, video_files):
         """按城市分组视频文件"""
         city_groups = {}
         
         for video_path in video_files:
-            # 从文件路径中提取城市信息
-            # 假设路径格式为：.../大洲/国家/城市/视频名.mp4
-            path_parts = video_path.split(os.sep)
-            city_name = '未知城市'
-            
-            # 尝试从路径中提取城市名（通常是倒数第二个部分）
-            if len(path_parts) >= 3:
-                city_name = path_parts[-2]
+            # 从数据集目录（路径格式：.../大洲/国家/城市/视频名.mp4）获取城市信息
+            city_name = self.get_location(video_path)['city']
             
             if city_name not in city_groups:
                 city_groups[city_name] = []
@@ -66,13 +69,21 @@ class VideoBatchProcessor:
             response = requests.post(f"{self.api_url}/api/video-batch-query", 
                                    files=files, data=data, timeout=1800)  # 30分钟超时
             
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('success'):
+            if response.status_code in (200, 202):
+                submitted = response.json()
+                if not submitted.get('success'):
+                    print(f"❌ 批次提交失败: {submitted.get('error')}")
+                    return None
+                
+                # 后端立即返回任务ID，轮询直到任务完成
+                result = self.wait_for_job(submitted['job_id'])
+                if result and result.get('success'):
+                    # 上传时只保留了文件名，按文件名找回本地源文件路径
+                    self.attach_source_paths(result.get('results', []), video_files)
                     print(f"✅ 批次处理成功，处理了 {len(result.get('results', []))} 个视频")
                     return result
                 else:
-                    print(f"❌ 批次处理失败: {result.get('error')}")
+                    print(f"❌ 批次处理失败: {result.get('error') if result else '查询任务失败'}")
                     return None
             else:
                 print(f"❌ HTTP错误: {response.status_code}")
@@ -89,6 +100,75 @@ class VideoBatchProcessor:
                 except Exception as e:
                     print(f"⚠️  关闭文件失败: {e}")
     
+    def process_server_paths(self, video_files, prompt):
+        """
+        提交服务器路径批量任务（视频由服务器原地读取，不上传）
+
+        Returns:
+            dict: 任务结果；服务器未配置或不允许读取这些路径时返回 None（调用方改为上传）
+        """
+        paths = [os.path.abspath(video_path) for video_path in video_files]
+        print(f"正在提交 {len(paths)} 个视频的服务器路径...")
+        try:
+            response = requests.post(f"{self.api_url}/api/video-batch-paths",
+                                     json={'question': prompt, 'paths': paths}, timeout=300)
+        except Exception as e:
+            print(f"❌ 请求异常: {e}")
+            return None
+        
+        submitted = response.json() if response.headers.get('Content-Type', '').startswith('application/json') else {}
+        if response.status_code != 202 or not submitted.get('success'):
+            print(f"⚠️  服务器路径提交失败: {submitted.get('error') or f'HTTP {response.status_code}'}")
+            return None
+        
+        print(f"✅ 已提交任务 {submitted['job_id']}，共 {submitted['total_files']} 个视频")
+        result = self.wait_for_job(submitted['job_id'])
+        if result is None:
+            # 任务已在服务器上处理，不再改为上传（避免重复处理）
+            print(f"❌ 获取任务 {submitted['job_id']} 结果失败")
+            return {'success': False, 'results': []}
+        self.attach_source_paths(result.get('results', []), video_files)
+        return result
+    
+    @staticmethod
+    def attach_source_paths(results, video_files):
+        """
+        按结果中的 filename 找回本地源文件路径，记录为 source_path
+        filename 为上传的文件名，或服务器路径任务中相对允许目录的真实路径；
+        服务器会去重、取消的视频没有结果，不能按提交顺序对应
+        """
+        candidates = {}  # 文件名 -> [(本地路径或其真实路径, 本地路径), ...]
+        for video_path in video_files:
+            for path in {os.path.abspath(video_path), os.path.realpath(video_path)}:
+                candidates.setdefault(os.path.basename(path), []).append((path.replace(os.sep, '/'), video_path))
+        
+        matched = set()
+        for video_result in results:
+            filename = video_result.get('filename', '').lstrip('/')
+            for path, video_path in candidates.get(os.path.basename(filename), []):
+                if video_path not in matched and ('/' + path).endswith('/' + filename):
+                    video_result['source_path'] = video_path
+                    matched.add(video_path)
+                    break
+    
+    def wait_for_job(self, job_id, poll_interval=5):
+        """轮询批量任务直到结束（完成或取消），返回任务结果（进度查询不返回结果，结束后再取一次全部结果）"""
+        while True:
+            response = requests.get(f"{self.api_url}/api/batch-status/{job_id}", timeout=60)
+            if response.status_code != 200:
+                print(f"❌ 查询任务 {job_id} 失败: HTTP {response.status_code}")
+                return None
+            
+            status = response.json()['status']
+            if status.get('status') in ('completed', 'cancelled'):
+                response = requests.get(f"{self.api_url}/api/video-batch-jobs/{job_id}", timeout=300)
+                return response.json() if response.status_code == 200 else None
+            
+            eta = status.get('timings', {}).get('eta_seconds')
+            print(f"⏳ 任务 {job_id} 进度: {status.get('completed', 0)}/{status.get('total_files', 0)}"
+                  + (f"，预计剩余 {eta:.0f} 秒" if eta else ''))
+            time.sleep(poll_interval)
+    
     def process_folder(self, folder_path, prompt):
         """处理整个文件夹的视频"""
         video_files = self.get_video_files(folder_path)
@@ -107,8 +187,28 @@ class VideoBatchProcessor:
         all_results = []
         failed_videos = []  # 记录失败视频信息
         
+        upload_cities = cities  # 需要分批上传的城市
+        if self.use_server_paths:
+            # 按城市顺序一次提交全部视频路径，服务器原地读取
+            result = self.process_server_paths([path for city in cities for path in city_groups[city]], prompt)
+            if result is not None:
+                all_results = result.get('results', [])
+                for video_result in all_results:
+                    if not video_result.get('success', False):
+                        city_name = self.get_location(video_result.get('source_path') or video_result.get('filename', ''))['city']
+                        failed_videos.append({
+                            '文件名': video_result.get('filename', ''),
+                            '错误信息': video_result.get('error', '未知错误'),
+                            '城市': city_name,
+                            '批次': f"{city_name}_服务器路径任务",
+                            '处理时间': time.strftime("%Y-%m-%d %H:%M:%S")
+                        })
+                upload_cities = []  # 已全部处理，不再分批上传
+            else:
+                print("⚠️  改为分批上传视频文件")
+        
         # 按城市顺序处理
-        for city_index, city_name in enumerate(cities):
+        for city_index, city_name in enumerate(upload_cities):
             city_files = city_groups[city_name]
             print(f"\n🏙️  开始处理城市【{city_name}】的 {len(city_files)} 个视频")
             
@@ -136,7 +236,7 @@ class VideoBatchProcessor:
                             })
                 
                 # 批次间休息，避免服务器过载
-                if batch_num < total_batches or city_index < len(cities) - 1:
+                if batch_num < total_batches or city_index < len(upload_cities) - 1:
                     print("⏳ 等待5秒后处理下一批...")
                     time.sleep(5)
             
@@ -162,17 +262,10 @@ class VideoBatchProcessor:
         # 按城市分组结果
         city_results = {}
         for result in results:
-            # 从文件名中提取城市信息
-            file_path = result.get('filename', '')
-            path_parts = file_path.split(os.sep)
-            
-            # 提取大洲、国家、城市信息（假设路径格式：.../大洲/国家/城市/视频名.mp4）
-            if len(path_parts) >= 4:
-                continent = path_parts[-4] if len(path_parts) >= 4 else '未知大洲'
-                country = path_parts[-3] if len(path_parts) >= 3 else '未知国家'
-                city = path_parts[-2] if len(path_parts) >= 2 else '未知城市'
-                
-                city_key = f"{continent}/{country}/{city}"
+            # 提取大洲、国家、城市信息（路径格式：.../大洲/国家/城市/视频名.mp4）
+            location = self.get_location(result.get('source_path') or result.get('filename', ''))['location']
+            if location:
+                city_key = location
                 if city_key not in city_results:
                     city_results[city_key] = []
                 city_results[city_key].append(result)
@@ -228,13 +321,12 @@ class VideoBatchProcessor:
         # 从第一个结果中提取路径信息
         if city_results:
             first_result = city_results[0]
-            file_path = first_result.get('filename', '')
-            path_parts = file_path.split(os.sep)
+            location = self.get_location(first_result.get('source_path') or first_result.get('filename', ''))
             
-            # 提取大洲、国家信息（假设路径格式：.../大洲/国家/城市/视频名.mp4）
-            if len(path_parts) >= 4:
-                continent = path_parts[-4] if len(path_parts) >= 4 else '未知大洲'
-                country = path_parts[-3] if len(path_parts) >= 3 else '未知国家'
+            # 提取大洲、国家信息（路径格式：.../大洲/国家/城市/视频名.mp4）
+            if location['location']:
+                continent = location['continent']
+                country = location['country']
                 
                 # 创建对应的文件夹结构
                 city_folder = os.path.join(output_base, continent, country, city_name)
@@ -4,25 +4,170 @@
 用于压缩视频文件，减小文件大小，提高处理效率
 """
 
+import json
 import os
+import re
 import subprocess
 import shutil
-from pathlib import Path
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dataset_catalog import DatasetCatalog, VIDEO_EXTENSIONS, find_video_files
+from response_cache import file_sha256
+
+
+# 并行处理时每个ffmpeg默认使用的线程数（x264 在4线程左右效率较高，再多收益递减）
+DEFAULT_THREADS_PER_JOB = 4
+
+# 增量处理清单文件名（保存在输出文件夹中）
+MANIFEST_NAME = '.preprocess_manifest.json'
+
+
+class PreprocessManifest:
+    """
+    增量处理清单
+    记录每个输入视频的大小、修改时间、内容哈希、输出路径和处理配置，
+    重跑时跳过未变化的视频，并清理源视频已删除的输出
+    """
+
+    def __init__(self, output_folder):
+        self.path = os.path.join(output_folder, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f).get('entries', {})
+            except (OSError, ValueError) as e:
+                print(f"⚠️  读取处理清单失败，将全部重新处理: {e}")
+
+    def is_unchanged(self, relative_path, video_file, profile, output_path):
+        """
+        判断视频是否已按相同配置处理过且源文件未变化
+        大小和修改时间都相同时直接认为未变化；只有修改时间不同时比较内容哈希（如复制或touch过的文件）
+        """
+        entry = self.entries.get(relative_path)
+        if not entry or entry.get('profile') != profile or not os.path.exists(output_path):
+            return False
+
+        stat = os.stat(video_file)
+        if stat.st_size != entry.get('size'):
+            return False
+        if stat.st_mtime_ns == entry.get('mtime_ns'):
+            return True
+        if file_sha256(video_file) == entry.get('sha256'):
+            entry['mtime_ns'] = stat.st_mtime_ns
+            return True
+        return False
+
+    def record(self, relative_path, stat, sha256, profile, output_path):
+        self.entries[relative_path] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': sha256,
+            'profile': profile,
+            'output': output_path,
+            'processed_at': time.time(),
+        }
+
+    def prune(self, existing_paths):
+        """删除源视频已不存在的输出和清单条目，返回清理的数量"""
+        removed = 0
+        for relative_path in [p for p in self.entries if p not in existing_paths]:
+            output_path = self.entries.pop(relative_path).get('output')
+            try:
+                if output_path and os.path.isdir(output_path):
+                    shutil.rmtree(output_path)
+                elif output_path and os.path.exists(output_path):
+                    os.unlink(output_path)
+                print(f"🧹 源视频已删除，清理输出: {relative_path}")
+                removed += 1
+            except OSError as e:
+                print(f"⚠️  清理输出失败: {relative_path}: {e}")
+        return removed
+
+    def save(self):
+        """原子写入清单（先写临时文件再替换）"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'entries': self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def plan_parallelism(workers=None, threads=None):
+    """
+    计算并行进程数和每个ffmpeg的线程数，保证 进程数 × 线程数 不超过CPU核数
+    
+    Returns:
+        (workers, threads)
+    """
+    cpu_count = os.cpu_count() or 1
+    if workers is None:
+        workers = max(1, cpu_count // (threads or DEFAULT_THREADS_PER_JOB))
+    workers = max(1, min(int(workers), cpu_count))
+    if threads is None or workers * threads > cpu_count:
+        if threads is not None:
+            print(f"⚠️  {workers}个进程 × {threads}线程 超过CPU核数({cpu_count})，已调整每个ffmpeg的线程数")
+        threads = max(1, cpu_count // workers)
+    return workers, threads
+
+
+# 每个工作进程（或串行处理时的主进程）共用一个预处理器，ffmpeg可用性只检查一次
+_worker_processor = None
+
+
+def _init_worker():
+    """进程池初始化函数：为当前进程创建预处理器"""
+    global _worker_processor
+    _worker_processor = VideoPreprocessor()
+
+
+def _process_video_task(task):
+    """
+    处理单个视频（在进程池中执行）
+    
+    Returns:
+        (相对路径, 是否成功, 耗时秒数, 错误信息, 源视频内容哈希)
+    """
+    mode, video_file, output_path, relative_path, options, duration = task
+    start_time = time.time()
+    if _worker_processor is None:
+        _init_worker()
+    processor = _worker_processor
+    try:
+        if mode == 'compress':
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            success = processor.compress_video(video_file, output_path, options['quality'], options['threads'])
+        else:
+            frames = processor.extract_key_frames(video_file, output_path, options['frame_count'],
+                                                  options['frame_selection'], threads=options['threads'],
+                                                  duration=duration)
+            success = bool(frames)
+        error = None if success else '处理失败'
+        # 成功时计算源视频哈希，写入增量处理清单
+        sha256 = file_sha256(video_file) if success and options.get('incremental') else None
+    except Exception as e:
+        success, error, sha256 = False, str(e), None
+    return relative_path, success, time.time() - start_time, error, sha256
+
 
 class VideoPreprocessor:
     def __init__(self):
-        self.supported_formats = ['.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v']
+        self.supported_formats = list(VIDEO_EXTENSIONS)
+        self._ffmpeg_available = None
     
     def check_ffmpeg(self):
-        """检查FFmpeg是否安装"""
-        try:
-            subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
-            return True
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            return False
+        """检查FFmpeg是否安装（结果缓存，批量处理时不再为每个视频启动一次ffmpeg）"""
+        if self._ffmpeg_available is None:
+            try:
+                subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
+                self._ffmpeg_available = True
+            except (subprocess.CalledProcessError, FileNotFoundError):
+                self._ffmpeg_available = False
+        return self._ffmpeg_available
     
-    def compress_video(self, input_path, output_path, quality='medium'):
-        """压缩视频文件"""
+    def compress_video(self, input_path, output_path, quality='medium', threads=None):
+        """压缩视频文件（threads 限制ffmpeg使用的线程数，并行处理时避免抢占CPU）"""
         if not self.check_ffmpeg():
             print("❌ 未找到FFmpeg，请先安装FFmpeg")
             return False
@@ -39,7 +184,9 @@ class VideoPreprocessor:
             '-c:v', 'libx264',
             '-c:a', 'aac',
             '-movflags', '+faststart'
-        ] + quality_settings.get(quality, quality_settings['medium']) + [
+        ] + quality_settings.get(quality, quality_settings['medium']) + (
+            ['-threads', str(threads)] if threads else []
+        ) + [
             '-y',  # 覆盖输出文件
             output_path
         ]
@@ -66,86 +213,255 @@ class VideoPreprocessor:
             print(f"❌ 压缩异常: {e}")
             return False
     
-    def extract_key_frames(self, input_path, output_dir, frame_count=10):
-        """提取关键帧"""
+    def extract_key_frames(self, input_path, output_dir, frame_count=10, selection='uniform', scene_threshold=0.3,
+                           threads=None, duration=None):
+        """
+        提取关键帧（一次ffmpeg调用完成）
+        
+        帧先写入 output_dir 下新建的临时目录，成功后替换 output_dir 中原有的 frame_*.jpg，
+        重新抽帧（如帧数变少）时不会残留上次的帧，抽帧失败时保留原有的帧
+        
+        Args:
+            selection: 'uniform' 按时长均匀取帧：单个输入经 fps 滤镜每隔 时长/frame_count 输出一帧；
+                       'scene' 场景切换检测：一次解码选出第一帧和场景切换帧，超出 frame_count 时均匀挑选
+            scene_threshold: 场景切换阈值（0-1，越小越敏感）
+            threads: 限制ffmpeg使用的线程数
+            duration: 已知的视频时长（来自数据集目录），提供时不再调用ffprobe
+        """
         if not self.check_ffmpeg():
             print("❌ 未找到FFmpeg，请先安装FFmpeg")
             return []
         
         os.makedirs(output_dir, exist_ok=True)
-        
-        # 获取视频时长
-        cmd = [
-            'ffprobe', '-v', 'quiet', '-show_entries', 'format=duration',
-            '-of', 'csv=p=0', input_path
-        ]
+        work_dir = tempfile.mkdtemp(prefix='.extract-', dir=output_dir)
         
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            duration = float(result.stdout.strip())
-            
-            # 计算提取间隔
-            interval = duration / frame_count
+            if selection == 'scene':
+                frames = self._extract_scene_frames(input_path, work_dir, frame_count, scene_threshold, threads)
+            else:
+                frames = self._extract_uniform_frames(input_path, work_dir, frame_count, threads, duration)
+            if not frames:
+                return []
             
+            # 新的帧全部生成后再替换原有的帧
+            for name in os.listdir(output_dir):
+                if name.startswith('frame_') and name.endswith('.jpg'):
+                    os.unlink(os.path.join(output_dir, name))
             extracted_frames = []
-            for i in range(frame_count):
-                timestamp = i * interval
-                output_file = os.path.join(output_dir, f"frame_{i+1:03d}.jpg")
-                
-                cmd = [
-                    'ffmpeg', '-i', input_path,
-                    '-ss', str(timestamp),
-                    '-vframes', '1',
-                    '-q:v', '2',
-                    '-y',
-                    output_file
-                ]
-                
-                result = subprocess.run(cmd, capture_output=True)
-                if result.returncode == 0:
-                    extracted_frames.append(output_file)
-                    print(f"✅ 提取帧 {i+1}/{frame_count}: {os.path.basename(output_file)}")
-            
+            for frame in frames:
+                output_file = os.path.join(output_dir, os.path.basename(frame))
+                os.replace(frame, output_file)
+                extracted_frames.append(output_file)
             return extracted_frames
             
         except Exception as e:
             print(f"❌ 提取帧失败: {e}")
             return []
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    def _extract_uniform_frames(self, input_path, output_dir, frame_count, threads=None, duration=None):
+        """单个输入一次解码，fps 滤镜按 frame_count/时长 的帧率均匀输出 frame_count 帧"""
+        # 获取视频时长
+        if not duration:
+            cmd = [
+                'ffprobe', '-v', 'quiet', '-show_entries', 'format=duration',
+                '-of', 'csv=p=0', input_path
+            ]
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            duration = float(result.stdout.strip())
+        
+        cmd = ['ffmpeg', '-hide_banner', '-nostdin']
+        if threads:
+            cmd += ['-threads', str(threads), '-filter_threads', str(threads)]
+        cmd += [
+            '-i', input_path,
+            # 第 i 帧取 i × 时长/frame_count 处的画面（与按间隔定位取帧的时间点相同）
+            '-an', '-vf', f"fps={frame_count}/{duration:.3f}",
+            '-frames:v', str(frame_count), '-q:v', '2', '-y',
+            os.path.join(output_dir, 'frame_%03d.jpg')
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"❌ 提取帧失败: {result.stderr[-500:]}")
+        
+        extracted_frames = sorted(os.path.join(output_dir, f) for f in os.listdir(output_dir)
+                                  if f.startswith('frame_'))
+        print(f"✅ 提取帧 {len(extracted_frames)}/{frame_count}: {os.path.basename(input_path)}")
+        return extracted_frames
+    
+    def _extract_scene_frames(self, input_path, output_dir, frame_count, scene_threshold, threads=None):
+        """一次解码选出第一帧和场景切换帧，均匀保留 frame_count 帧"""
+        cmd = ['ffmpeg', '-hide_banner', '-nostdin']
+        if threads:
+            cmd += ['-threads', str(threads), '-filter_threads', str(threads)]
+        cmd += [
+            '-i', input_path,
+            '-an', '-vf', f"select='eq(n\\,0)+gt(scene\\,{scene_threshold})',showinfo",
+            '-vsync', 'vfr', '-q:v', '2', '-y',
+            os.path.join(output_dir, 'scene_%05d.jpg')
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"❌ 提取帧失败: {result.stderr[-500:]}")
+            return []
+        
+        timestamps = re.findall(r'pts_time:\s*([\d.]+)', result.stderr)
+        scene_files = sorted(f for f in os.listdir(output_dir) if f.startswith('scene_'))
+        
+        # 场景帧多于 frame_count 时按时间均匀挑选
+        keep = range(len(scene_files))
+        if len(scene_files) > frame_count:
+            step = len(scene_files) / frame_count
+            keep = [int(i * step + step / 2) for i in range(frame_count)]
+        
+        extracted_frames = []
+        for i, index in enumerate(keep):
+            output_file = os.path.join(output_dir, f"frame_{i+1:03d}.jpg")
+            os.replace(os.path.join(output_dir, scene_files[index]), output_file)
+            extracted_frames.append(output_file)
+        for name in os.listdir(output_dir):
+            if name.startswith('scene_'):
+                os.unlink(os.path.join(output_dir, name))
+        
+        times = ', '.join(f"{float(timestamps[index]):.1f}s" for index in keep if index < len(timestamps))
+        print(f"✅ 场景切换帧 {len(extracted_frames)}/{len(scene_files)}: {os.path.basename(input_path)} ({times})")
+        return extracted_frames
     
-    def process_folder(self, input_folder, output_folder, mode='compress', quality='medium'):
-        """处理整个文件夹"""
+    def process_folder(self, input_folder, output_folder, mode='compress', quality='medium',
+                       frame_count=10, frame_selection='uniform', workers=1, threads=None, incremental=True,
+                       catalog_path=None):
+        """
+        处理整个文件夹
+        
+        Args:
+            workers: 并行进程数，1 为逐个处理，None 为按CPU核数自动计算
+            threads: 每个ffmpeg的线程数，None 为按CPU核数和进程数自动计算（进程数 × 线程数 不超过核数）
+            incremental: 使用输出文件夹中的处理清单，只处理新增或变化的视频，并清理源视频已删除的输出
+            catalog_path: 数据集目录数据库路径，提供时从目录获取视频列表和时长（增量刷新），不再逐个ffprobe
+        
+        Returns:
+            dict: 成功/失败/跳过数量、失败文件列表和耗时统计；单个视频失败不影响其余视频
+        """
         if not os.path.exists(input_folder):
             print("❌ 输入文件夹不存在")
             return
+        if mode not in ('compress', 'extract_frames'):
+            print(f"❌ 不支持的处理模式: {mode}")
+            return
         
         os.makedirs(output_folder, exist_ok=True)
         
-        video_files = []
-        for root, dirs, files in os.walk(input_folder):
-            for file in files:
-                if any(file.lower().endswith(ext) for ext in self.supported_formats):
-                    video_files.append(os.path.join(root, file))
+        durations = {}
+        if catalog_path:
+            catalog = DatasetCatalog(catalog_path)
+            # 只有均匀抽帧需要时长，其余模式只刷新文件列表
+            catalog.refresh(input_folder, probe=(mode == 'extract_frames' and frame_selection == 'uniform'))
+            records = catalog.list_videos(root=input_folder)
+            video_files = [record['path'] for record in records]
+            durations = {record['path']: record['duration'] for record in records}
+        else:
+            video_files = find_video_files(input_folder, tuple(self.supported_formats))
         
         print(f"找到 {len(video_files)} 个视频文件")
         
+        # 处理配置标识：配置变化时需要重新处理
         if mode == 'compress':
-            for video_file in video_files:
-                relative_path = os.path.relpath(video_file, input_folder)
+            profile = f"compress:quality={quality}"
+        else:
+            profile = f"extract_frames:count={frame_count}:selection={frame_selection}"
+        
+        manifest = PreprocessManifest(output_folder) if incremental else None
+        summary = {'total': len(video_files), 'succeeded': 0, 'failed': [], 'skipped': 0, 'pruned': 0,
+                   'file_seconds': 0.0}
+        
+        tasks = []
+        stats = {}
+        for video_file in video_files:
+            relative_path = os.path.relpath(video_file, input_folder)
+            if mode == 'compress':
                 output_path = os.path.join(output_folder, relative_path)
-                
-                # 创建输出目录
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-                
-                self.compress_video(video_file, output_path, quality)
+            else:
+                # 每个视频的帧输出到以视频名命名的目录
+                output_path = os.path.join(output_folder, os.path.splitext(relative_path)[0])
+            
+            if manifest and manifest.is_unchanged(relative_path, video_file, profile, output_path):
+                summary['skipped'] += 1
+                continue
+            stats[relative_path] = os.stat(video_file)
+            tasks.append((mode, video_file, output_path, relative_path, None, durations.get(video_file)))
         
-        elif mode == 'extract_frames':
-            for video_file in video_files:
-                relative_path = os.path.relpath(video_file, input_folder)
-                name_without_ext = os.path.splitext(relative_path)[0]
-                frame_dir = os.path.join(output_folder, name_without_ext)
-                
-                print(f"\n处理视频: {relative_path}")
-                self.extract_key_frames(video_file, frame_dir)
+        if manifest:
+            summary['pruned'] = manifest.prune({os.path.relpath(f, input_folder) for f in video_files})
+            print(f"📋 增量处理: {len(tasks)} 个新增或变化，跳过 {summary['skipped']} 个未变化，"
+                  f"清理 {summary['pruned']} 个已删除视频的输出")
+        
+        if workers is None or workers > 1 or threads:
+            workers, threads = plan_parallelism(workers, threads)
+        options = {'quality': quality, 'frame_count': frame_count, 'frame_selection': frame_selection,
+                   'threads': threads, 'incremental': incremental}
+        tasks = [task[:4] + (options,) + task[5:] for task in tasks]
+        outputs = {task[3]: task[2] for task in tasks}
+        
+        if workers > 1 and len(tasks) > 1:
+            print(f"🚀 并行处理: {workers} 个进程，每个ffmpeg {threads} 线程")
+        
+        start_time = time.time()
+        
+        def report(result):
+            relative_path, success, elapsed, error, sha256 = result
+            summary['file_seconds'] += elapsed
+            if success:
+                summary['succeeded'] += 1
+                if manifest:
+                    manifest.record(relative_path, stats[relative_path], sha256, profile, outputs[relative_path])
+            else:
+                summary['failed'].append({'file': relative_path, 'error': error})
+            done = summary['succeeded'] + len(summary['failed'])
+            status = "✅" if success else f"❌ {error}"
+            print(f"[{done}/{len(tasks)}] {status} {relative_path} ({elapsed:.1f}秒)")
+            # 定期保存清单，中断后重跑不会重复处理已完成的视频
+            if manifest and done % 20 == 0:
+                manifest.save()
+        
+        try:
+            if workers > 1 and len(tasks) > 1:
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                    futures = {executor.submit(_process_video_task, task): task for task in tasks}
+                    for future in as_completed(futures):
+                        try:
+                            report(future.result())
+                        except Exception as e:
+                            # 工作进程异常退出，记录后继续处理其余视频
+                            report((futures[future][3], False, 0.0, str(e), None))
+            else:
+                for task in tasks:
+                    if mode == 'extract_frames':
+                        print(f"\n处理视频: {task[3]}")
+                    report(_process_video_task(task))
+        finally:
+            if manifest:
+                manifest.save()
+        
+        summary['wall_seconds'] = time.time() - start_time
+        print(f"\n处理完成: 成功 {summary['succeeded']}/{len(tasks)}，失败 {len(summary['failed'])}，"
+              f"跳过 {summary['skipped']}，总耗时 {summary['wall_seconds']:.1f}秒"
+              f"（单个视频累计 {summary['file_seconds']:.1f}秒）")
+        for failure in summary['failed']:
+            print(f"   ❌ {failure['file']}: {failure['error']}")
+        return summary
+
+def ask_worker_count():
+    """询问并行进程数，直接回车时按CPU核数自动计算"""
+    default_workers, default_threads = plan_parallelism()
+    value = input(f"并行进程数 (回车默认 {default_workers}，每个ffmpeg {default_threads} 线程): ").strip()
+    if not value:
+        return None
+    try:
+        return max(1, int(value))
+    except ValueError:
+        print("⚠️  无效输入，使用默认值")
+        return None
 
 def main():
     """主函数"""
@@ -153,6 +469,8 @@ def main():
     print("=" * 50)
     
     processor = VideoPreprocessor()
+    # 设置 DATASET_CATALOG_PATH 时使用数据集目录获取视频列表和时长
+    catalog_path = os.getenv('DATASET_CATALOG_PATH')
     
     print("选择处理模式:")
     print("1. 压缩视频 (减小文件大小)")
@@ -173,13 +491,24 @@ def main():
         quality_map = {'1': 'low', '2': 'medium', '3': 'high'}
         quality = quality_map.get(quality_choice, 'medium')
         
-        processor.process_folder(input_folder, output_folder, 'compress', quality)
+        workers = ask_worker_count()
+        processor.process_folder(input_folder, output_folder, 'compress', quality, workers=workers,
+                                 catalog_path=catalog_path)
     
     elif choice == '2':
         input_folder = input("请输入视频文件夹路径: ").strip()
         output_folder = input("请输入输出文件夹路径: ").strip()
         
-        processor.process_folder(input_folder, output_folder, 'extract_frames')
+        print("选择取帧方式:")
+        print("1. 均匀取帧 (按时长等间隔)")
+        print("2. 场景切换 (画面变化处取帧)")
+        
+        selection_choice = input("请选择 (1/2): ").strip()
+        frame_selection = 'scene' if selection_choice == '2' else 'uniform'
+        
+        workers = ask_worker_count()
+        processor.process_folder(input_folder, output_folder, 'extract_frames', frame_selection=frame_selection,
+                                 workers=workers, catalog_path=catalog_path)
     
     else:
         print("❌ 无效选择")